@@ -1,6 +1,9 @@
 from .ocr_agent import OCRAgent
+from .nsfw_backends import NSFWBackend, VisionBackend, OnnxBackend, FakeBackend
 from .nsfw_agent import NSFWAgent
 from .toxicity_agent import ToxicityAgent
-from .main_agent import MainAgent
+from .main_agent import MainAgent, SUMMARY_MODES
+from .registry import AgentRegistry
 
-__all__ = ["OCRAgent", "NSFWAgent", "ToxicityAgent", "MainAgent"]
\ No newline at end of file
+__all__ = ["OCRAgent", "NSFWAgent", "ToxicityAgent", "MainAgent", "AgentRegistry", "SUMMARY_MODES",
+           "NSFWBackend", "VisionBackend", "OnnxBackend", "FakeBackend"]
\ No newline at end of file
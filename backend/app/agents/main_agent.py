@@ -1,34 +1,422 @@
-from typing import Dict
 from PIL import Image
 import asyncio
 from . import OCRAgent, NSFWAgent, ToxicityAgent
-from app.helpers import ImagePreprocessor, PromptInjectionDetector
-from typing import Dict, Any
-from groq import Groq
+from app.helpers import ImagePreprocessor, PromptInjectionDetector, ResultCache, NearDuplicateIndex, CACHE_STATUS
+from app.helpers import Scheduler, AdmissionError, LLMGateway, LLMUnavailableError, SingleFlight, stage, record_stage
+from app.helpers import open_image
+from app.helpers.result_cache import MemoryCacheBackend
+from typing import TYPE_CHECKING, Dict, Any, Optional, List, AsyncIterator, Awaitable, Callable, Tuple, Union
+import uuid
 import os
+import time
 import logging
+if TYPE_CHECKING:
+    from groq import AsyncGroq
+
+# Max batch items analyzed at the same time
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+# How long background summaries stay fetchable by result id
+SUMMARY_RESULT_TTL = float(os.getenv("SUMMARY_RESULT_TTL", "900"))
+# Identical images or texts analyzed at the same time share one analysis
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+# full: LLM summary inline, template: local summary, verdict: no summary,
+# async_summary: verdict now and an LLM summary fetchable by result id
+SUMMARY_MODES = ("full", "template", "verdict", "async_summary")
 
 
 class MainAgent:
 
-    def __init__(self):
-        self.ocr_agent = OCRAgent()
-        self.nsfw_agent = NSFWAgent()
-        self.toxicity_agent = ToxicityAgent()
-        self.imagePreprocessor = ImagePreprocessor()
-        self.promptInjectionDetector = PromptInjectionDetector()
+    def __init__(self, ocr_agent: Optional[OCRAgent] = None,
+                 nsfw_agent: Optional[NSFWAgent] = None,
+                 toxicity_agent: Optional[ToxicityAgent] = None,
+                 image_preprocessor: Optional[ImagePreprocessor] = None,
+                 prompt_injection_detector: Optional[PromptInjectionDetector] = None,
+                 groq_client: Optional["AsyncGroq"] = None,
+                 result_cache: Optional[ResultCache] = None,
+                 near_duplicate_index: Optional[NearDuplicateIndex] = None,
+                 scheduler: Optional[Scheduler] = None,
+                 gateway: Optional[LLMGateway] = None):
+        # Shared instances are injected by the AgentRegistry; fall back to
+        # building our own so the agent can still be used standalone
+        if groq_client is None:
+            from groq import AsyncGroq
+            groq_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0)
+        self.groq_client = groq_client
+        # Summary calls share the gateway, and the Groq stage limit, with the toxicity agent
+        self.gateway = gateway or (toxicity_agent.gateway if toxicity_agent is not None else LLMGateway(
+            self.groq_client, limiter=scheduler.stage("groq") if scheduler is not None else None))
+        self.ocr_agent = ocr_agent or OCRAgent()
+        self.nsfw_agent = nsfw_agent or NSFWAgent()
+        self.toxicity_agent = toxicity_agent or ToxicityAgent(
+            client=self.groq_client, gateway=self.gateway)
+        self.imagePreprocessor = image_preprocessor or ImagePreprocessor()
+        self.promptInjectionDetector = prompt_injection_detector or PromptInjectionDetector()
+        self.summary_model = "llama-3.3-70b-versatile"
+        self.result_cache = result_cache
+        self.near_duplicate_index = near_duplicate_index
+        # Background summaries for the async_summary mode, by result id
+        self.summary_results = MemoryCacheBackend(
+            max_entries=10000, ttl=SUMMARY_RESULT_TTL)
+        self._summary_tasks = set()
+        # In-progress analyses by cache key, shared by identical requests
+        self.image_flights = SingleFlight("image")
+        self.text_flights = SingleFlight("text")
+
+    async def analyze_image(self, image: Image.Image, content: Optional[bytes] = None,
+                            mode: str = "full") -> Dict:
+        """Analyze an image, reusing a cached or in-progress result for identical uploads"""
+        # Every async_summary request gets its own result id
+        if mode == "async_summary" or (self.result_cache is None and not SINGLE_FLIGHT_ENABLED):
+            return await self._analyze_image(image, mode)
+
+        key = ResultCache.image_key(
+            content if content is not None else image.tobytes(),
+            self._config_fingerprint(mode))
+        return await self._collapsed(self.image_flights, key, lambda: self._analyze_image(image, mode))
+
+    async def analyze_text(self, text: str, mode: str = "full") -> Dict:
+        """Analyze text, reusing a cached or in-progress result for the same normalized text"""
+        if mode == "async_summary" or (self.result_cache is None and not SINGLE_FLIGHT_ENABLED):
+            return await self._analyze_text(text, mode=mode)
+
+        key = ResultCache.text_key(text, self._config_fingerprint(mode))
+        return await self._collapsed(self.text_flights, key, lambda: self._analyze_text(text, mode=mode))
+
+    async def _collapsed(self, flights: SingleFlight, key: str,
+                         analyze: Callable[[], Awaitable[Dict]]) -> Dict:
+        """
+        The cached result for key, or the result of analyze, run once for
+        all concurrent requests with the same key when single-flight is on
+        """
+        async def cached_analysis() -> Tuple[Dict, Optional[str]]:
+            if self.result_cache is not None:
+                cached = await self.result_cache.get(key)
+                if cached is not None:
+                    return cached, CACHE_STATUS.get()
+            result = await analyze()
+            if self.result_cache is not None:
+                await self._store_result(key, result)
+            # The run has its own context, hand the cache status back
+            return result, CACHE_STATUS.get()
+
+        if not SINGLE_FLIGHT_ENABLED:
+            return (await cached_analysis())[0]
+        (result, status), shared = await flights.do(key, cached_analysis)
+        CACHE_STATUS.set("COLLAPSED" if shared else status)
+        return result
+
+    async def analyze_image_stream(self, image: Image.Image, content: Optional[bytes] = None,
+                                   mode: str = "full") -> AsyncIterator[Tuple[str, Dict]]:
+        """analyze_image as (event, data) pairs, each stage as soon as it is ready"""
+        key = None
+        if self.result_cache is not None and mode != "async_summary":
+            key = ResultCache.image_key(
+                content if content is not None else image.tobytes(),
+                self._config_fingerprint(mode))
+        async for event in self._cached_events(key, self._image_events(image, mode, stream_summary=True)):
+            yield event
+
+    async def analyze_text_stream(self, text: str, mode: str = "full") -> AsyncIterator[Tuple[str, Dict]]:
+        """analyze_text as (event, data) pairs, each stage as soon as it is ready"""
+        key = None
+        if self.result_cache is not None and mode != "async_summary":
+            key = ResultCache.text_key(text, self._config_fingerprint(mode))
+        async for event in self._cached_events(key, self._text_events(text, mode=mode, stream_summary=True)):
+            yield event
+
+    async def get_summary_result(self, result_id: str) -> Optional[Dict]:
+        """Status and summary of a background summary, None if unknown or expired"""
+        return await self.summary_results.get(result_id)
+
+    async def analyze_batch(self, items: List[Dict], mode: str = "full") -> AsyncIterator[Tuple[int, Dict]]:
+        """
+        Analyze many items, yielding (index, result) as each one completes.
 
-    async def analyze_image(self, image: Image.Image) -> Dict:
+        Items are {"text": str}, {"image": Image, "content": bytes} or
+        {"load": async callable returning the image bytes}. Short texts
+        share Groq toxicity calls and at most BATCH_CONCURRENCY items are
+        in flight at once. Images to load are only read and opened in
+        their turn, one that can't be gets {"invalid_input": message}.
+        """
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        tasks = []
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        async def indexed(index: int, coro):
+            try:
+                return index, await coro
+            except Exception as e:
+                logging.error(e, exc_info=True)
+                return index, {"error": str(e)}
+
+        # Texts: answer from the cache where possible, pack the rest
+        text_indices = [i for i, item in enumerate(items) if "text" in item]
+        use_cache = self.result_cache is not None and mode != "async_summary"
+        fingerprint = self._config_fingerprint(mode)
+        keys = {
+            i: ResultCache.text_key(items[i]["text"], fingerprint) for i in text_indices
+        } if use_cache else {}
+        cached = dict(zip(text_indices, await asyncio.gather(*(
+            self.result_cache.get(keys[i]) for i in text_indices
+        )))) if use_cache else {}
+
+        pending = [
+            i for i in text_indices
+            if cached.get(i) is None and not self.promptInjectionDetector.is_injection(items[i]["text"])
+        ]
+        pack_tasks = {}
+        for pack in self.toxicity_agent.plan_packs([items[i]["text"] for i in pending]):
+            indices = [pending[p] for p in pack]
+            task = asyncio.ensure_future(bounded(self.toxicity_agent.analyze_packed(
+                [items[i]["text"] for i in indices])))
+            for position, index in enumerate(indices):
+                pack_tasks[index] = (task, position)
+
+        async def run_text(index: int) -> Dict:
+            if cached.get(index) is not None:
+                return cached[index]
+            text_result = None
+            if index in pack_tasks:
+                task, position = pack_tasks[index]
+                text_result = (await task)[position]
+            result = await bounded(self._analyze_text(items[index]["text"], text_result, mode))
+            if use_cache:
+                await self._store_result(keys[index], result)
+            return result
+
+        async def run_image(item: Dict) -> Dict:
+            if "load" not in item:
+                return await self.analyze_image(item["image"], item.get("content"), mode)
+            try:
+                content = await item["load"]()
+                image = open_image(content)
+            except ValueError as e:
+                return {"invalid_input": str(e)}
+            return await self.analyze_image(image, content, mode)
+
+        for index, item in enumerate(items):
+            if "text" in item:
+                coro = run_text(index)
+            else:
+                coro = bounded(run_image(item))
+            tasks.append(asyncio.ensure_future(indexed(index, coro)))
 
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The client went away or we finished, stop any leftover work
+            # and wait for it, so nothing still runs once the batch is closed
+            leftover = tasks + [task for task, _ in pack_tasks.values()]
+            for task in leftover:
+                task.cancel()
+            await asyncio.gather(*leftover, return_exceptions=True)
+
+    def _config_fingerprint(self, mode: str = "full") -> str:
+        """Everything a cached verdict depends on besides the content itself"""
+        return ResultCache.fingerprint({
+            "toxicity_model": self.toxicity_agent.model_name,
+            "summary_model": self.summary_model,
+            "nsfw_categories": self.nsfw_agent.categories,
+            "nsfw_backend": self.nsfw_agent.backend.name,
+            "preprocessing": {
+                "target_size": self.imagePreprocessor.target_size,
+                "vision_max_side": self.imagePreprocessor.vision_max_side,
+                "ocr_threshold": (self.imagePreprocessor.ocr_block_size,
+                                  self.imagePreprocessor.ocr_threshold_c)
+            },
+            "ocr_mode": self.ocr_agent.mode,
+            "mode": mode
+        })
+
+    async def _cached_events(self, key: Optional[str],
+                             events: AsyncIterator[Tuple[str, Dict]]) -> AsyncIterator[Tuple[str, Dict]]:
+        """A cached result as verdict and result events, or events, storing their result"""
+        if key is not None:
+            cached = await self.result_cache.get(key)
+            if cached is not None:
+                yield "verdict", {"is_toxic": cached["is_toxic"], "confidence": cached["confidence"]}
+                yield "result", cached
+                return
+        async for event, data in events:
+            if event == "result" and key is not None:
+                await self._store_result(key, data)
+            yield event, data
+
+    @staticmethod
+    async def _final_result(events: AsyncIterator[Tuple[str, Dict]]) -> Dict:
+        try:
+            async for event, data in events:
+                if event == "result":
+                    return data
+            return {"error": "No result"}
+        finally:
+            await events.aclose()
+
+    async def _store_result(self, key: str, result: Dict):
+        # Never cache failures, a retry should get a fresh analysis
+        if "error" in result or not isinstance(result.get("summary", ""), str):
+            return
+        await self.result_cache.set(key, result)
+
+    async def _summarize(self, analysis_data: Dict[str, Any], mode: str) -> Dict:
+        """Summary fields for the response according to the requested mode"""
+        if mode == "verdict":
+            return {}
+        if mode == "template":
+            return {"summary": self._template_summary(analysis_data)}
+        if mode == "async_summary":
+            result_id = uuid.uuid4().hex
+            await self.summary_results.set(result_id, {"status": "pending"})
+            task = asyncio.create_task(
+                self._background_summary(result_id, analysis_data))
+            # Keep a reference so the task is not garbage collected early
+            self._summary_tasks.add(task)
+            task.add_done_callback(self._summary_tasks.discard)
+            return {"result_id": result_id, "summary_status": "pending"}
+        return {"summary": await self._prepare_summary_data(analysis_data)}
+
+    async def _summary_events(self, analysis_data: Dict[str, Any], mode: str, result: Dict,
+                              stream_summary: bool) -> AsyncIterator[Tuple[str, Dict]]:
+        """Add the summary fields to result, yielding the LLM summary chunk by chunk if asked"""
+        if not (stream_summary and mode == "full"):
+            result.update(await self._summarize(analysis_data, mode))
+            return
+        async for kind, value in self._stream_summary(analysis_data):
+            if kind == "delta":
+                yield "summary", {"delta": value}
+            else:
+                result["summary"] = value
+
+    async def _background_summary(self, result_id: str, analysis_data: Dict[str, Any]):
+        summary = await self._prepare_summary_data(analysis_data)
+        if isinstance(summary, str):
+            await self.summary_results.set(
+                result_id, {"status": "ready", "summary": summary})
+        else:
+            await self.summary_results.set(result_id, {"status": "failed"})
+
+    async def aclose(self):
+        """Cancel background summaries still running"""
+        for task in list(self._summary_tasks):
+            task.cancel()
+
+    def _template_summary(self, analysis_data: Dict[str, Any]) -> str:
+        """Deterministic summary built locally from the agent results"""
+        text_analysis = analysis_data.get("text_analysis", {})
+        image_analysis = analysis_data.get("image_analysis", {})
+        text_toxic = bool(text_analysis.get("is_toxic", False))
+        image_toxic = bool(image_analysis.get("is_toxic", False))
+
+        if not (text_toxic or image_toxic):
+            return ("The content appears safe for most audiences based on both "
+                    "text and image analysis.")
+
+        sentences = []
+        if text_toxic:
+            categories = ", ".join(text_analysis.get("categories", [])) or "unspecified categories"
+            sentences.append(
+                f"The text was flagged as toxic ({categories}) with "
+                f"{text_analysis.get('confidence', 0):.0%} confidence and "
+                f"{str(text_analysis.get('severity', 'low')).lower()} severity.")
+        if image_toxic:
+            categories = ", ".join(image_analysis.get("flagged_categories", [])) or "unspecified categories"
+            sentences.append(
+                f"The image was flagged for {categories} with "
+                f"{image_analysis.get('confidence', 0):.0%} confidence.")
+        sentences.append("Restricting this content is recommended.")
+
+        summary = "TOXICITY DETECTED: " + " ".join(sentences)
+        if text_toxic != image_toxic:
+            problematic_component = "text" if text_toxic else "image"
+            summary = f"{problematic_component.upper()}-SPECIFIC ISSUE: {summary}"
+        return summary
+
+    async def _reuse(self, stored: Dict, mode: str) -> Dict:
+        """
+        A near-duplicate's image verdict with the summary fields of the
+        requested mode. Seeded entries carry a fixed summary, others are
+        summarized from their image analysis alone: the new copy's caption
+        was never read.
+        """
+        result = {"is_toxic": stored["is_toxic"], "confidence": stored["confidence"]}
+        if mode == "verdict":
+            return result
+        summary = stored.get("summary")
+        if summary is None:
+            analysis = {"image_analysis": stored["image_analysis"], "text_analysis": {},
+                        "verdict": stored["is_toxic"]}
+            result.update(await self._summarize(analysis, mode))
+        elif mode == "async_summary":
+            result_id = uuid.uuid4().hex
+            await self.summary_results.set(result_id, {"status": "ready", "summary": summary})
+            result.update({"result_id": result_id, "summary_status": "ready"})
+        else:
+            result["summary"] = summary
+        return result
+
+    async def _analyze_image(self, image: Image.Image, mode: str = "full") -> Dict:
+        return await self._final_result(self._image_events(image, mode))
+
+    async def _image_events(self, image: Image.Image, mode: str = "full",
+                            stream_summary: bool = False) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Analyze an image, yielding ("nsfw" | "ocr" | "toxicity" | "verdict",
+        data) as each stage finishes, and always a last ("result", result).
+        With stream_summary there are also ("summary", {"delta": ...}) per
+        summary chunk and, when toxicity answers are streamed, an early
+        ("toxicity_verdict", {"is_toxic": ...}). A failed analysis ends
+        with a result holding "error".
+        """
+        tasks = []
         try:
 
-            processed_image = await self.imagePreprocessor.preprocess(image)
-
-            # process these modules paralelly
-            ocr_text, nsfw_result = await asyncio.gather(
-                self._run_ocr(processed_image),
-                self._run_nsfw(processed_image)
-            )
+            # Each consumer gets its own view of one decoded array: a small
+            # JPEG for Vision and a binarized grayscale image for Tesseract
+            with stage("preprocess"):
+                views = await self.imagePreprocessor.preprocess_profiles(image, ("vision", "ocr"))
+
+            # Reuse the image verdict of a perceptually identical earlier image
+            phash = views["phash"]
+            known_image = None
+            if self.near_duplicate_index is not None and phash is not None:
+                match = self.near_duplicate_index.lookup(phash)
+                if match is not None and match[1]["is_toxic"]:
+                    CACHE_STATUS.set("NEAR-HIT")
+                    result = await self._reuse(match[1], mode)
+                    yield "verdict", {"is_toxic": result["is_toxic"], "confidence": result["confidence"]}
+                    yield "result", result
+                    return
+                if match is not None:
+                    # A safe image can still carry a toxic caption, only Vision is skipped
+                    known_image = match[1]["image_analysis"]
+
+            # process these modules paralelly, reporting whichever ends first
+            ocr_task = asyncio.ensure_future(self._run_ocr(views["ocr"]))
+            nsfw_task = asyncio.ensure_future(
+                self._run_nsfw(views["vision"]) if known_image is None else asyncio.sleep(0, known_image))
+            tasks = [ocr_task, nsfw_task]
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if nsfw_task in done:
+                    yield "nsfw", nsfw_task.result()
+                if ocr_task in done:
+                    yield "ocr", {"text": ocr_task.result()}
+            ocr_text, nsfw_result = ocr_task.result(), nsfw_task.result()
+            self._check_image_stages(ocr_text, nsfw_result)
+            if self.near_duplicate_index is not None and phash is not None and known_image is None:
+                # Only the image's own verdict: the hash barely sees a caption,
+                # so the text of a near copy has to be read again
+                self.near_duplicate_index.add(phash, {
+                    "is_toxic": bool(nsfw_result.get("is_toxic", False)),
+                    "confidence": float(nsfw_result.get("confidence", 0)),
+                    "image_analysis": nsfw_result
+                })
 
             is_prompt_injection = self.promptInjectionDetector.is_injection(
                 ocr_text)
@@ -38,8 +426,15 @@ class MainAgent:
 
             # Process text toxicity if text exists
             text_result = {}
-            if ocr_text and "OCR Error" not in ocr_text:
-                text_result = self.toxicity_agent.analyze(ocr_text)
+            offensive_words = []
+            if ocr_text:
+                # Text in the image can run past the prompt budget, only its start is analyzed then
+                async for event, data in self._toxicity_events(ocr_text, early=stream_summary, truncate=True):
+                    if event == "analysis":
+                        text_result = data
+                    else:
+                        yield event, data
+                self._check_toxicity(text_result)
                 # Extract offensive words details
                 offensive_words = []
                 if isinstance(text_result.get("offensive_words"), list):
@@ -73,21 +468,47 @@ class MainAgent:
                 "verdict": overall_safeness
             }
 
-            summary = await self._prepare_summary_data(analysis_json)
-            return {"is_toxic": overall_safeness, "confidence": float(overall_confidence), "summary": summary}
+            yield "toxicity", analysis_json["text_analysis"]
 
+            result = {"is_toxic": overall_safeness, "confidence": float(overall_confidence)}
+            if text_result.get("partial"):
+                analysis_json["text_analysis"]["partial"] = result["partial"] = True
+            yield "verdict", dict(result)
+            async for event in self._summary_events(analysis_json, mode, result, stream_summary):
+                yield event
+            yield "result", result
+
+        except AdmissionError:
+            raise
         except Exception as e:
             logging.error(e, exc_info=True)
-            return {"error": str(e)}
-
-    async def analyze_text(self, text: str) -> str:
+            yield "result", {"error": str(e)}
+        finally:
+            # The client went away or we failed, stop any leftover work
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _analyze_text(self, text: str, text_result: Optional[Dict] = None, mode: str = "full") -> Dict:
+        return await self._final_result(self._text_events(text, text_result, mode))
+
+    async def _text_events(self, text: str, text_result: Optional[Dict] = None, mode: str = "full",
+                           stream_summary: bool = False) -> AsyncIterator[Tuple[str, Dict]]:
+        """Analyze text, yielding events like _image_events"""
         try:
             is_prompt_injection = self.promptInjectionDetector.is_injection(
                 text)
             if (is_prompt_injection):
                 raise ValueError("Possible Prompt Injection")
 
-            text_result = self.toxicity_agent.analyze(text)
+            # Batches hand in the toxicity result from a packed call
+            if text_result is None:
+                async for event, data in self._toxicity_events(text, early=stream_summary):
+                    if event == "analysis":
+                        text_result = data
+                    else:
+                        yield event, data
+            self._check_toxicity(text_result)
             # Extract offensive words details
             offensive_words = []
             if isinstance(text_result.get("offensive_words"), list):
@@ -115,20 +536,119 @@ class MainAgent:
                 "verdict": "unsafe" if bool(text_result.get("is_toxic", False)) else "safe"
             }
 
-            summary = await self._prepare_summary_data(analysis_json)
+            yield "toxicity", analysis_json["text_analysis"]
 
-            return {"is_toxic": bool(text_result.get("is_toxic", False)), "confidence": float(text_result.get("confidence", 0)), "summary": summary}
+            result = {"is_toxic": bool(text_result.get("is_toxic", False)), "confidence": float(text_result.get("confidence", 0))}
+            yield "verdict", dict(result)
+            async for event in self._summary_events(analysis_json, mode, result, stream_summary):
+                yield event
+            yield "result", result
 
+        except AdmissionError:
+            raise
         except Exception as e:
             logging.error(e, exc_info=True)
-            return {"error": f"Text Analysis Error: {str(e)}"}
+            yield "result", {"error": f"Text Analysis Error: {str(e)}"}
+
+    async def _toxicity_events(self, text: str, early: bool = False,
+                               truncate: bool = False) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        The toxicity result of text as a last ("analysis", result). With
+        early and streamed toxicity answers, ("toxicity_verdict",
+        {"is_toxic": ...}) comes first, as soon as the model has decided.
+        truncate is passed on to ToxicityAgent.analyze.
+        """
+        if not (early and self.toxicity_agent.stream):
+            with stage("toxicity"):
+                text_result = await self.toxicity_agent.analyze(text, truncate=truncate)
+            yield "analysis", text_result
+            return
+
+        verdict = asyncio.get_running_loop().create_future()
+
+        def on_verdict(is_toxic: bool):
+            if not verdict.done():
+                verdict.set_result(is_toxic)
+
+        # Timed by hand, a span can't stay open across the yields
+        start = time.perf_counter()
+        task = asyncio.ensure_future(self.toxicity_agent.analyze(text, on_verdict=on_verdict, truncate=truncate))
+        try:
+            await asyncio.wait((task, verdict), return_when=asyncio.FIRST_COMPLETED)
+            if verdict.done() and not task.done():
+                yield "toxicity_verdict", {"is_toxic": verdict.result()}
+            text_result = await task
+        finally:
+            task.cancel()
+            record_stage("toxicity", time.perf_counter() - start)
+        yield "analysis", text_result
+
+    def _check_image_stages(self, ocr_text: str, nsfw_result: Dict):
+        """
+        Fail the analysis when NSFW detection or OCR failed, rather than
+        calling the image safe, so the failure isn't cached or indexed
+        """
+        if "error" in nsfw_result:
+            raise ValueError(f"NSFW analysis failed: {nsfw_result['error']}")
+        if self.ocr_agent.is_error(ocr_text):
+            raise ValueError(f"Text extraction failed: {ocr_text}")
+
+    @staticmethod
+    def _check_toxicity(text_result: Dict):
+        """Fail the request when the toxicity check failed, rather than calling the text safe"""
+        if "error" in text_result:
+            raise LLMUnavailableError(f"Toxicity analysis failed: {text_result['error']}",
+                                      text_result.get("retry_after") or 1)
 
     async def _prepare_summary_data(self, analysis_data: Dict[str, Any]) -> str:
         """
         Generates an accurate safety summary based on both text and image toxicity analysis results.
         """
-        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        prompt = self._summary_prompt(analysis_data)
+        try:
+            with stage("summary"):
+                response = await self.gateway.create(
+                    "summary", self.summary_model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.0,  # Use 0 for maximum consistency
+                    max_tokens=250  # Slightly more tokens for combined analysis
+                )
+
+            return self._finish_summary(response.choices[0].message.content, analysis_data)
+
+        except Exception as e:
+            logging.error(e, exc_info=True)
+            return {"error": f"Safety evaluation error: {str(e)}"}
 
+    async def _stream_summary(self, analysis_data: Dict[str, Any]) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        The summary as ("delta", text) chunks straight from Groq, then
+        ("summary", final) with the same checks as _prepare_summary_data.
+        """
+        prompt = self._summary_prompt(analysis_data)
+        parts = []
+        # Timed by hand, a span can't stay open across the yields
+        start = time.perf_counter()
+        try:
+            async for chunk in self.gateway.stream(
+                    "summary_stream", self.summary_model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.0,
+                    max_tokens=250):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield "delta", delta
+        except Exception as e:
+            logging.error(e, exc_info=True)
+            yield "summary", {"error": f"Safety evaluation error: {str(e)}"}
+            return
+        finally:
+            record_stage("summary", time.perf_counter() - start)
+        yield "summary", self._finish_summary("".join(parts), analysis_data)
+
+    def _summary_prompt(self, analysis_data: Dict[str, Any]) -> str:
+        """Prompt asking the summary model for a summary of analysis_data"""
         # Extract analysis data with proper defaults
         text_analysis = analysis_data.get("text_analysis", {})
         image_analysis = analysis_data.get("image_analysis", {})
@@ -178,7 +698,6 @@ class MainAgent:
 
         # Determine overall toxicity
         overall_toxic = text_toxic or image_toxic
-        overall_confidence = max(text_confidence, image_confidence)
 
         # Create instructions based on combined analysis
         toxicity_instruction = ("Highlight all concerning elements from both text and image analysis and recommend appropriate restrictions."
@@ -205,44 +724,39 @@ class MainAgent:
 
             Generate the combined safety summary[/INST]"""
 
-        try:
-            response = client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="llama-3.3-70b-versatile",
-                temperature=0.0,  # Use 0 for maximum consistency
-                max_tokens=250  # Slightly more tokens for combined analysis
-            )
-
-            summary = response.choices[0].message.content
+        return prompt
 
-            # Ensure the summary reflects the toxicity appropriately
-            if overall_toxic:
-                if "non-toxic" in summary.lower():
-                    summary = f"TOXIC CONTENT WARNING: {summary}"
-                elif not any(word in summary.lower() for word in ["toxic", "violent", "concern", "risk", "inappropriate"]):
-                    summary = f"TOXICITY DETECTED: {summary}"
+    def _finish_summary(self, summary: str, analysis_data: Dict[str, Any]) -> str:
+        """Make sure the summary reflects the verdict"""
+        text_toxic = analysis_data.get("text_analysis", {}).get("is_toxic", False)
+        image_toxic = analysis_data.get("image_analysis", {}).get("is_toxic", False)
 
-                # Add clarification if only one component is toxic
-                if text_toxic != image_toxic:
-                    problematic_component = "text" if text_toxic else "image"
-                    summary = f"{problematic_component.upper()}-SPECIFIC ISSUE: {summary}"
+        # Ensure the summary reflects the toxicity appropriately
+        if text_toxic or image_toxic:
+            if "non-toxic" in summary.lower():
+                summary = f"TOXIC CONTENT WARNING: {summary}"
+            elif not any(word in summary.lower() for word in ["toxic", "violent", "concern", "risk", "inappropriate"]):
+                summary = f"TOXICITY DETECTED: {summary}"
 
-            return summary.strip()
+            # Add clarification if only one component is toxic
+            if text_toxic != image_toxic:
+                problematic_component = "text" if text_toxic else "image"
+                summary = f"{problematic_component.upper()}-SPECIFIC ISSUE: {summary}"
 
-        except Exception as e:
-            logging.error(e, exc_info=True)
-            return {"error": f"Safety evaluation error: {str(e)}"}
+        return summary.strip()
 
     async def _run_ocr(self, image: Image.Image) -> str:
         try:
-            return self.ocr_agent.extract_text(image)
+            with stage("ocr"):
+                return await self.ocr_agent.extract_text_async(image)
         except Exception as e:
             logging.error(e, exc_info=True)
-            return {"error": f"OCR Error: {str(e)}"}
+            return f"OCR Error: {str(e)}"
 
-    async def _run_nsfw(self, image: Image.Image) -> Dict:
+    async def _run_nsfw(self, image: Union[Image.Image, bytes]) -> Dict:
         try:
-            return self.nsfw_agent.detect(image)
+            with stage("nsfw"):
+                return await self.nsfw_agent.detect(image)
         except Exception as e:
             logging.error(e, exc_info=True)
             return {"rating": "error", "error": str(e)}
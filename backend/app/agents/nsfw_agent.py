@@ -1,10 +1,16 @@
-from google.cloud import vision
 from PIL import Image
 import io
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+from concurrent.futures import Executor
+import asyncio
 from dotenv import load_dotenv
 import os
 import logging
+from app.helpers import Limiter
+from app.helpers.img_preprocessor import VISION_MAX_SIDE, VISION_JPEG_QUALITY
+from .nsfw_backends import NSFWBackend, VisionBackend
+if TYPE_CHECKING:
+    from google.cloud import vision
 # Load environment variables from .env file
 load_dotenv()
 
@@ -12,13 +18,44 @@ load_dotenv()
 #os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# Another Vision endpoint (host:port), such as the stand-in in benchmarks.fake_servers
+VISION_API_ENDPOINT = os.getenv("VISION_API_ENDPOINT")
+# Connect to VISION_API_ENDPOINT in plain text and without credentials
+VISION_API_INSECURE = os.getenv("VISION_API_INSECURE", "false").lower() == "true"
+
+
+def create_vision_client() -> "vision.ImageAnnotatorAsyncClient":
+    """Async Vision client for GOOGLE_API_KEY and VISION_API_ENDPOINT"""
+    # The Vision SDK and gRPC take a while to import, only load them for this backend
+    from google.cloud import vision
+    if VISION_API_ENDPOINT and VISION_API_INSECURE:
+        import grpc
+        from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcAsyncIOTransport
+        channel = grpc.aio.insecure_channel(VISION_API_ENDPOINT)
+        return vision.ImageAnnotatorAsyncClient(transport=ImageAnnotatorGrpcAsyncIOTransport(channel=channel))
+    client_options = {"api_key": GOOGLE_API_KEY}
+    if VISION_API_ENDPOINT:
+        client_options["api_endpoint"] = VISION_API_ENDPOINT
+    return vision.ImageAnnotatorAsyncClient(client_options=client_options)
 
 
 class NSFWAgent:
-    def __init__(self):
-        self.client = vision.ImageAnnotatorClient(
-                    client_options={"api_key": GOOGLE_API_KEY}
-                )
+    def __init__(self, client: Optional["vision.ImageAnnotatorAsyncClient"] = None,
+                 executor: Optional[Executor] = None, limiter: Optional[Limiter] = None,
+                 max_side: int = VISION_MAX_SIDE, quality: int = VISION_JPEG_QUALITY,
+                 backend: Optional[NSFWBackend] = None):
+        # Google Vision unless another backend is given, the async client
+        # keeps the gRPC calls off the event loop
+        if backend is None:
+            client = client or create_vision_client()
+            backend = VisionBackend(client, limiter=limiter)
+        self.backend = backend
+        # JPEG encoding is CPU bound, run it on this pool
+        self.executor = executor
+        # Size and quality of images encoded here, the preprocessor's
+        # "vision" profile already arrives as JPEG bytes
+        self.max_side = max_side
+        self.quality = quality
 
         self.categories = {
             'adult': {
@@ -43,48 +80,45 @@ class NSFWAgent:
             }
         }
 
-    def detect(self, image: Image.Image) -> Dict:
+    async def detect(self, image: Union[Image.Image, bytes]) -> Dict:
+        """Moderate a PIL image, or JPEG/PNG bytes that are sent as they are"""
         try:
-            # Convert image if needed
-            if image.mode == 'RGBA':
-                image = image.convert('RGB')
-
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='JPEG')
-            content = img_byte_arr.getvalue()
+            if isinstance(image, (bytes, bytearray)):
+                content = bytes(image)
+            else:
+                loop = asyncio.get_running_loop()
+                content = await loop.run_in_executor(
+                    self.executor, self._encode, image)
 
-            # Call APIs
-            safe_response = self.client.safe_search_detection(
-                image=vision.Image(content=content))
-            object_response = self.client.object_localization(
-                image=vision.Image(content=content))
+            # Batched with the other images in flight
+            annotation = await self.backend.annotate(content)
 
-            if safe_response.error.message:
-                return {"error": safe_response.error.message}
+            if annotation.error:
+                return {"error": annotation.error}
 
-            # Process results
-            safe = safe_response.safe_search_annotation
+            # Process results, categories the backend can't rate are UNKNOWN
+            levels = {cat: annotation.likelihoods.get(cat, 0) for cat in self.categories}
             likelihood_name = ['UNKNOWN', 'VERY_UNLIKELY', 'UNLIKELY',
                                'POSSIBLE', 'LIKELY', 'VERY_LIKELY']
             likelihood_score = [0.0, 0.1, 0.3, 0.5, 0.7, 0.9]
 
             flagged = []
             for cat, config in self.categories.items():
-                level = getattr(safe, cat)
+                level = levels[cat]
                 if level >= config['threshold']:
                     flagged.append(cat)
 
             visual_cues = []
-            for obj in object_response.localized_object_annotations:
-                if obj.score > 0.7:
-                    visual_cues.append(obj.name)
+            for name, score in annotation.objects:
+                if score > 0.7:
+                    visual_cues.append(name)
 
             overall_confidence = 1.0  # Default for safe images
             if flagged:
                 # Get max confidence from flagged categories
                 max_conf = 0.0
                 for cat in flagged:
-                    level = getattr(safe, cat)
+                    level = levels[cat]
                     max_conf = max(max_conf, likelihood_score[level])
                 overall_confidence = max_conf
 
@@ -95,8 +129,8 @@ class NSFWAgent:
                 "visual_cues": visual_cues,    # Just visual cue names
                 "details": {
                     cat: {
-                        'level': likelihood_name[getattr(safe, cat)],
-                        'confidence': likelihood_score[getattr(safe, cat)]
+                        'level': likelihood_name[levels[cat]],
+                        'confidence': likelihood_score[levels[cat]]
                     } for cat in self.categories
                 }
             }
@@ -104,3 +138,20 @@ class NSFWAgent:
         except Exception as e:
             logging.error(e, exc_info=True)
             return {"error": str(e)}
+
+    def stats(self) -> Dict:
+        """Backend calls, batching, latency and upload sizes"""
+        return self.backend.stats()
+
+    def _encode(self, image: Image.Image) -> bytes:
+        """Encode the image as JPEG for the Vision API"""
+        # Convert image if needed
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        if max(image.size) > self.max_side:
+            image = image.copy()
+            image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format='JPEG', quality=self.quality)
+        return img_byte_arr.getvalue()
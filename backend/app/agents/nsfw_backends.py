@@ -0,0 +1,283 @@
+from PIL import Image
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+from dotenv import load_dotenv
+import numpy as np
+import asyncio
+import time
+import io
+import os
+import logging
+from app.helpers import Batcher, Limiter, external_call
+if TYPE_CHECKING:
+    from google.cloud import vision
+# Load environment variables from .env file
+load_dotenv()
+
+# "vision" (Google Cloud Vision), "onnx" (local classifier) or "fake"
+NSFW_BACKEND = os.getenv("NSFW_BACKEND", "vision").lower()
+# Images in flight at the same time share one batch_annotate_images call,
+# Vision accepts at most 16 images per request
+VISION_BATCH_SIZE = min(16, int(os.getenv("VISION_BATCH_SIZE", "16")))
+VISION_BATCH_WAIT_MS = float(os.getenv("VISION_BATCH_WAIT_MS", "10"))
+VISION_BATCH_MAX_BYTES = int(os.getenv("VISION_BATCH_MAX_BYTES", str(8 * 1024 * 1024)))
+NSFW_ONNX_MODEL = os.getenv("NSFW_ONNX_MODEL")
+# Output classes of the model in order, the default matches the common
+# 5 class NSFW image classifiers
+NSFW_ONNX_LABELS = os.getenv("NSFW_ONNX_LABELS", "drawings,hentai,neutral,porn,sexy")
+# "unit" scales pixels to [0, 1], "imagenet" also applies ImageNet mean/std
+NSFW_ONNX_NORMALIZE = os.getenv("NSFW_ONNX_NORMALIZE", "unit").lower()
+NSFW_ONNX_BATCH_SIZE = int(os.getenv("NSFW_ONNX_BATCH_SIZE", "16"))
+NSFW_ONNX_BATCH_WAIT_MS = float(os.getenv("NSFW_ONNX_BATCH_WAIT_MS", "5"))
+# 0 lets ONNX Runtime pick, one thread per core
+NSFW_ONNX_THREADS = int(os.getenv("NSFW_ONNX_THREADS", "0"))
+NSFW_FAKE_LATENCY_MS = float(os.getenv("NSFW_FAKE_LATENCY_MS", "0"))
+
+# Vision likelihood levels: UNKNOWN, VERY_UNLIKELY, UNLIKELY, POSSIBLE, LIKELY, VERY_LIKELY
+LIKELIHOOD_BOUNDS = (0.1, 0.3, 0.5, 0.7)
+
+# Which moderation category each classifier label counts towards
+LABEL_CATEGORIES = {
+    "porn": "adult",
+    "hentai": "adult",
+    "nsfw": "adult",
+    "sexy": "racy",
+    "violence": "violence",
+    "gore": "violence",
+    "medical": "medical"
+}
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], np.float32)
+
+
+class Annotation(NamedTuple):
+    """What a backend found in one image, in Vision's terms"""
+    # Likelihood level (0-5) per category, 0 when the backend can't tell
+    likelihoods: Dict[str, int]
+    # (name, score) of the objects found
+    objects: Tuple[Tuple[str, float], ...] = ()
+    error: Optional[str] = None
+
+
+def score_to_likelihood(score: float) -> int:
+    """Map a probability to a Vision likelihood level"""
+    return 1 + sum(score >= bound for bound in LIKELIHOOD_BOUNDS)
+
+
+class NSFWBackend(ABC):
+    """
+    Annotates JPEG/PNG bytes, coalescing images in flight into batches.
+
+    Subclasses implement `_annotate_batch`, one Annotation per image.
+    """
+
+    name = "base"
+
+    def __init__(self, batch_size: int = 16, batch_wait_ms: float = 0.0,
+                 batch_max_bytes: Optional[int] = None, limiter: Optional[Limiter] = None):
+        # Each batch takes one slot of limiter
+        self.limiter = limiter
+        self.batcher = Batcher(
+            self.name, self._timed_batch, max_batch=batch_size, max_wait=batch_wait_ms / 1000,
+            max_weight=batch_max_bytes, weigh=len, limiter=limiter)
+
+        self.calls = 0
+        self.images = 0
+        self.payload_bytes = 0
+        self.max_payload_bytes = 0
+        self._latency_seconds = 0.0
+        self.max_latency_ms = 0.0
+
+    async def annotate(self, content: bytes) -> Annotation:
+        return await self.batcher.submit(content)
+
+    async def warmup(self):
+        """Load whatever the first call would otherwise load"""
+
+    def stats(self) -> Dict:
+        """Calls, batching, latency and payload sizes"""
+        return {
+            "backend": self.name,
+            "calls": self.calls,
+            "images": self.images,
+            "mean_latency_ms": round(self._latency_seconds * 1e3 / self.calls, 3) if self.calls else 0.0,
+            "mean_latency_per_image_ms": (
+                round(self._latency_seconds * 1e3 / self.images, 3) if self.images else 0.0),
+            "max_latency_ms": round(self.max_latency_ms, 3),
+            "payload_bytes": self.payload_bytes,
+            "mean_payload_bytes_per_call": self.payload_bytes // self.calls if self.calls else 0,
+            "mean_payload_bytes_per_image": self.payload_bytes // self.images if self.images else 0,
+            "max_payload_bytes": self.max_payload_bytes,
+            "batching": self.batcher.stats()
+        }
+
+    async def _timed_batch(self, contents: List[bytes]) -> List[Annotation]:
+        payload = sum(len(content) for content in contents)
+        start = time.perf_counter()
+        with external_call(self.name, "annotate"):
+            annotations = await self._annotate_batch(contents)
+        elapsed = time.perf_counter() - start
+
+        self.calls += 1
+        self.images += len(contents)
+        self.payload_bytes += payload
+        self.max_payload_bytes = max(self.max_payload_bytes, payload)
+        self._latency_seconds += elapsed
+        self.max_latency_ms = max(self.max_latency_ms, elapsed * 1e3)
+        logging.debug("%s: %d images, %d bytes in %.1f ms", self.name, len(contents), payload, elapsed * 1e3)
+        return annotations
+
+    @abstractmethod
+    async def _annotate_batch(self, contents: List[bytes]) -> List[Annotation]:
+        """One Annotation per image in contents"""
+
+
+class VisionBackend(NSFWBackend):
+    """Google Cloud Vision SafeSearch and object localization, one request per batch"""
+
+    name = "vision"
+
+    def __init__(self, client: "vision.ImageAnnotatorAsyncClient", limiter: Optional[Limiter] = None,
+                 batch_size: int = VISION_BATCH_SIZE, batch_wait_ms: float = VISION_BATCH_WAIT_MS,
+                 batch_max_bytes: int = VISION_BATCH_MAX_BYTES):
+        # Imported here, like onnxruntime, so other backends don't load it
+        from google.cloud import vision
+        super().__init__(batch_size, batch_wait_ms, batch_max_bytes, limiter)
+        self.client = client
+        self.vision = vision
+        # Both features come back in one response per image
+        self.features = [
+            vision.Feature(type_=vision.Feature.Type.SAFE_SEARCH_DETECTION),
+            vision.Feature(type_=vision.Feature.Type.OBJECT_LOCALIZATION)
+        ]
+
+    async def _annotate_batch(self, contents: List[bytes]) -> List[Annotation]:
+        response = await self.client.batch_annotate_images(requests=[
+            self.vision.AnnotateImageRequest(image=self.vision.Image(content=content), features=self.features)
+            for content in contents
+        ])
+        return [self._convert(result) for result in response.responses]
+
+    @staticmethod
+    def _convert(result: "vision.AnnotateImageResponse") -> Annotation:
+        if result.error.message:
+            return Annotation({}, error=result.error.message)
+        safe = result.safe_search_annotation
+        return Annotation(
+            {category: int(getattr(safe, category))
+             for category in ("adult", "violence", "racy", "medical", "spoof")},
+            tuple((obj.name, obj.score) for obj in result.localized_object_annotations)
+        )
+
+
+class OnnxBackend(NSFWBackend):
+    """
+    Local image classifier run with ONNX Runtime (pip install onnxruntime).
+
+    The model is loaded once, when the backend is built, and each batch is
+    one inference call on the executor. Class probabilities are mapped to
+    categories through LABEL_CATEGORIES, the highest score wins when
+    several labels share a category, and categories the model doesn't
+    cover are reported as UNKNOWN. There is no object localization.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path: Optional[str] = NSFW_ONNX_MODEL, labels: str = NSFW_ONNX_LABELS,
+                 normalize: str = NSFW_ONNX_NORMALIZE, executor: Optional[Executor] = None,
+                 limiter: Optional[Limiter] = None, batch_size: int = NSFW_ONNX_BATCH_SIZE,
+                 batch_wait_ms: float = NSFW_ONNX_BATCH_WAIT_MS, threads: int = NSFW_ONNX_THREADS):
+        super().__init__(batch_size, batch_wait_ms, None, limiter)
+        if not model_path or not os.path.exists(model_path):
+            raise EnvironmentError(f"ONNX model not found at {model_path}, set NSFW_ONNX_MODEL")
+        if normalize not in ("unit", "imagenet"):
+            raise ValueError(f"Unknown normalization: {normalize}")
+        # Optional dependency, fail at startup rather than per request
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # NCHW when the channel axis comes first, NHWC otherwise
+        shape = model_input.shape
+        self.channels_first = shape[1] == 3
+        height, width = (shape[2], shape[3]) if self.channels_first else (shape[1], shape[2])
+        self.input_size = (width if isinstance(width, int) else 224,
+                           height if isinstance(height, int) else 224)
+        self.labels = [label.strip().lower() for label in labels.split(",")]
+        self.normalize = normalize
+        # Inference is CPU bound, keep it off the event loop
+        self.executor = executor
+
+    async def warmup(self):
+        blank = io.BytesIO()
+        Image.new("RGB", self.input_size, "white").save(blank, format="JPEG")
+        await self._annotate_batch([blank.getvalue()])
+
+    async def _annotate_batch(self, contents: List[bytes]) -> List[Annotation]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._classify, contents)
+
+    def _classify(self, contents: List[bytes]) -> List[Annotation]:
+        annotations: List[Optional[Annotation]] = [None] * len(contents)
+        inputs, valid = [], []
+        for index, content in enumerate(contents):
+            try:
+                inputs.append(self._to_input(content))
+                valid.append(index)
+            except Exception as e:
+                logging.error(e, exc_info=True)
+                annotations[index] = Annotation({}, error=f"Invalid image: {str(e)}")
+
+        if inputs:
+            scores = self.session.run(None, {self.input_name: np.stack(inputs)})[0]
+            for index, row in zip(valid, scores):
+                annotations[index] = self._to_annotation(row)
+        return annotations
+
+    def _to_input(self, content: bytes) -> np.ndarray:
+        image = Image.open(io.BytesIO(content))
+        # Let the JPEG decoder do most of the downscaling
+        image.draft("RGB", self.input_size)
+        image = image.convert("RGB").resize(self.input_size, Image.BILINEAR)
+        array = np.asarray(image, dtype=np.float32) / 255.0
+        if self.normalize == "imagenet":
+            array = (array - IMAGENET_MEAN) / IMAGENET_STD
+        return array.transpose(2, 0, 1) if self.channels_first else array
+
+    def _to_annotation(self, row: np.ndarray) -> Annotation:
+        row = np.asarray(row, dtype=np.float32).ravel()
+        # Some exports end in logits rather than a softmax
+        if row.min() < 0 or abs(float(row.sum()) - 1.0) > 1e-3:
+            row = np.exp(row - row.max())
+            row = row / row.sum()
+        scores: Dict[str, float] = {}
+        for label, score in zip(self.labels, row):
+            category = LABEL_CATEGORIES.get(label)
+            if category is not None:
+                scores[category] = max(scores.get(category, 0.0), float(score))
+        return Annotation({category: score_to_likelihood(score) for category, score in scores.items()})
+
+
+class FakeBackend(NSFWBackend):
+    """Offline stand-in for Vision: every image is safe, after an optional delay"""
+
+    name = "fake"
+
+    def __init__(self, latency_ms: float = NSFW_FAKE_LATENCY_MS, limiter: Optional[Limiter] = None,
+                 batch_size: int = VISION_BATCH_SIZE, batch_wait_ms: float = 0.0,
+                 likelihoods: Optional[Dict[str, int]] = None):
+        super().__init__(batch_size, batch_wait_ms, None, limiter)
+        self.latency_ms = latency_ms
+        self.likelihoods = likelihoods or {
+            category: 1 for category in ("adult", "violence", "racy", "medical", "spoof")}
+
+    async def _annotate_batch(self, contents: List[bytes]) -> List[Annotation]:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return [Annotation(dict(self.likelihoods)) for _ in contents]
@@ -1,41 +1,215 @@
-import pytesseract
+from app.helpers import Limiter, ProcessPool, limited, detect_text_regions
 from PIL import Image
+from concurrent.futures import Executor
+from typing import Callable, List, Optional
+import numpy as np
+import threading
+import asyncio
+import re
 import os
 import logging
 from dotenv import load_dotenv
 load_dotenv()
 
+# "pytesseract" runs the tesseract binary per call, "tesserocr" keeps an
+# engine loaded in each worker (pip install tesserocr)
+OCR_ENGINE = os.getenv("OCR_ENGINE", "pytesseract").lower()
+TESSERACT_LANG = os.getenv("TESSERACT_LANG", "eng")
+# "full" runs one call on the whole image, "tiled" OCRs only the detected
+# text regions, in parallel, and the whole image when none are found
+OCR_MODE = os.getenv("OCR_MODE", "full").lower()
+OCR_MAX_TILES = int(os.getenv("OCR_MAX_TILES", "16"))
+# Seconds per Tesseract call, so per tile in tiled mode
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "5"))
+
+# Persistent tesserocr engines, one per thread (and so per worker process)
+_engines = threading.local()
+
+
+def _tesserocr_api(config: Optional[str], lang: str):
+    api = getattr(_engines, "api", None)
+    if api is None:
+        import tesserocr
+
+        # Same page segmentation and engine mode as the tesseract CLI config
+        options = dict(re.findall(r"--(psm|oem)\s+(\d+)", config or ""))
+        kwargs = {"lang": lang}
+        if "psm" in options:
+            kwargs["psm"] = int(options["psm"])
+        if "oem" in options:
+            kwargs["oem"] = int(options["oem"])
+        if os.getenv("TESSDATA_PREFIX"):
+            kwargs["path"] = os.getenv("TESSDATA_PREFIX")
+        api = tesserocr.PyTessBaseAPI(**kwargs)
+        _engines.api = api
+    return api
+
+
+def recognize(gray: np.ndarray, engine: str, config: Optional[str], tesseract_cmd: Optional[str],
+              lang: str = TESSERACT_LANG, timeout: float = OCR_TIMEOUT) -> str:
+    """Text of a grayscale array, module level so pool workers can run it"""
+    # Loaded on the first image rather than when the app starts
+    import pytesseract
+    try:
+        if engine == "tesserocr":
+            api = _tesserocr_api(config, lang)
+            api.SetImage(Image.fromarray(gray))
+            return api.GetUTF8Text()
+
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+        return pytesseract.image_to_string(
+            Image.fromarray(gray),
+            config=config,
+            timeout=timeout
+        )
+    except pytesseract.TesseractError as e:
+        logging.error(e, exc_info=True)
+        return f"OCR Error: {str(e)}"
+    except Exception as e:
+        logging.error(e, exc_info=True)
+        return f"Image processing error: {str(e)}"
+
+
+def _is_error(text: str) -> bool:
+    return text.startswith(("OCR Error:", "Image processing error:"))
+
+
+def merge_tiles(texts: List[str]) -> str:
+    """
+    Join tile texts, already in reading order. Failed tiles are dropped so
+    one timeout doesn't lose the rest of the text, the error is returned
+    only when every tile failed.
+    """
+    recognized = [text.strip() for text in texts if not _is_error(text)]
+    if texts and not recognized:
+        return texts[0]
+    return "\n".join(text for text in recognized if text)
+
 
 class OCRAgent:
-    def __init__(self):
+    def __init__(self, executor: Optional[Executor] = None, limiter: Optional[Limiter] = None,
+                 engine: str = OCR_ENGINE, process_pool: Optional[ProcessPool] = None,
+                 mode: str = OCR_MODE, max_tiles: int = OCR_MAX_TILES):
         # Configure Tesseract path for Windows
         self.tesseract_path = os.getenv('TESSERACT_PATH')
         self.tesseract_config = os.getenv('TESSERACT_CONFIG')
+        self.engine = engine
+        if mode not in ("full", "tiled"):
+            raise ValueError(f"Unknown OCR mode: {mode}")
+        self.mode = mode
+        self.max_tiles = max_tiles
 
+        if engine == "tesserocr":
+            # Optional dependency, fail at startup rather than per request
+            import tesserocr  # noqa: F401
+        elif engine != "pytesseract":
+            raise ValueError(f"Unknown OCR engine: {engine}")
         # Verify installation
-        if not os.path.exists(self.tesseract_path):
+        elif not self.tesseract_path or not os.path.exists(self.tesseract_path):
             raise EnvironmentError(
                 f"Tesseract not found at {self.tesseract_path}\n"
                 "Please install Tesseract first: "
                 "https://github.com/UB-Mannheim/tesseract/wiki"
             )
 
-        pytesseract.pytesseract.tesseract_cmd = self.tesseract_path
+        # Tesseract is CPU bound, keep it off the event loop: on the
+        # executor threads, or on worker processes when a pool is given
+        self.executor = executor
+        self.process_pool = process_pool
+        # Caps concurrent Tesseract runs (tiles count individually),
+        # waiting requests are queued by priority
+        self.limiter = limiter
+
+        self.images = 0
+        self.fallbacks = 0
+        self.tiles = 0
+
+    async def extract_text_async(self, image: Image.Image) -> str:
+        """Async wrapper running extraction on the OCR executor or process pool"""
+        if self.mode == "full":
+            async with limited(self.limiter):
+                if self.process_pool is not None:
+                    # The pixels reach the worker through shared memory
+                    return await self.process_pool.run(
+                        recognize, np.asarray(image.convert('L')), *self._recognize_args())
+
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self.executor,
+                    lambda: self.extract_text(image)
+                )
+
+        try:
+            gray = np.asarray(image.convert('L'))
+        except Exception as e:
+            logging.error(e, exc_info=True)
+            return f"Image processing error: {str(e)}"
+
+        # Detection takes milliseconds, only the Tesseract calls take a slot
+        regions = await self._run(detect_text_regions, gray, self.max_tiles)
+        self._count(regions)
+        if not regions:
+            # Detection needs three glyphs in a row, so a caption such as
+            # "ok" finds nothing: read the whole image instead of skipping it
+            return await self._recognize_async(gray)
+
+        async def tile(box):
+            async with limited(self.limiter):
+                return await self._run(recognize, _crop(gray, box), *self._recognize_args())
+
+        return merge_tiles(await asyncio.gather(*(tile(box) for box in regions)))
 
     def extract_text(self, image: Image.Image) -> str:
         """Process image and extract text with error handling"""
         try:
             img = image.convert('L')  # Convert to grayscale
-
-            return pytesseract.image_to_string(
-                img,
-                config=self.tesseract_config,
-                timeout=5
-            )
-        except pytesseract.TesseractError as e:
-            logging.error(e, exc_info=True)
-            return f"OCR Error: {str(e)}"
         except Exception as e:
-            logging.error(e, exc_info=True)
             logging.error(e, exc_info=True)
             return f"Image processing error: {str(e)}"
+
+        gray = np.asarray(img)
+        if self.mode == "full":
+            return self._recognize(gray)
+
+        regions = detect_text_regions(gray, self.max_tiles)
+        self._count(regions)
+        if not regions:
+            return self._recognize(gray)
+        return merge_tiles([self._recognize(_crop(gray, box)) for box in regions])
+
+    @staticmethod
+    def is_error(text: str) -> bool:
+        """Whether extracted text is an error message rather than the image's text"""
+        return _is_error(text)
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "images": self.images, "fallbacks": self.fallbacks, "tiles": self.tiles}
+
+    async def _recognize_async(self, gray: np.ndarray) -> str:
+        """One Tesseract call on the whole image, for tiled mode when no region was found"""
+        async with limited(self.limiter):
+            return await self._run(recognize, gray, *self._recognize_args())
+
+    def _recognize_args(self) -> tuple:
+        # Plain values, so the call pickles for pool workers
+        return self.engine, self.tesseract_config, self.tesseract_path
+
+    def _recognize(self, gray: np.ndarray) -> str:
+        return recognize(gray, *self._recognize_args())
+
+    async def _run(self, fn: Callable, gray: np.ndarray, *args):
+        if self.process_pool is not None:
+            return await self.process_pool.run(fn, gray, *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, gray, *args)
+
+    def _count(self, regions: list):
+        self.images += 1
+        self.tiles += len(regions)
+        if not regions:
+            self.fallbacks += 1
+
+
+def _crop(gray: np.ndarray, box) -> np.ndarray:
+    x, y, width, height = box
+    return gray[y:y + height, x:x + width]
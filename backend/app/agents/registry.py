@@ -0,0 +1,281 @@
+from PIL import Image
+from typing import TYPE_CHECKING, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import time
+import os
+import logging
+from . import OCRAgent, NSFWAgent, ToxicityAgent, MainAgent
+from .nsfw_agent import create_vision_client
+from .nsfw_backends import NSFW_BACKEND, NSFWBackend, VisionBackend, OnnxBackend, FakeBackend
+from app.helpers import ImagePreprocessor, PromptInjectionDetector, ResultCache, NearDuplicateIndex, TextPreClassifier
+from app.helpers import Scheduler, ProcessPool, LLMGateway
+from app.helpers.metrics import Family
+if TYPE_CHECKING:
+    from groq import AsyncGroq
+    from google.cloud import vision
+# Load environment variables from .env file
+load_dotenv()
+
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "10"))
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+# Bounded pools for the CPU bound stages, sized to the cores by default
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+VISION_CONCURRENCY_DEFAULT = 16
+# "thread" runs preprocessing and OCR on the pools above, "process" on a
+# pool of worker processes fed through shared memory
+CPU_POOL = os.getenv("CPU_POOL", "thread").lower()
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+
+class AgentRegistry:
+    """
+    Process-wide holder for the agents and their network clients.
+
+    Built once per worker in the FastAPI lifespan so that every request
+    reuses the same gRPC channel, pooled HTTP connections, compiled
+    regexes and prompt templates instead of constructing them again.
+    Must be built inside the running event loop since the async gRPC and
+    HTTP clients bind to it.
+    """
+
+    def __init__(self):
+        self.groq_client: Optional["AsyncGroq"] = None
+        self.llm_gateway: Optional[LLMGateway] = None
+        self.vision_client: Optional["vision.ImageAnnotatorAsyncClient"] = None
+        self.preprocess_executor: Optional[ThreadPoolExecutor] = None
+        self.ocr_executor: Optional[ThreadPoolExecutor] = None
+        self.nsfw_executor: Optional[ThreadPoolExecutor] = None
+        self.result_cache: Optional[ResultCache] = None
+        self.near_duplicate_index: Optional[NearDuplicateIndex] = None
+        self.text_preclassifier: Optional[TextPreClassifier] = None
+        self.scheduler: Optional[Scheduler] = None
+        self.process_pool: Optional[ProcessPool] = None
+        self.main_agent: Optional[MainAgent] = None
+        self.build_timings: Dict[str, float] = {}
+        self.warmup_seconds = 0.0
+        self.requests_served = 0
+
+    @staticmethod
+    def preload():
+        """
+        Import the SDKs the agents load lazily. They are imported on first
+        use otherwise; calling this on a thread first keeps the event loop
+        free while build() runs.
+        """
+        import groq  # noqa: F401
+        import pytesseract  # noqa: F401
+        if NSFW_BACKEND == "vision":
+            from google.cloud import vision  # noqa: F401
+            import grpc  # noqa: F401
+
+    def build(self) -> "AgentRegistry":
+        """Construct every agent once, recording how long each one takes"""
+        self.preprocess_executor = ThreadPoolExecutor(
+            max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess")
+        self.ocr_executor = ThreadPoolExecutor(
+            max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+        process_mode = CPU_POOL == "process"
+        if process_mode:
+            self.process_pool = self._timed(
+                "process_pool", lambda: ProcessPool(PROCESS_POOL_WORKERS))
+        # Stage limits default to the pool and connection sizes they guard
+        self.scheduler = self._timed("scheduler", lambda: Scheduler.from_env({
+            "preprocess": PROCESS_POOL_WORKERS if process_mode else PREPROCESS_WORKERS,
+            "ocr": PROCESS_POOL_WORKERS if process_mode else OCR_WORKERS,
+            "vision": VISION_CONCURRENCY_DEFAULT,
+            "groq": GROQ_MAX_CONNECTIONS
+        }))
+
+        self.groq_client = self._timed("groq_client", self._build_groq_client)
+        self.llm_gateway = self._timed("llm_gateway", lambda: LLMGateway(
+            self.groq_client, limiter=self.scheduler.stage("groq")))
+        ocr_agent = self._timed(
+            "ocr_agent", lambda: OCRAgent(
+                executor=self.ocr_executor, limiter=self.scheduler.stage("ocr"),
+                process_pool=self.process_pool))
+        nsfw_backend = self._timed("nsfw_backend", self._build_nsfw_backend)
+        nsfw_agent = self._timed("nsfw_agent", lambda: NSFWAgent(
+            executor=self.preprocess_executor, backend=nsfw_backend))
+        self.text_preclassifier = self._timed(
+            "text_preclassifier", TextPreClassifier.from_env)
+        toxicity_agent = self._timed("toxicity_agent", lambda: ToxicityAgent(
+            client=self.groq_client, prefilter=self.text_preclassifier,
+            limiter=self.scheduler.stage("groq"), gateway=self.llm_gateway))
+        preprocessor = self._timed("image_preprocessor", lambda: ImagePreprocessor(
+            executor=self.preprocess_executor, limiter=self.scheduler.stage("preprocess"),
+            process_pool=self.process_pool))
+        detector = self._timed(
+            "prompt_injection_detector", PromptInjectionDetector)
+        self.result_cache = self._timed("result_cache", ResultCache.from_env)
+        self.near_duplicate_index = self._timed(
+            "near_duplicate_index", NearDuplicateIndex.from_env)
+
+        self.main_agent = MainAgent(
+            ocr_agent=ocr_agent,
+            nsfw_agent=nsfw_agent,
+            toxicity_agent=toxicity_agent,
+            image_preprocessor=preprocessor,
+            prompt_injection_detector=detector,
+            groq_client=self.groq_client,
+            result_cache=self.result_cache,
+            near_duplicate_index=self.near_duplicate_index,
+            scheduler=self.scheduler,
+            gateway=self.llm_gateway
+        )
+        return self
+
+    def _build_groq_client(self) -> "AsyncGroq":
+        """Groq client on a pool sized to the groq stage limit"""
+        # Imported here so importing the app doesn't load the Groq SDK
+        from groq import AsyncGroq
+        import httpx
+        return AsyncGroq(
+            api_key=os.getenv("GROQ_API_KEY"),
+            # The gateway retries, with deadlines, hedging and fallback
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=GROQ_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_MAX_KEEPALIVE
+            ))
+        )
+
+    def _build_nsfw_backend(self) -> NSFWBackend:
+        """The NSFW_BACKEND backend, every one limited by the vision stage"""
+        limiter = self.scheduler.stage("vision")
+        if NSFW_BACKEND == "vision":
+            self.vision_client = create_vision_client()
+            return VisionBackend(self.vision_client, limiter=limiter)
+        if NSFW_BACKEND == "onnx":
+            # One inference at a time, ONNX Runtime spreads it over the cores
+            self.nsfw_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nsfw")
+            return OnnxBackend(executor=self.nsfw_executor, limiter=limiter)
+        if NSFW_BACKEND == "fake":
+            return FakeBackend(limiter=limiter)
+        raise ValueError(f"Unknown NSFW backend: {NSFW_BACKEND}")
+
+    async def warmup(self):
+        """Exercise the local stages once so the first request is not cold"""
+        if not WARMUP_ON_STARTUP:
+            return
+        start = time.perf_counter()
+        try:
+            if self.process_pool is not None:
+                await self.process_pool.warmup()
+            dummy = Image.new("RGB", (64, 64), color="white")
+            views = await self.main_agent.imagePreprocessor.preprocess_profiles(dummy)
+            await self.main_agent.ocr_agent.extract_text_async(views["ocr"])
+            await self.main_agent.nsfw_agent.backend.warmup()
+            self.main_agent.promptInjectionDetector.is_injection("warmup")
+        except Exception as e:
+            logging.error(f"Warmup failed: {str(e)}", exc_info=True)
+        self.warmup_seconds = time.perf_counter() - start
+        logging.info(f"Agent warmup finished in {self.warmup_seconds:.3f}s")
+
+    def acquire(self) -> MainAgent:
+        """Return the shared MainAgent for the current request"""
+        self.requests_served += 1
+        return self.main_agent
+
+    async def aclose(self):
+        """Release pooled connections and worker threads"""
+        if self.main_agent is not None:
+            await self.main_agent.aclose()
+        if self.groq_client is not None:
+            try:
+                await self.groq_client.close()
+            except Exception as e:
+                logging.error(e, exc_info=True)
+        if self.vision_client is not None:
+            try:
+                await self.vision_client.transport.close()
+            except Exception as e:
+                logging.error(e, exc_info=True)
+        if self.result_cache is not None:
+            try:
+                await self.result_cache.close()
+            except Exception as e:
+                logging.error(e, exc_info=True)
+        for executor in (self.preprocess_executor, self.ocr_executor, self.nsfw_executor):
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+
+    def stats(self) -> Dict:
+        """Construction cost and the time saved by reusing the agents"""
+        build_seconds = sum(self.build_timings.values())
+        reused = max(self.requests_served - 1, 0)
+        return {
+            "build_seconds": round(build_seconds, 6),
+            "build_timings": {
+                name: round(seconds, 6) for name, seconds in self.build_timings.items()
+            },
+            "warmup_seconds": round(self.warmup_seconds, 6),
+            "requests_served": self.requests_served,
+            "time_saved_per_request_seconds": round(build_seconds, 6),
+            "time_saved_total_seconds": round(build_seconds * reused, 6)
+        }
+
+    def metric_families(self) -> List[Family]:
+        """Prometheus families of the shared objects' counters, collected on each scrape"""
+        families = []
+        caches = {"result": self.result_cache, "near_duplicate": self.near_duplicate_index}
+        caches = {name: cache for name, cache in caches.items() if cache is not None}
+        families.append(("safens_cache_hits_total", "counter", "Cache lookups answered from the cache",
+                         [({"cache": name}, cache.hits) for name, cache in caches.items()]))
+        families.append(("safens_cache_misses_total", "counter", "Cache lookups that missed",
+                         [({"cache": name}, cache.misses) for name, cache in caches.items()]))
+        if self.text_preclassifier is not None:
+            families.append(("safens_text_resolved_total", "counter", "Texts resolved per pre-classifier tier",
+                             [({"tier": tier}, count)
+                              for tier, count in self.text_preclassifier.counters.items()]))
+
+        lanes = self.scheduler.stats()["lanes"]
+        families.append(("safens_admission_in_flight", "gauge", "Requests being served per lane",
+                         [({"lane": name}, lane["in_flight"]) for name, lane in lanes.items()]))
+        families.append(("safens_admission_queued", "gauge", "Requests waiting for admission per lane",
+                         [({"lane": name}, lane["queued"]) for name, lane in lanes.items()]))
+        families.append(("safens_admission_rejected_total", "counter", "Requests turned away with 429",
+                         [({"lane": name}, lane["rejected"]) for name, lane in lanes.items()]))
+        families.append(("safens_admission_timed_out_total", "counter", "Requests turned away with 503",
+                         [({"lane": name}, lane["timed_out"]) for name, lane in lanes.items()]))
+
+        if self.llm_gateway is not None:
+            families.extend(self.llm_gateway.metric_families())
+        if self.main_agent is not None:
+            backend = self.main_agent.nsfw_agent.backend
+            families.append(("safens_nsfw_calls_total", "counter", "Batched NSFW backend calls",
+                             [({"backend": backend.name}, backend.calls)]))
+            families.append(("safens_nsfw_images_total", "counter", "Images rated by the NSFW backend",
+                             [({"backend": backend.name}, backend.images)]))
+            flights = (self.main_agent.image_flights, self.main_agent.text_flights)
+            families.append(("safens_single_flight_leaders_total", "counter",
+                             "Analyses run for requests with no identical one in progress",
+                             [({"kind": flight.name}, flight.leaders) for flight in flights]))
+            families.append(("safens_single_flight_collapsed_total", "counter",
+                             "Requests that waited for an identical one's analysis",
+                             [({"kind": flight.name}, flight.collapsed) for flight in flights]))
+            batcher = self.main_agent.toxicity_agent.batcher
+            families.append(("safens_toxicity_batches_total", "counter",
+                             "Groq calls made for coalesced short texts", [({}, batcher.batches)]))
+            families.append(("safens_toxicity_batched_texts_total", "counter",
+                             "Short texts analyzed through the coalescer", [({}, batcher.items)]))
+            answers = self.main_agent.toxicity_agent.answers
+            families.append(("safens_toxicity_answers_total", "counter",
+                             "Toxicity answers by how they were read: valid, repaired, reasked or invalid",
+                             [({"outcome": outcome}, count) for outcome, count in answers.items()]))
+            ocr = self.main_agent.ocr_agent.stats()
+            families.append(("safens_ocr_tiles_total", "counter", "Tiles read by Tesseract in tiled mode",
+                             [({}, ocr["tiles"])]))
+            families.append(("safens_ocr_fallbacks_total", "counter", "Images without text regions, OCRed whole",
+                             [({}, ocr["fallbacks"])]))
+        return families
+
+    def _timed(self, name: str, factory):
+        start = time.perf_counter()
+        instance = factory()
+        self.build_timings[name] = time.perf_counter() - start
+        return instance
@@ -1,20 +1,70 @@
-from groq import Groq
-from langchain.prompts import PromptTemplate
-from typing import Dict, List
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 import json
+import asyncio
 from dotenv import load_dotenv
 import os
 import logging
+from app.helpers import TextPreClassifier, Limiter, LLMGateway, Batcher, compact_text, split_chunks, estimate_tokens
+from app.helpers import TextTooLongError, truncate_tokens
+from app.helpers import JSONStream, ToxicityAnswer, parse_answer, parse_packed, describe_error
+from app.helpers.text_preclassifier import SEVERITY_RANK
+if TYPE_CHECKING:
+    from groq import AsyncGroq
 # Load environment variables from .env file
 load_dotenv()
 
+# Texts up to this length are packed several to a single Groq prompt
+PACK_MAX_CHARS = int(os.getenv("TOXICITY_PACK_MAX_CHARS", "280"))
+PACK_MAX_ITEMS = int(os.getenv("TOXICITY_PACK_MAX_ITEMS", "10"))
+# Short texts of concurrent requests share one packed prompt, sent after
+# TOXICITY_BATCH_WAIT_MS or once it holds TOXICITY_BATCH_SIZE texts or
+# TOXICITY_BATCH_MAX_TOKENS of them (a size of 1 turns this off)
+TOXICITY_BATCH_SIZE = int(os.getenv("TOXICITY_BATCH_SIZE", str(PACK_MAX_ITEMS)))
+TOXICITY_BATCH_WAIT_MS = float(os.getenv("TOXICITY_BATCH_WAIT_MS", "5"))
+TOXICITY_BATCH_MAX_TOKENS = int(os.getenv("TOXICITY_BATCH_MAX_TOKENS", "2000"))
+# Longer texts are split into overlapping chunks, analyzed concurrently
+CHUNK_TOKENS = int(os.getenv("TOXICITY_CHUNK_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("TOXICITY_CHUNK_OVERLAP_TOKENS", "32"))
+# Chunks grow rather than outnumber this, up to TOXICITY_MAX_CHUNK_TOKENS
+MAX_CHUNKS = int(os.getenv("TOXICITY_MAX_CHUNKS", "8"))
+MAX_CHUNK_TOKENS = int(os.getenv("TOXICITY_MAX_CHUNK_TOKENS", str(CHUNK_TOKENS * 2)))
+# Longer submitted texts are rejected rather than sent as ever larger
+# prompts, longer OCR text is cut to it
+MAX_TEXT_TOKENS = int(os.getenv("TOXICITY_MAX_TEXT_TOKENS", str(CHUNK_TOKENS * MAX_CHUNKS)))
+# Completion budget per text, a compact answer takes 30-100 tokens
+MAX_OUTPUT_TOKENS = int(os.getenv("TOXICITY_MAX_OUTPUT_TOKENS", "200"))
+# Stream single-text answers, so the verdict is known before the rest of
+# the answer is written
+TOXICITY_STREAM = os.getenv("TOXICITY_STREAM", "false").lower() == "true"
+# Times a model is asked again when its answer can't be used even repaired
+TOXICITY_REASK_ATTEMPTS = int(os.getenv("TOXICITY_REASK_ATTEMPTS", "1"))
+
 
 class ToxicityAgent:
-    def __init__(self, model_name: str = "llama-3.3-70b-versatile"):
+    def __init__(self, model_name: str = "llama-3.3-70b-versatile", client: Optional["AsyncGroq"] = None,
+                 prefilter: Optional[TextPreClassifier] = None, limiter: Optional[Limiter] = None,
+                 gateway: Optional[LLMGateway] = None, stream: bool = TOXICITY_STREAM):
 
-        # Initialize Groq client
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        # Reuse the shared Groq client when one is provided
+        if client is None:
+            # Imported here so importing the agents doesn't load the Groq SDK
+            from groq import AsyncGroq
+            client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0)
+        self.client = client
         self.model_name = model_name
+        # Local tier that answers clear-cut texts without calling Groq
+        self.prefilter = prefilter
+        # Caps concurrent Groq calls, shared with the summary calls
+        self.limiter = limiter
+        # Deadlines, retries, hedging and model fallback of every Groq call
+        self.gateway = gateway or LLMGateway(self.client, limiter=limiter)
+        # Groq limits are per request as well as per token, so short texts
+        # arriving together are analyzed with one completion
+        self.batcher = Batcher(
+            "toxicity", self._analyze_short, max_batch=TOXICITY_BATCH_SIZE,
+            max_wait=TOXICITY_BATCH_WAIT_MS / 1000, max_weight=TOXICITY_BATCH_MAX_TOKENS,
+            weigh=estimate_tokens)
+        self.stream = stream
 
         # Define toxicity categories
         self.categories = {
@@ -26,83 +76,318 @@ class ToxicityAgent:
             "violence": "Graphic violence"
         }
 
-        # LangChain prompt template (unchanged)
-        self.prompt = PromptTemplate(
-            input_variables=["text"],
-            template="""
-            Analyze this text for toxicity and respond in STRICT JSON format:
-            {{
-                "is_toxic": boolean,
-                "confidence": float (0.0-1.0),
-                "categories": ["hate_speech", "harassment", "threats", "sexual", "self_harm", "violence"],
-                "reasoning": "string",
-                "offensive_words": [
-                    {{
-                        "word": "string",
-                        "category": "string",
-                        "severity": "low|medium|high"
-                    }}
-                ],
-                "overall_severity": "low|medium|high"
-            }}
-
-            [Previous template content remains exactly the same...]
-            Text to Analyze: "{text}"
-            """
+        # Compact schema: one letter keys, category and severity codes and
+        # each offensive word once, so answers take few output tokens.
+        # Plain str.format templates, the doubled braces are literal ones
+        self.prompt = (
+            "Rate the text below for toxicity. Answer with minified JSON only:\n"
+            '{{"t":1 if toxic else 0,"c":confidence 0.0-1.0,"k":[category codes],"s":"l|m|h",'
+            '"w":[["word","category code","l|m|h"]],"r":"reason, at most 15 words"}}\n'
+            "Category codes: H hate speech, A harassment, T threats, S sexual, X self-harm, V violence. "
+            "s is the overall severity (low, medium, high). List each offensive word once, at most 10. "
+            "Use empty lists for safe text.\n"
+            "Text: {text}"
+        )
+
+        # Several short texts analyzed in a single completion
+        self.batch_prompt = (
+            "Rate each text below for toxicity, independently of one another. Answer with minified "
+            "JSON only, one entry per text in the same order:\n"
+            '{{"a":[{{"i":id of the text,"t":1 if toxic else 0,"c":confidence 0.0-1.0,"k":[category codes],'
+            '"s":"l|m|h","w":[["word","category code","l|m|h"]],"r":"reason, at most 15 words"}}]}}\n'
+            "Category codes: H hate speech, A harassment, T threats, S sexual, X self-harm, V violence. "
+            "s is the overall severity (low, medium, high). List each offensive word once, at most 10. "
+            "Use empty lists for safe text.\n"
+            "Texts (JSON array): {items}"
         )
 
-    def analyze(self, text: str) -> Dict:
-        """Analyze text for toxicity using Groq"""
+        # Follows the first prompt and the unusable answer
+        self.reask_prompt = (
+            "That answer could not be used ({error}). Answer again with minified JSON only, "
+            'in the schema given above, starting with "t".'
+        )
+
+        self.calls = 0
+        self.chunked_texts = 0
+        self.chunks = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # How answers were read: as given, repaired, after asking again, or not at all
+        self.answers = {"valid": 0, "repaired": 0, "reasked": 0, "invalid": 0}
+
+    async def analyze(self, text: str, on_verdict: Optional[Callable[[bool], None]] = None,
+                      truncate: bool = False) -> Dict:
+        """
+        Analyze text for toxicity using Groq. When answers are streamed,
+        on_verdict is called with the model's is_toxic as soon as it is
+        written, before the rest of the answer; it is only a hint, the
+        returned result has the final say. A text over MAX_TEXT_TOKENS
+        raises TextTooLongError, or with truncate only its first
+        MAX_TEXT_TOKENS are analyzed and the result is marked partial.
+        """
         if not text.strip():
             return self._safe_response()
 
+        if self.prefilter is not None:
+            local_result = self.prefilter.classify(text)
+            if local_result is not None:
+                return local_result
+
+        text = compact_text(text)
+        if not text:
+            return self._safe_response()
+        tokens = estimate_tokens(text)
+        if truncate and tokens > MAX_TEXT_TOKENS:
+            result = await self._analyze_compacted(truncate_tokens(text, MAX_TEXT_TOKENS), on_verdict)
+            return dict(result, partial=True)
+        self._check_tokens(tokens)
+        return await self._analyze_compacted(text, on_verdict)
+
+    async def _analyze_compacted(self, text: str, on_verdict: Optional[Callable[[bool], None]]) -> Dict:
+        chunks = split_chunks(text, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, MAX_CHUNKS, MAX_CHUNK_TOKENS)
+        if len(chunks) == 1:
+            # Packed answers aren't streamed, a caller waiting for the verdict gets its own call
+            early = self.stream and on_verdict is not None
+            if self.batcher.max_batch > 1 and len(chunks[0]) <= PACK_MAX_CHARS and not early:
+                return await self.batcher.submit(chunks[0])
+            return await self._analyze_remote(chunks[0], on_verdict)
+
+        def on_chunk_verdict(is_toxic: bool):
+            # One toxic chunk makes the text toxic, a safe one says nothing yet
+            if is_toxic and on_verdict is not None:
+                on_verdict(True)
+
+        self.chunked_texts += 1
+        self.chunks += len(chunks)
+        return self._merge(await asyncio.gather(*(
+            self._analyze_remote(chunk, on_chunk_verdict) for chunk in chunks)))
+
+    async def _analyze_remote(self, text: str, on_verdict: Optional[Callable[[bool], None]] = None) -> Dict:
+        """Ask the Groq model for a toxicity analysis, again if its answer can't be used"""
+        messages = [{"role": "user", "content": self.prompt.format(text=json.dumps(text, ensure_ascii=False))}]
         try:
-            # Generate prompt
-            formatted_prompt = self.prompt.format(text=text)
+            for attempt in range(TOXICITY_REASK_ATTEMPTS + 1):
+                content, model = await self._complete(messages, on_verdict if attempt == 0 else None)
+                try:
+                    return dict(self._parse(content), model=model)
+                except ValueError as e:
+                    if attempt == TOXICITY_REASK_ATTEMPTS:
+                        self.answers["invalid"] += 1
+                        raise ValueError(f"Unusable toxicity answer: {describe_error(e)}") from e
+                    self.answers["reasked"] += 1
+                    logging.info(f"Asking {model} again for a toxicity answer: {describe_error(e)}")
+                    messages = [messages[0], {"role": "assistant", "content": content},
+                                {"role": "user", "content": self.reask_prompt.format(error=describe_error(e))}]
 
-            # Call Groq API
-            response = self.client.chat.completions.create(
-                messages=[{"role": "user", "content": formatted_prompt}],
-                model=self.model_name,
+        except Exception as e:
+            logging.error(e, exc_info=True)
+            # Unknown rather than False, a failed check must never read as safe
+            return {
+                "is_toxic": None,
+                "error": str(e),
+                "retry_after": getattr(e, "retry_after", None),
+                "raw_response": str(content)[:200] if 'content' in locals() else None
+            }
+
+    async def _complete(self, messages: List[Dict], on_verdict: Optional[Callable[[bool], None]]) -> Tuple[str, str]:
+        """The answer to messages and the model that wrote it, streamed when self.stream is set"""
+        if not self.stream:
+            response = await self.gateway.create(
+                "toxicity", self.model_name,
+                messages=messages,
                 temperature=0.1,
-                max_tokens=1000,
+                max_tokens=MAX_OUTPUT_TOKENS,
                 response_format={"type": "json_object"}  # Force JSON output
             )
+            self._count(getattr(response, "usage", None))
+            return response.choices[0].message.content, self._answered_by(response)
 
-            # Extract and parse response
-            result = response.choices[0].message.content
-            if result.startswith("```json"):
-                result = result[7:-3].strip()
+        # JSON mode can't be streamed, fences or prose around the object are
+        # skipped by the parser and dropped by the repair
+        answer = JSONStream()
+        model, usage = self.model_name, None
+        async for chunk in self.gateway.stream(
+                "toxicity_stream", self.model_name,
+                messages=messages,
+                temperature=0.1,
+                max_tokens=MAX_OUTPUT_TOKENS):
+            model = getattr(chunk, "model", None) or model
+            x_groq = getattr(chunk, "x_groq", None)
+            if getattr(x_groq, "usage", None) is not None:
+                # Groq reports it on the last chunk
+                usage = x_groq.usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            for key, value in answer.feed(delta):
+                if key in ("t", "is_toxic") and on_verdict is not None and value in (0, 1):
+                    on_verdict(bool(value))
+        self._count(usage)
+        return answer.text, model
 
-            data = json.loads(result)
+    def _parse(self, content: str) -> Dict:
+        """Validated result from the model's JSON answer, repaired if it has to be"""
+        answer, repaired = parse_answer(content)
+        self.answers["repaired" if repaired else "valid"] += 1
+        return self._result(answer)
 
-            # Validate output
-            return {
+    def _parse_packed(self, content: str, count: int) -> Dict[int, Dict]:
+        """Validated results by text id from a packed JSON answer"""
+        answers, repaired = parse_packed(content, count)
+        self.answers["repaired" if repaired else "valid"] += len(answers)
+        return {index: self._result(answer) for index, answer in answers.items()}
 
-                "is_toxic": bool(data.get("is_toxic", False)),
-                "confidence": max(0.0, min(1.0, float(data.get("confidence", 0.0)))),
-                "categories": [
-                    cat for cat in data.get("categories", [])
-                    if cat in self.categories
-                ],
-                "reasoning": str(data.get("reasoning", "No reasoning provided")),
-                "offensive_words": [
-                    off for off in data.get("offensive_words", [])
-                ],
-                "severity": data.get("severity", "low"),
-                "model": self.model_name
+    def _result(self, answer: ToxicityAnswer) -> Dict:
+        """The agent's result shape of a validated answer"""
+        return {
+            "is_toxic": answer.is_toxic,
+            "confidence": answer.confidence,
+            "categories": answer.categories,
+            "reasoning": answer.reasoning,
+            "offensive_words": answer.offensive_words,
+            "severity": answer.severity,
+            "model": self.model_name
+        }
 
-            }
+    def _merge(self, results: List[Dict]) -> Dict:
+        """One result for a text from the results of its chunks"""
+        toxic = [result for result in results if result.get("is_toxic") and "error" not in result]
+        failed = [result for result in results if "error" in result]
+        if failed and not toxic:
+            # A chunk that wasn't checked may be what makes the text toxic
+            return failed[0]
 
+        chosen = toxic or results
+        words, seen = [], set()
+        for result in chosen:
+            for word in result.get("offensive_words", []):
+                key = (word.get("word", "") if isinstance(word, dict) else str(word)).lower()
+                if key not in seen:
+                    seen.add(key)
+                    words.append(word)
+        return {
+            "is_toxic": bool(toxic),
+            # How sure the most certain toxic chunk is, or the least certain safe one
+            "confidence": (max(result["confidence"] for result in toxic) if toxic
+                           else min(result["confidence"] for result in results)),
+            "categories": list(dict.fromkeys(
+                category for result in chosen for category in result.get("categories", []))),
+            "reasoning": " ".join(dict.fromkeys(result.get("reasoning", "") for result in chosen)).strip(),
+            "offensive_words": words,
+            "severity": max((result.get("severity", "low") for result in chosen),
+                            key=lambda severity: SEVERITY_RANK.get(severity, 0)),
+            "model": self.model_name,
+            "chunks": len(results)
+        }
+
+    def _answered_by(self, response) -> str:
+        """The model that wrote response, the fallback model when the gateway fell back"""
+        return getattr(response, "model", None) or self.model_name
+
+    def _count(self, usage):
+        """Token accounting of one completion"""
+        self.calls += 1
+        self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    @staticmethod
+    def check_length(text: str):
+        """Raise TextTooLongError when text, compacted as analyze does, is over MAX_TEXT_TOKENS"""
+        ToxicityAgent._check_tokens(estimate_tokens(compact_text(text)))
+
+    @staticmethod
+    def _check_tokens(tokens: int):
+        if tokens > MAX_TEXT_TOKENS:
+            raise TextTooLongError(f"Text of about {tokens} tokens is over the {MAX_TEXT_TOKENS} token limit")
+
+    def stats(self) -> Dict:
+        """Groq calls, chunking and tokens per call"""
+        return {
+            "calls": self.calls,
+            "chunked_texts": self.chunked_texts,
+            "chunks": self.chunks,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "mean_prompt_tokens": round(self.prompt_tokens / self.calls, 1) if self.calls else 0.0,
+            "mean_completion_tokens": round(self.completion_tokens / self.calls, 1) if self.calls else 0.0,
+            "batching": self.batcher.stats(),
+            "answers": dict(self.answers)
+        }
+
+    def plan_packs(self, texts: List[str]) -> List[List[int]]:
+        """
+        Group text indices into Groq calls: short texts are packed together,
+        long ones get a call of their own.
+        """
+        packs, current = [], []
+        for index, text in enumerate(texts):
+            if len(text) > PACK_MAX_CHARS:
+                packs.append([index])
+                continue
+            current.append(index)
+            if len(current) >= PACK_MAX_ITEMS:
+                packs.append(current)
+                current = []
+        if current:
+            packs.append(current)
+        return packs
+
+    async def analyze_packed(self, texts: List[str]) -> List[Dict]:
+        """Analyze several short texts with one completion"""
+        if len(texts) == 1:
+            return [await self.analyze(texts[0])]
+
+        results: List[Optional[Dict]] = [None] * len(texts)
+        items = []
+        for index, text in enumerate(texts):
+            if not text.strip():
+                results[index] = self._safe_response()
+                continue
+            if self.prefilter is not None:
+                results[index] = self.prefilter.classify(text)
+            if results[index] is None:
+                compacted = compact_text(text)
+                if compacted:
+                    items.append({"id": index, "text": compacted})
+                else:
+                    results[index] = self._safe_response()
+
+        analyzed = await self._analyze_short([item["text"] for item in items]) if items else []
+        for item, result in zip(items, analyzed):
+            results[item["id"]] = result
+        return results
+
+    async def _analyze_short(self, texts: List[str]) -> List[Dict]:
+        """Results of compacted short texts, several texts share a packed prompt"""
+        if len(texts) == 1:
+            return [await self._analyze_remote(texts[0])]
+
+        results: List[Optional[Dict]] = [None] * len(texts)
+        items = [{"id": index, "text": text} for index, text in enumerate(texts)]
+        try:
+            response = await self.gateway.create(
+                "toxicity_packed", self.model_name,
+                messages=[{"role": "user", "content": self.batch_prompt.format(
+                    items=json.dumps(items, ensure_ascii=False))}],
+                temperature=0.1,
+                max_tokens=min(MAX_OUTPUT_TOKENS * len(items), 4000),
+                response_format={"type": "json_object"}
+            )
+            self._count(getattr(response, "usage", None))
+            packed = self._parse_packed(response.choices[0].message.content, len(texts))
+            for index, result in packed.items():
+                results[index] = dict(result, model=self._answered_by(response))
         except Exception as e:
             logging.error(e, exc_info=True)
-            return {
-                "is_toxic": False,
-                "error": str(e),
-                "raw_response": str(result)[:200] if 'result' in locals() else None
-            }
 
-    # [Rest of the class remains unchanged...]
+        # Anything the packed answer missed is retried on its own
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            retried = await asyncio.gather(*(self._analyze_remote(texts[i]) for i in missing))
+            for index, result in zip(missing, retried):
+                results[index] = result
+        return results
+
     def _safe_response(self) -> Dict:
         """Default for empty input"""
         return {
@@ -113,6 +398,13 @@ class ToxicityAgent:
             "severity": "low"
         }
 
-    def batch_analyze(self, texts: List[str]) -> List[Dict]:
-        """Process multiple texts (sequentially)"""
-        return [self.analyze(text) for text in texts]
+    async def batch_analyze(self, texts: List[str]) -> List[Dict]:
+        """Process multiple texts (concurrently, short ones packed together)"""
+        results: List[Optional[Dict]] = [None] * len(texts)
+        packs = self.plan_packs(texts)
+        packed = await asyncio.gather(*(
+            self.analyze_packed([texts[i] for i in pack]) for pack in packs))
+        for pack, pack_results in zip(packs, packed):
+            for index, result in zip(pack, pack_results):
+                results[index] = result
+        return results
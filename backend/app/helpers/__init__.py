@@ -1,4 +1,27 @@
 from .img_preprocessor import ImagePreprocessor
 from .prompt_injection_detector import PromptInjectionDetector
+from .result_cache import ResultCache, CACHE_STATUS
+from .perceptual_hash import NearDuplicateIndex
+from .aho_corasick import AhoCorasick
+from .text_preclassifier import TextPreClassifier
+from .image_input import ImageTooLargeError, sniff_image_format, read_upload, open_image
+from .scheduler import Scheduler, Limiter, AdmissionError, limited
+from .process_pool import ProcessPool
+from .text_regions import detect_text_regions
+from .batcher import Batcher
+from .metrics import (METRICS, REQUEST_TIMINGS, REQUEST_TOKENS, MetricsMiddleware, stage, record_stage,
+                      external_call, record_tokens, server_timing)
+from .prompt_budget import estimate_tokens, compact_text, split_chunks, truncate_tokens, TextTooLongError
+from .llm_gateway import LLMGateway, LLMUnavailableError, CircuitBreaker
+from .single_flight import SingleFlight
+from .llm_json import JSONStream, repair_json
+from .toxicity_schema import ToxicityAnswer, parse_answer, parse_packed, describe_error
 
-__all__ = ["ImagePreprocessor", "PromptInjectionDetector"]
+__all__ = ["ImagePreprocessor", "PromptInjectionDetector", "ResultCache", "CACHE_STATUS", "NearDuplicateIndex",
+           "AhoCorasick", "TextPreClassifier", "ImageTooLargeError", "sniff_image_format", "read_upload",
+           "open_image", "Scheduler", "Limiter", "AdmissionError", "limited",
+           "ProcessPool", "detect_text_regions", "Batcher", "METRICS", "REQUEST_TIMINGS", "REQUEST_TOKENS",
+           "MetricsMiddleware", "stage", "record_stage", "external_call", "record_tokens", "server_timing",
+           "estimate_tokens", "compact_text", "split_chunks", "truncate_tokens", "TextTooLongError", "LLMGateway", "LLMUnavailableError",
+           "CircuitBreaker", "SingleFlight", "JSONStream", "repair_json", "ToxicityAnswer", "parse_answer",
+           "parse_packed", "describe_error"]
@@ -0,0 +1,83 @@
+from collections import deque
+from typing import Iterable, Iterator, List, Tuple
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher.
+
+    Finds every occurrence of every pattern, overlapping ones included,
+    in a single left-to-right pass over the text regardless of how many
+    patterns there are.
+    """
+
+    def __init__(self, patterns: Iterable[str], word_boundaries: bool = False):
+        """
+        Args:
+            patterns (iterable): Lowercase strings to search for
+            word_boundaries (bool): Only report matches not embedded in a longer word
+        """
+        self.word_boundaries = word_boundaries
+        self._goto: List[dict] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+        self.patterns = []
+
+        for pattern in patterns:
+            if pattern and pattern not in self.patterns:
+                self.patterns.append(pattern)
+                self._insert(pattern)
+        self._build()
+
+    def _insert(self, pattern: str):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append(pattern)
+
+    def _build(self):
+        """Breadth-first construction of the failure links"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """Yield (start, end, pattern) for every match in text"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not out[state]:
+                continue
+            end = index + 1
+            for pattern in out[state]:
+                start = end - len(pattern)
+                if self.word_boundaries and not self._is_word(text, start, end):
+                    continue
+                yield start, end, pattern
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        return list(self.iter_matches(text))
+
+    @staticmethod
+    def _is_word(text: str, start: int, end: int) -> bool:
+        before = text[start - 1] if start > 0 else " "
+        after = text[end] if end < len(text) else " "
+        return not before.isalnum() and not after.isalnum()
@@ -0,0 +1,146 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from .scheduler import Limiter, limited, REQUEST_PRIORITY
+from .metrics import REQUEST_TIMINGS, REQUEST_TOKENS
+import asyncio
+import contextvars
+
+
+class Batcher:
+    """
+    Coalesces concurrent submissions into one call of `handler`.
+
+    The first item to arrive opens a batch that closes after max_wait
+    seconds (or at the next event loop iteration when max_wait is 0), or as
+    soon as it holds max_batch items or max_weight in total `weigh(item)`.
+    handler receives the items in arrival order and returns one result
+    per item. An exception from handler is raised to every submitter.
+
+    A batch runs on behalf of all its submitters rather than whichever
+    one flushed it: at the most urgent of their priorities, with its
+    stage timings added to every submitter's request and its LLM tokens
+    split among them, prompt tokens by weight and the rest evenly.
+    """
+
+    def __init__(self, name: str, handler: Callable[[List[Any]], Awaitable[List[Any]]],
+                 max_batch: int = 16, max_wait: float = 0.0, max_weight: Optional[int] = None,
+                 weigh: Optional[Callable[[Any], int]] = None, limiter: Optional[Limiter] = None):
+        self.name = name
+        self.handler = handler
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.max_weight = max_weight
+        self.weigh = weigh
+        # Caps concurrent handler calls, each batch takes one slot
+        self.limiter = limiter
+        self._pending: List[tuple] = []
+        self._weight = 0
+        self._timer: Optional[asyncio.Handle] = None
+        self._tasks = set()
+
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+
+    async def submit(self, item: Any) -> Any:
+        """Result of item, once its batch has run"""
+        weight = self.weigh(item) if self.weigh else 0
+        if self.max_weight is not None and self._pending and self._weight + weight > self.max_weight:
+            self._flush()
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future, weight, REQUEST_PRIORITY.get(),
+                              REQUEST_TOKENS.get(), REQUEST_TIMINGS.get()))
+        self._weight += weight
+        if len(self._pending) >= self.max_batch or (
+                self.max_weight is not None and self._weight >= self.max_weight):
+            self._flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = (loop.call_later(self.max_wait, self._flush) if self.max_wait > 0
+                           else loop.call_soon(self._flush))
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._weight = self._pending, [], 0
+        if not batch:
+            return
+        # In a context of its own, not the one of the submitter that flushed
+        task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._run(batch))
+        # Keep a reference until it's done, the loop only holds weak ones
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[tuple]):
+        # Everyone may have given up while the batch was filling
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+        REQUEST_PRIORITY.set(min(entry[3] for entry in batch))
+        tokens = {"prompt": 0, "completion": 0, "calls": 0}
+        timings: Dict[str, float] = {}
+        REQUEST_TOKENS.set(tokens)
+        REQUEST_TIMINGS.set(timings)
+        try:
+            async with limited(self.limiter):
+                results = await self.handler([entry[0] for entry in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name} returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for entry in batch:
+                if not entry[1].done():
+                    entry[1].set_exception(e)
+            return
+        except asyncio.CancelledError:
+            for entry in batch:
+                entry[1].cancel()
+            raise
+        finally:
+            self._charge(batch, tokens, timings)
+
+        self.batches += 1
+        self.items += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        for entry, result in zip(batch, results):
+            if not entry[1].done():
+                entry[1].set_result(result)
+
+    @staticmethod
+    def _charge(batch: List[tuple], tokens: Dict[str, int], timings: Dict[str, float]):
+        """Add what the batch took to the request of each of its submitters"""
+        weights = [entry[2] for entry in batch]
+        prompt = _shares(tokens["prompt"], weights if any(weights) else [1] * len(batch))
+        completion = _shares(tokens["completion"], [1] * len(batch))
+        for entry, prompt_share, completion_share in zip(batch, prompt, completion):
+            request_tokens, request_timings = entry[4], entry[5]
+            if request_tokens is not None:
+                request_tokens["prompt"] += prompt_share
+                request_tokens["completion"] += completion_share
+                # Each request was waiting on every call of the batch
+                request_tokens["calls"] += tokens["calls"]
+            if request_timings is not None:
+                for name, seconds in timings.items():
+                    request_timings[name] = request_timings.get(name, 0.0) + seconds
+
+    def stats(self) -> Dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "pending": len(self._pending)
+        }
+
+
+def _shares(total: int, weights: List[int]) -> List[int]:
+    """total split in proportion to weights, in whole units that add up to it"""
+    whole = sum(weights)
+    exact = [total * weight / whole for weight in weights]
+    shares = [int(share) for share in exact]
+    # Hand the units lost to rounding down to the largest remainders
+    by_remainder = sorted(range(len(weights)), key=lambda i: shares[i] - exact[i])
+    for i in by_remainder[:total - sum(shares)]:
+        shares[i] += 1
+    return shares
@@ -0,0 +1,79 @@
+from PIL import Image, UnidentifiedImageError
+from typing import Optional, Union
+from dotenv import load_dotenv
+import io
+import os
+# Load environment variables from .env file
+load_dotenv()
+
+# Largest upload accepted, checked while the body is streamed in
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(50 * 1024 * 1024)))
+# Largest decoded size accepted, guards against decompression bombs
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "100000000"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# (offset, magic bytes, format) of the formats PIL can decode for us
+_SIGNATURES = (
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"GIF87a", "gif"),
+    (0, b"GIF89a", "gif"),
+    (8, b"WEBP", "webp"),
+    (0, b"BM", "bmp"),
+    (0, b"II*\x00", "tiff"),
+    (0, b"MM\x00*", "tiff"),
+)
+
+
+class ImageTooLargeError(ValueError):
+    """The upload is over IMAGE_MAX_BYTES or IMAGE_MAX_PIXELS"""
+
+
+def sniff_image_format(data: Union[bytes, bytearray, memoryview]) -> Optional[str]:
+    """Image format from the leading magic bytes, None if not a supported image"""
+    header = memoryview(data)[:16]
+    for offset, magic, name in _SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            if name == "webp" and header[:4] != b"RIFF":
+                continue
+            return name
+    return None
+
+
+async def read_upload(upload, max_bytes: int = IMAGE_MAX_BYTES) -> bytes:
+    """
+    Read an UploadFile in chunks, rejecting non-images after the first
+    chunk and oversized bodies as soon as they pass max_bytes.
+    """
+    buffer = bytearray()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise ImageTooLargeError(f"Image larger than {max_bytes} bytes")
+        if len(buffer) == len(chunk) and sniff_image_format(buffer) is None:
+            raise ValueError("Invalid image file")
+    if sniff_image_format(buffer) is None:
+        raise ValueError("Invalid image file")
+    return bytes(buffer)
+
+
+def open_image(contents: bytes, max_pixels: int = IMAGE_MAX_PIXELS) -> Image.Image:
+    """
+    Validate image bytes and open them lazily, raising ValueError if unusable.
+
+    Only the header is parsed here. Pixels are decoded once, later, by
+    ImagePreprocessor, which can ask the JPEG decoder for a reduced size.
+    """
+    if sniff_image_format(contents) is None:
+        raise ValueError("Invalid image file")
+    try:
+        img = Image.open(io.BytesIO(contents))
+    except (UnidentifiedImageError, OSError):
+        raise ValueError("Invalid image format")
+    width, height = img.size
+    if width * height > max_pixels:
+        raise ImageTooLargeError(f"Image larger than {max_pixels} pixels")
+    return img
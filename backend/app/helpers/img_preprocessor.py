@@ -1,13 +1,34 @@
 from PIL import Image
+from dotenv import load_dotenv
 import cv2
 import numpy as np
 import asyncio
-from skimage.filters import gaussian, median
 import io
-from typing import Dict
+import os
+from typing import Dict, Iterable, Optional
+from concurrent.futures import Executor
+from .perceptual_hash import perceptual_hash
+from .scheduler import Limiter, limited
+from .process_pool import ProcessPool
+# Load environment variables from .env file
+load_dotenv()
+
+# Longest side of the image sent to Google Vision, SafeSearch and object
+# localization don't gain anything from more pixels than this
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "1024"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+# Adaptive threshold neighbourhood (odd) and offset for the OCR profile
+OCR_THRESHOLD_BLOCK = int(os.getenv("OCR_THRESHOLD_BLOCK", "31"))
+OCR_THRESHOLD_C = int(os.getenv("OCR_THRESHOLD_C", "15"))
 
 class ImagePreprocessor:
-    def __init__(self, target_size=(1600, 1200), gaussian_sigma=1, mean_kernel_size=3, quality=90):
+    PROFILES = ("enhanced", "vision", "ocr")
+
+    def __init__(self, target_size=(1600, 1200), gaussian_sigma=1, mean_kernel_size=3, quality=90,
+                 executor: Optional[Executor] = None, vision_max_side=VISION_MAX_SIDE,
+                 vision_quality=VISION_JPEG_QUALITY, ocr_block_size=OCR_THRESHOLD_BLOCK,
+                 ocr_threshold_c=OCR_THRESHOLD_C, limiter: Optional[Limiter] = None,
+                 process_pool: Optional[ProcessPool] = None):
         """
         Initialize the preprocessor with default parameters
         
@@ -16,40 +37,169 @@ class ImagePreprocessor:
             gaussian_sigma (float): Sigma for Gaussian filter
             mean_kernel_size (int): Kernel size for mean filtering
             quality (int): JPEG quality for output
+            executor (Executor): Pool to run preprocessing on (default loop executor)
+            vision_max_side (int): Longest side of the "vision" profile JPEG
+            vision_quality (int): JPEG quality of the "vision" profile
+            ocr_block_size (int): Adaptive threshold neighbourhood of the "ocr" profile
+            ocr_threshold_c (int): Constant subtracted from the neighbourhood mean
+            limiter (Limiter): Caps how many images are preprocessed at once
+            process_pool (ProcessPool): Build the profiles in worker processes instead of executor threads
         """
         self.target_size = target_size
         self.gaussian_sigma = gaussian_sigma
         self.mean_kernel_size = mean_kernel_size
         self.quality = quality
+        self.executor = executor
+        self.vision_max_side = vision_max_side
+        self.vision_quality = vision_quality
+        self.ocr_block_size = ocr_block_size | 1
+        self.ocr_threshold_c = ocr_threshold_c
+        self.limiter = limiter
+        self.process_pool = process_pool
+        self._clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        self._sharpen_kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float32)
+
+    def __getstate__(self):
+        # Sent to worker processes with the profile builders, leave the
+        # pools, the limiter and the (unpicklable) CLAHE object behind
+        state = self.__dict__.copy()
+        for name in ("executor", "limiter", "process_pool", "_clahe"):
+            state[name] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         
     async def preprocess(self, image: Image.Image) -> Image.Image:
         """Async wrapper for image preprocessing"""
         loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(
-            None, 
-            lambda: self._sync_preprocess(image)
-        )
+        async with limited(self.limiter):
+            return await loop.run_in_executor(
+                self.executor,
+                lambda: self._sync_preprocess(image)
+            )
     
+    async def preprocess_profiles(self, image: Image.Image,
+                                  profiles: Iterable[str] = ("vision", "ocr")) -> Dict:
+        """
+        Decode once, then build each named profile concurrently.
+
+        Returns {"phash": int, <profile>: output} where "enhanced" is the
+        full filter pipeline as a PIL image, "vision" is a downscaled
+        JPEG (bytes) for Google Vision and "ocr" is a binarized grayscale
+        PIL image for Tesseract.
+        """
+        profiles = tuple(profiles)
+        unknown = set(profiles) - set(self.PROFILES)
+        if unknown:
+            raise ValueError(f"Unknown preprocessing profiles: {sorted(unknown)}")
+
+        loop = asyncio.get_running_loop()
+        async with limited(self.limiter):
+            img = await loop.run_in_executor(self.executor, self._decode, image)
+
+            if self.process_pool is not None:
+                # The decoded array reaches the worker through shared memory
+                views = await self.process_pool.run(self._build_profiles, img, profiles)
+            else:
+                # The array is shared read-only, every profile allocates its own output
+                builders = self._builders()
+                phash, *outputs = await asyncio.gather(
+                    loop.run_in_executor(self.executor, lambda: perceptual_hash(self._to_gray(img))),
+                    *(loop.run_in_executor(self.executor, builders[name], img) for name in profiles)
+                )
+                views = {"phash": phash, **dict(zip(profiles, outputs))}
+
+        return {
+            name: Image.fromarray(view) if isinstance(view, np.ndarray) else view
+            for name, view in views.items()
+        }
+
+    def _builders(self) -> Dict:
+        return {
+            "enhanced": self._enhanced_profile,
+            "vision": self._vision_profile,
+            "ocr": self._ocr_profile
+        }
+
+    def _build_profiles(self, img: np.ndarray, profiles: tuple) -> Dict:
+        """Worker process side of preprocess_profiles, one image at a time"""
+        builders = self._builders()
+        views = {"phash": perceptual_hash(self._to_gray(img))}
+        for name in profiles:
+            views[name] = builders[name](img)
+        return views
+
     def _sync_preprocess(self, image: Image.Image) -> Image.Image:
-        """Actual preprocessing logic"""
-        img = np.array(image)
-        
-        if len(img.shape) == 3 and img.shape[2] == 3:
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        """Actual preprocessing logic, kept in uint8 RGB (or gray) throughout"""
+        img = self._decode(image)
+
+        # Fingerprint before enhancement so near-duplicates hash alike
+        phash = perceptual_hash(self._to_gray(img))
+
+        result = Image.fromarray(self._enhanced_profile(img))
+        result.info["phash"] = phash
+        return result
+
+    def _decode(self, image: Image.Image) -> np.ndarray:
+        """RGB or gray uint8 array, resized to the target size"""
+        if image.format == "JPEG":
+            # Let libjpeg decode straight to the smallest 1/2, 1/4 or 1/8
+            # scale still at least as large as the resize target, a 48 MP
+            # photo then never exists in memory at full resolution
+            w, h = image.size
+            ratio = min(self.target_size[0] / w, self.target_size[1] / h)
+            if ratio < 1:
+                image.draft(None, (int(w * ratio), int(h * ratio)))
+        try:
+            image.load()
+        except OSError:
+            raise ValueError("Invalid image format")
+
+        if image.mode in ("1", "LA", "I", "I;16", "F"):
+            image = image.convert("L")
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        img = np.asarray(image)
         
         # 1. Resize (maintain aspect ratio)
-        img = self._smart_resize(img)
-        
+        return self._smart_resize(img)
+
+    def _enhanced_profile(self, img: np.ndarray) -> np.ndarray:
+        """Contrast, sharpening and denoising for a human-viewable image"""
         # 2. Quality optimization
         img = self._optimize_quality(img)
         
         # 3. Apply filters
-        img = self._apply_filters(img)
-        
+        return self._apply_filters(img)
 
+    def _vision_profile(self, img: np.ndarray) -> bytes:
+        """Downscaled JPEG, Vision does its own normalization"""
+        h, w = img.shape[:2]
+        ratio = self.vision_max_side / max(h, w)
+        if ratio < 1:
+            img = cv2.resize(img, (max(int(w * ratio), 1), max(int(h * ratio), 1)),
+                             interpolation=cv2.INTER_AREA)
         if len(img.shape) == 3:
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        return Image.fromarray(img)
+            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, self.vision_quality])
+        if not ok:
+            raise ValueError("Could not encode image for Vision")
+        return encoded.tobytes()
+
+    def _ocr_profile(self, img: np.ndarray) -> np.ndarray:
+        """Binarized grayscale, what Tesseract segments best"""
+        gray = cv2.medianBlur(self._to_gray(img), 3)
+        return cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+            self.ocr_block_size, self.ocr_threshold_c)
+
+    def _to_gray(self, img):
+        """Grayscale view of an RGB or already gray array"""
+        if len(img.shape) == 2:
+            return img
+        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
 
     def _load_and_orient(self, image_path):
         """Load image and handle orientation (EXIF)"""
@@ -91,58 +241,52 @@ class ImagePreprocessor:
         return img
     
     def _optimize_quality(self, img):
-        """Optimize image quality with contrast enhancement and sharpening"""
+        """Optimize image contrast with CLAHE on the luma channel"""
 
         if len(img.shape) == 2:
             return img
-            
 
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
+        # YCrCb is a far cheaper round trip from RGB than LAB and its Y
+        # channel serves the same purpose for contrast equalization
+        ycrcb = cv2.cvtColor(img, cv2.COLOR_RGB2YCrCb)
         
         # Mild CLAHE for contrast enhancement
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        l = clahe.apply(l)
-        
-        lab = cv2.merge((l, a, b))
-        img = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-        
-        # Mild sharpening
-        kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-        img = cv2.filter2D(img, -1, kernel)
+        luma = self._clahe.apply(cv2.extractChannel(ycrcb, 0))
+        cv2.insertChannel(luma, ycrcb, 0)
         
-        return img
+        return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2RGB)
  
+    def _sharpen(self, image):
+        """
+        The mild 3x3 kernel (color only) then an unsharp mask, both
+        saturating in uint8 with no float copies. Folded into one kernel
+        they would be a 9x9 filter2D (7x7 for grayscale) that can't be
+        split into rows and columns like the Gaussian, about 4x slower
+        than these passes (see benchmarks/preprocess_filters.py).
+        """
+        if len(image.shape) == 3:
+            image = cv2.filter2D(image, -1, self._sharpen_kernel)
+        blurred = cv2.GaussianBlur(image, (0, 0), self.gaussian_sigma)
+        return cv2.addWeighted(image, 2.5, blurred, -1.5, 0)
+
     def _apply_filters(self, image):
-        """Apply various filters to the image"""
-        # Convert to float32 for processing
-        if len(image.shape) == 2:
-            # Handle grayscale images
-            img_float = image.astype('float32') / 255.0
-            blurred = gaussian(img_float, sigma=self.gaussian_sigma)
-            sharpened = img_float + (img_float - blurred) * 1.5
-            filtered = median(sharpened, np.ones((self.mean_kernel_size, self.mean_kernel_size)))
-        else:
-            # Handle color images
-            img_float = image.astype('float32') / 255.0
-            blurred = gaussian(img_float, sigma=self.gaussian_sigma, channel_axis=-1)
-            sharpened = img_float + (img_float - blurred) * 1.5
-            
-            # Median filtering for noise reduction
-            filtered = np.zeros_like(sharpened)
-            for i in range(3):  # Apply to each channel
-                filtered[:,:,i] = median(sharpened[:,:,i], 
-                                       np.ones((self.mean_kernel_size, self.mean_kernel_size)))
-        
-        # Clip values to 0-1 range
-        filtered = np.clip(filtered, 0, 1)
-        
+        """Sharpen, denoise and stretch the image without leaving uint8"""
+        sharpened = self._sharpen(image)
+
+        # Median filtering for noise reduction
+        filtered = cv2.medianBlur(sharpened, self.mean_kernel_size)
+
         # Normalization (per channel)
-        if len(filtered.shape) == 3:
-            for i in range(filtered.shape[2]):
-                channel = filtered[:,:,i]
-                filtered[:,:,i] = (channel - np.min(channel)) / (np.max(channel) - np.min(channel) + 1e-7)
-        else:
-            filtered = (filtered - np.min(filtered)) / (np.max(filtered) - np.min(filtered) + 1e-7)
-        
-        return (filtered * 255).astype('uint8')
\ No newline at end of file
+        if len(filtered.shape) == 2:
+            return cv2.normalize(filtered, None, 0, 255, cv2.NORM_MINMAX)
+
+        # A 256 entry lookup table per channel stretches all three in one
+        # pass, with the bounds read off the channel histograms
+        levels = np.arange(256, dtype=np.float32)
+        lut = np.empty((256, 1, 3), dtype=np.uint8)
+        for i in range(3):
+            hist = cv2.calcHist([filtered], [i], None, [256], [0, 256]).ravel()
+            present = np.flatnonzero(hist)
+            low, high = float(present[0]), float(present[-1])
+            lut[:, 0, i] = np.clip((levels - low) * 255.0 / max(high - low, 1e-7), 0, 255)
+        return cv2.LUT(filtered, lut)
@@ -0,0 +1,355 @@
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from .scheduler import AdmissionError, Limiter, limited
+from .metrics import (Family, external_call, record_tokens, LLM_CALL_SECONDS, LLM_RETRIES, LLM_HEDGES,
+                      LLM_FALLBACKS)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Seconds one attempt may take, and a whole call with its retries and fallback
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "10"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "25"))
+# Retries of an attempt that timed out or got a 408/409/429/5xx, with jittered backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.25"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "4"))
+# A duplicate attempt is sent once one is slower than this percentile of
+# recent ones, on at most LLM_HEDGE_MAX_RATIO of the calls
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+# Smaller model answering while the requested one fails, empty to disable
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "llama-3.1-8b-instant")
+# Consecutive failures that open a model's circuit, and seconds it stays open
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Successful attempt latencies kept per operation and model
+LATENCY_WINDOW = 200
+RETRYABLE_STATUS = (408, 409, 429)
+
+
+class LLMUnavailableError(AdmissionError):
+    """Raised when no model answered a call in time, carries the Retry-After"""
+
+    status_code = 503
+
+
+class CircuitBreaker:
+    """
+    Closed until `failures` calls in a row fail, then open for `cooldown`
+    seconds, after which a single probe call decides whether it closes
+    again (half-open).
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.opened = 0
+        # When the probe of a half-open circuit went out, a cancelled one expires
+        self._probe_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        now = time.monotonic()
+        if state == "half_open" and (self._probe_at is None or now - self._probe_at >= self.cooldown):
+            self._probe_at = now
+            return True
+        return False
+
+    def success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_at = None
+
+    def failure(self):
+        self.consecutive_failures += 1
+        if self._probe_at is not None or self.consecutive_failures >= self.failures:
+            if self.state != "open":
+                self.opened += 1
+            self.opened_at = time.monotonic()
+        self._probe_at = None
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+
+class LLMGateway:
+    """
+    The one way agents call Groq chat completions.
+
+    Every call has a deadline. Attempts that time out or are rate limited
+    or fail on the server are retried with jittered exponential backoff
+    (or after the Retry-After Groq sent). An attempt slower than the
+    recent p95 gets a hedged duplicate and the first answer wins. Each
+    model has a circuit breaker. While the requested model's circuit is
+    open, or once its retries are spent, the call goes to the smaller
+    fallback model. When nothing answers, LLMUnavailableError is raised
+    instead of a result that could be mistaken for a verdict.
+    """
+
+    def __init__(self, client, limiter: Optional[Limiter] = None, fallback_model: Optional[str] = LLM_FALLBACK_MODEL,
+                 timeout: float = LLM_TIMEOUT, deadline: float = LLM_DEADLINE,
+                 max_retries: int = LLM_MAX_RETRIES, hedge: bool = LLM_HEDGE_ENABLED):
+        self.client = client
+        # Caps concurrent Groq calls, hedged attempts take a slot too
+        self.limiter = limiter
+        self.fallback_model = fallback_model or None
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[Tuple[str, str], Deque[float]] = {}
+
+        self.calls = 0
+        self.failures = 0
+        self.fallbacks = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    async def create(self, operation: str, model: str, **kwargs):
+        """A chat completion from model, or from the fallback model if model is failing"""
+        return await self._call(operation, model, kwargs, self._retrying)
+
+    async def stream(self, operation: str, model: str, **kwargs) -> AsyncIterator:
+        """
+        Chunks of a streamed chat completion. Retries and fallback only
+        happen before the stream starts, and the deadline covers the
+        whole stream.
+        """
+        start = time.monotonic()
+        async with limited(self.limiter):
+            stream = await self._call(operation, model, dict(kwargs, stream=True), self._retrying_stream)
+            try:
+                iterator = stream.__aiter__()
+                while True:
+                    remaining = self.deadline - (time.monotonic() - start)
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError(f"{operation} stream passed its {self.deadline}s deadline")
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        return
+                    # Groq reports usage on the last chunk
+                    x_groq = getattr(chunk, "x_groq", None)
+                    if getattr(x_groq, "usage", None) is not None:
+                        record_tokens(getattr(chunk, "model", None) or model, x_groq.usage)
+                    yield chunk
+            finally:
+                # Frees the HTTP connection when the consumer stops early or a chunk times out
+                await stream.close()
+
+    async def _call(self, operation: str, model: str, kwargs: Dict, attempt_with_retries):
+        self.calls += 1
+        start = time.monotonic()
+        deadline = start + self.deadline
+        candidates = [model] + ([self.fallback_model] if self.fallback_model and self.fallback_model != model else [])
+        last_error: Optional[Exception] = None
+        for index, candidate in enumerate(candidates):
+            breaker = self.breakers.setdefault(candidate, CircuitBreaker())
+            if not breaker.allow():
+                if index + 1 < len(candidates):
+                    LLM_FALLBACKS.inc(operation=operation, reason="circuit_open")
+                continue
+            # Leave the fallback model time of its own
+            until = deadline
+            if index + 1 < len(candidates):
+                until = deadline - min(self.timeout, self.deadline / 3)
+            try:
+                response = await attempt_with_retries(operation, candidate, kwargs, until)
+            except Exception as e:
+                if not _retryable(e):
+                    # The model answered, but a bad request fails the same way on any model
+                    breaker.success()
+                    self.failures += 1
+                    raise
+                breaker.failure()
+                last_error = e
+                logging.error(f"{operation} on {candidate} failed: {e!r}")
+                if index + 1 < len(candidates):
+                    LLM_FALLBACKS.inc(operation=operation, reason="error")
+                continue
+            breaker.success()
+            if candidate != model:
+                self.fallbacks += 1
+            LLM_CALL_SECONDS.observe(time.monotonic() - start, operation=operation, model=candidate)
+            return response
+
+        self.failures += 1
+        LLM_CALL_SECONDS.observe(time.monotonic() - start, operation=operation, model="none")
+        retry_after = min((self.breakers[name].retry_after() for name in candidates if name in self.breakers),
+                          default=0.0)
+        detail = f": {last_error!r}" if last_error is not None else ", every model's circuit is open"
+        raise LLMUnavailableError(f"No model answered {operation}{detail}", max(1, math.ceil(retry_after)))
+
+    async def _retrying(self, operation: str, model: str, kwargs: Dict, until: float):
+        return await self._retry(operation, model, until, lambda timeout: self._hedged(operation, model, kwargs, timeout))
+
+    async def _retrying_stream(self, operation: str, model: str, kwargs: Dict, until: float):
+        # The caller already holds the limiter slot for the whole stream
+        return await self._retry(operation, model, until, lambda timeout: asyncio.wait_for(
+            self._attempt(operation, model, kwargs, limit=False), timeout))
+
+    async def _retry(self, operation: str, model: str, until: float, attempt):
+        retries = 0
+        while True:
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"{operation} on {model} ran out of time")
+            try:
+                return await attempt(min(self.timeout, remaining))
+            except Exception as e:
+                if not _retryable(e) or retries >= self.max_retries:
+                    raise
+                delay = _backoff(retries, e)
+                if time.monotonic() + delay >= until:
+                    raise
+                retries += 1
+                self.retries += 1
+                LLM_RETRIES.inc(operation=operation, model=model, reason=_reason(e))
+                await asyncio.sleep(delay)
+
+    async def _hedged(self, operation: str, model: str, kwargs: Dict, timeout: float):
+        """The first successful of an attempt and, if it is slow, a duplicate of it"""
+        start = time.monotonic()
+        tasks = [asyncio.ensure_future(self._attempt(operation, model, kwargs))]
+        hedge_after = self._hedge_delay(operation, model)
+        errors: List[BaseException] = []
+        try:
+            while True:
+                pending = [task for task in tasks if not task.done()]
+                if not pending:
+                    raise errors[0] if errors else asyncio.CancelledError()
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f"{operation} on {model} took longer than {timeout:.1f}s")
+                wait = remaining
+                if hedge_after is not None and len(tasks) == 1:
+                    wait = min(remaining, max(0.0, hedge_after - (time.monotonic() - start)))
+                done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        # Cancelled from outside, it has no result or error to report
+                        continue
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.hedges_won += 1
+                            LLM_HEDGES.inc(operation=operation, outcome="won")
+                        return task.result()
+                    errors.append(task.exception())
+                if not done and len(tasks) == 1 and hedge_after is not None:
+                    self.hedges += 1
+                    LLM_HEDGES.inc(operation=operation, outcome="sent")
+                    tasks.append(asyncio.ensure_future(self._attempt(operation, model, kwargs)))
+                    hedge_after = None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _attempt(self, operation: str, model: str, kwargs: Dict, limit: bool = True):
+        async with limited(self.limiter if limit else None):
+            start = time.monotonic()
+            with external_call("groq", operation):
+                response = await self.client.chat.completions.create(model=model, **kwargs)
+            self._latencies.setdefault((operation, model), deque(maxlen=LATENCY_WINDOW)).append(
+                time.monotonic() - start)
+        if not kwargs.get("stream"):
+            record_tokens(model, getattr(response, "usage", None))
+        return response
+
+    def _hedge_delay(self, operation: str, model: str) -> Optional[float]:
+        """Seconds after which an attempt gets a duplicate, None for no hedging"""
+        if not self.hedge or self.hedges >= LLM_HEDGE_MAX_RATIO * self.calls:
+            return None
+        latencies = self._latencies.get((operation, model))
+        if latencies is None or len(latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return _percentile(sorted(latencies), LLM_HEDGE_PERCENTILE)
+
+    def stats(self) -> Dict:
+        """Calls, fallbacks and hedges, circuit states and recent attempt latencies"""
+        latency = {}
+        for (operation, model), samples in self._latencies.items():
+            ordered = sorted(samples)
+            latency[f"{operation}/{model}"] = {
+                f"p{q}_ms": round(_percentile(ordered, q) * 1000, 1) for q in (50, 95, 99)
+            }
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+            "fallback_rate": round(self.fallbacks / self.calls, 4) if self.calls else 0.0,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "circuits": {
+                model: {"state": breaker.state, "opened": breaker.opened} for model, breaker in self.breakers.items()
+            },
+            "attempt_latency": latency
+        }
+
+    def metric_families(self) -> List[Family]:
+        return [("safens_llm_circuit_open", "gauge", "1 while a model's circuit breaker is open",
+                 [({"model": model}, float(breaker.state == "open")) for model, breaker in self.breakers.items()])]
+
+
+def _retryable(error: BaseException) -> bool:
+    # Only reached once a call failed, and the client already loaded groq
+    from groq import APIConnectionError, APIStatusError
+    if isinstance(error, (asyncio.TimeoutError, APIConnectionError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def _reason(error: BaseException) -> str:
+    from groq import APIStatusError
+    if isinstance(error, APIStatusError):
+        return str(error.status_code)
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    return "connection"
+
+
+def _backoff(retry: int, error: BaseException) -> float:
+    """Seconds before the next attempt: Groq's Retry-After, or full jitter"""
+    response = getattr(error, "response", None)
+    header = response.headers.get("retry-after") if response is not None else None
+    try:
+        if header is not None:
+            return min(float(header), LLM_RETRY_MAX_DELAY)
+    except ValueError:
+        pass
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** retry))
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
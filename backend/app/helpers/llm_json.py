@@ -0,0 +1,194 @@
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import re
+
+# Members of a cut off answer dropped at most to make the rest parse
+MAX_DROPPED_MEMBERS = 3
+
+_STRUCTURAL = re.compile(r'[{}\[\]",:\\]')
+
+
+class JSONStream:
+    """
+    Incremental parser for one JSON object arriving in pieces, such as a
+    streamed completion.
+
+    feed() returns the top-level fields the new piece completed, so a field
+    the model writes first can be acted on before the rest of the object
+    arrives. Text before the object (a code fence, prose) is skipped, and
+    nested values are returned whole once they close.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._pos = 0
+        self._start: Optional[int] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Where the root object is at: a "key", its "colon" or its "value"
+        self._expect = "key"
+        self._key_start = 0
+        self._key: Optional[str] = None
+        self._value_start = 0
+
+    def feed(self, piece: str) -> List[Tuple[str, Any]]:
+        """Add piece, returning the (key, value) pairs it completed"""
+        self.text += piece
+        completed = []
+        text, i = self.text, self._pos
+        if self._escape and i < len(text):
+            # The character a piece ago ended in a backslash that escapes this one
+            self._escape, i = False, i + 1
+        while not self.done:
+            # Only the structural characters matter, jump from one to the next
+            match = _STRUCTURAL.search(text, i)
+            if match is None:
+                i = len(text)
+                break
+            i = match.start()
+            ch = text[i]
+            if self._in_string:
+                if ch == "\\":
+                    if i + 1 == len(text):
+                        self._escape, i = True, i + 1
+                        break
+                    i += 1
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key":
+                        self._key = self._load(text[self._key_start:i + 1])
+                        self._expect = "colon"
+            elif self._start is None:
+                if ch == "{":
+                    self._start, self._depth, self._expect = i, 1, "key"
+            elif ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect == "key":
+                    self._key_start = i
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete(text[self._value_start:i], completed)
+                    self.done = True
+            elif self._depth == 1:
+                if ch == ":" and self._expect == "colon":
+                    self._expect, self._value_start = "value", i + 1
+                elif ch == ",":
+                    self._complete(text[self._value_start:i], completed)
+                    self._expect = "key"
+            i += 1
+        self._pos = i
+        return completed
+
+    def object_text(self) -> str:
+        """The object so far, from its opening brace, whole once done"""
+        if self._start is None:
+            return ""
+        return self.text[self._start:self._pos] if self.done else self.text[self._start:]
+
+    def _complete(self, raw: str, completed: List[Tuple[str, Any]]):
+        if self._expect != "value" or self._key is None:
+            return
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            # Left to the validation of the whole answer
+            return
+        self.fields[self._key] = value
+        completed.append((self._key, value))
+        self._key = None
+
+    @staticmethod
+    def _load(raw: str) -> Optional[str]:
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort fix of a model's malformed JSON object: text around it
+    dropped, trailing commas removed and, when the answer was cut off,
+    the open string, arrays and objects closed after the last complete
+    value. Returns text unchanged when there is no object in it.
+    """
+    start = text.find("{")
+    if start < 0:
+        return text
+    out: List[str] = []
+    closers: List[str] = []
+    in_string = escape = False
+    for ch in text[start:]:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            _drop_trailing_comma(out)
+            if not closers:
+                break
+            out.append(closers.pop())
+            if not closers:
+                break
+            continue
+        out.append(ch)
+
+    if not closers:
+        return "".join(out)
+    if in_string:
+        out.append('"')
+    # Drop what was cut off in the middle, a member at a time, until it parses
+    body = "".join(out)
+    for _ in range(MAX_DROPPED_MEMBERS + 1):
+        candidate = list(body.rstrip())
+        _drop_trailing_comma(candidate)
+        repaired = "".join(candidate) + "".join(reversed(closers))
+        try:
+            json.loads(repaired)
+            return repaired
+        except ValueError:
+            body = body[:_last_member_start(body)]
+    return repaired
+
+
+def _drop_trailing_comma(out: List[str]):
+    index = len(out) - 1
+    while index >= 0 and out[index].isspace():
+        index -= 1
+    if index >= 0 and out[index] == ",":
+        del out[index:]
+
+
+def _last_member_start(text: str) -> int:
+    """Where the last member of text starts: its "," or just after its opening bracket"""
+    depth, in_string, index = 0, False, len(text) - 1
+    while index >= 0:
+        ch = text[index]
+        if ch == '"' and (index == 0 or text[index - 1] != "\\"):
+            in_string = not in_string
+        elif not in_string:
+            if ch in "}]":
+                depth += 1
+            elif ch in "{[":
+                if depth == 0:
+                    return index + 1
+                depth -= 1
+            elif ch == "," and depth == 0:
+                return index
+        index -= 1
+    return 0
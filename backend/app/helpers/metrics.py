@@ -0,0 +1,294 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Wrap pipeline stages in OpenTelemetry spans (needs opentelemetry-api, and
+# an SDK/exporter such as opentelemetry-distro to send them anywhere)
+OTEL_ENABLED = os.getenv("OTEL_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Seconds, from a cache lookup up to a slow LLM summary
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Groq tokens per request, from a cached answer up to a chunked long text
+TOKEN_BUCKETS = (0, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+# Stage durations of the current request, in seconds, for its Server-Timing header
+REQUEST_TIMINGS: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+# Groq calls and tokens of the current request, for its X-Token-Usage header
+REQUEST_TOKENS: ContextVar[Optional[Dict[str, int]]] = ContextVar("request_tokens", default=None)
+
+# (labels, value) pairs of one metric
+Samples = Iterable[Tuple[Dict[str, str], float]]
+# name, type, help and samples, as rendered by render_family
+Family = Tuple[str, str, str, Samples]
+
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> str:
+        with self._lock:
+            samples = [(dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+        return render_family(self.name, "counter", self.help, samples)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label combination"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per bucket counts (last one is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(dict(labels, le=_number(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+class Metrics:
+    """The process's counters and histograms, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, families: Iterable[Family] = ()) -> str:
+        """All metrics, followed by families collected elsewhere (stats of shared objects)"""
+        return "".join([metric.render() for metric in self._metrics]
+                       + [render_family(*family) for family in families])
+
+
+METRICS = Metrics()
+
+STAGE_SECONDS = METRICS.histogram(
+    "safens_stage_seconds", "Duration of each moderation pipeline stage", ("stage",))
+EXTERNAL_CALL_SECONDS = METRICS.histogram(
+    "safens_external_call_seconds", "Duration of calls to external APIs and local models",
+    ("service", "operation"))
+EXTERNAL_CALL_ERRORS = METRICS.counter(
+    "safens_external_call_errors_total", "External calls that raised", ("service", "operation"))
+LLM_TOKENS = METRICS.counter(
+    "safens_llm_tokens_total", "Tokens billed by Groq", ("model", "kind"))
+REQUEST_SECONDS = METRICS.histogram(
+    "safens_request_seconds", "Duration of moderation requests, to the end of the response",
+    ("endpoint", "status"))
+LLM_CALL_SECONDS = METRICS.histogram(
+    "safens_llm_call_seconds", "Duration of Groq calls with their retries, hedges and fallback, "
+    "by the model that answered", ("operation", "model"))
+LLM_RETRIES = METRICS.counter(
+    "safens_llm_retries_total", "Groq attempts retried after a timeout or a retryable status",
+    ("operation", "model", "reason"))
+LLM_HEDGES = METRICS.counter(
+    "safens_llm_hedges_total", "Hedged duplicate Groq attempts sent, and those that answered first",
+    ("operation", "outcome"))
+LLM_FALLBACKS = METRICS.counter(
+    "safens_llm_fallbacks_total", "Groq calls sent on to the fallback model", ("operation", "reason"))
+REQUEST_TOKEN_COUNT = METRICS.histogram(
+    "safens_request_tokens", "Groq tokens used by each moderation request", ("endpoint", "kind"),
+    buckets=TOKEN_BUCKETS)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a pipeline stage into safens_stage_seconds and the request's
+    Server-Timing, in an OpenTelemetry span when OTEL_ENABLED is set.
+    """
+    tracer = _tracer()
+    span = tracer.start_as_current_span(f"safe-ns.{name}") if tracer is not None else nullcontext()
+    start = time.perf_counter()
+    with span:
+        try:
+            yield
+        finally:
+            record_stage(name, time.perf_counter() - start)
+
+
+def record_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = REQUEST_TIMINGS.get()
+    if timings is not None:
+        # Stages that ran more than once (OCR tiles, retries) add up
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def external_call(service: str, operation: str):
+    """Time a call to an external API into safens_external_call_seconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        EXTERNAL_CALL_ERRORS.inc(service=service, operation=operation)
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.observe(time.perf_counter() - start, service=service, operation=operation)
+
+
+def record_tokens(model: str, usage) -> None:
+    """Count the token usage of a Groq completion, if it reported any"""
+    totals = REQUEST_TOKENS.get()
+    if totals is not None:
+        totals["calls"] += 1
+    if usage is None:
+        return
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if tokens:
+            LLM_TOKENS.inc(tokens, model=model, kind=kind)
+            if totals is not None:
+                totals[kind] += tokens
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Server-Timing header value, durations in milliseconds"""
+    return ", ".join(f"{name};dur={seconds * 1e3:.1f}" for name, seconds in timings.items())
+
+
+def render_family(name: str, kind: str, help: str, samples: Samples) -> str:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{_labels(labels)} {_number(value)}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing the requests to `endpoints` into
+    safens_request_seconds and their Groq tokens into
+    safens_request_tokens. Responses of `server_timing_endpoints` get a
+    Server-Timing header with the stage durations and the total and an
+    X-Token-Usage header, those are only complete for responses that are
+    not streamed.
+    """
+
+    def __init__(self, app, endpoints: Sequence[str] = ("/moderate", "/moderate/stream", "/moderate/batch"),
+                 server_timing_endpoints: Sequence[str] = ("/moderate",)):
+        self.app = app
+        self.endpoints = set(endpoints)
+        self.server_timing_endpoints = set(server_timing_endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.endpoints:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        timings: Dict[str, float] = {}
+        # The endpoint runs in this task, so its stages record into timings
+        token = REQUEST_TIMINGS.set(timings)
+        tokens = {"prompt": 0, "completion": 0, "calls": 0}
+        tokens_token = REQUEST_TOKENS.set(tokens)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if path in self.server_timing_endpoints:
+                    value = server_timing(dict(timings, total=time.perf_counter() - start))
+                    usage = ", ".join(f"{kind}={count}" for kind, count in tokens.items())
+                    message = dict(message, headers=list(message.get("headers", []))
+                                   + [(b"server-timing", value.encode("latin-1")),
+                                      (b"x-token-usage", usage.encode("latin-1"))])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=path, status=str(status))
+            for kind in ("prompt", "completion"):
+                REQUEST_TOKEN_COUNT.observe(tokens[kind], endpoint=path, kind=kind)
+            REQUEST_TIMINGS.reset(token)
+            REQUEST_TOKENS.reset(tokens_token)
+
+
+_TRACER = None
+
+
+def _tracer():
+    global _TRACER, OTEL_ENABLED
+    if not OTEL_ENABLED:
+        return None
+    if _TRACER is None:
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            logging.error("OTEL_ENABLED is set but opentelemetry-api is not installed, tracing is off")
+            OTEL_ENABLED = False
+            return None
+        _TRACER = trace.get_tracer("safe-ns")
+    return _TRACER
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,186 @@
+from PIL import Image
+from typing import Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+import numpy as np
+import threading
+import cv2
+import os
+import logging
+# Load environment variables from .env file
+load_dotenv()
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tiff")
+
+
+def perceptual_hash(gray: np.ndarray) -> int:
+    """
+    64-bit DCT perceptual hash (pHash) of a grayscale uint8 image.
+
+    The image is shrunk to 32x32, and the signs of its 8x8 lowest
+    frequency DCT coefficients relative to their median form the hash,
+    so re-encoding, resizing and small crops barely change it.
+    """
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    dct = cv2.dct(small.astype(np.float32))[:8, :8].flatten()
+    # The DC term only reflects overall brightness, keep it out of the median
+    bits = dct > np.median(dct[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def image_hash(image: Image.Image) -> int:
+    """Perceptual hash of a PIL image"""
+    return perceptual_hash(np.asarray(image.convert("L")))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes for hamming radius queries"""
+
+    def __init__(self):
+        # node: [hash, value, {distance: child node}]
+        self.root: Optional[list] = None
+        self.size = 0
+
+    def add(self, key: int, value):
+        self.size += 1
+        if self.root is None:
+            self.root = [key, value, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1] = value
+                self.size -= 1
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, value, {}]
+                return
+            node = child
+
+    def search(self, key: int, max_distance: int) -> List[Tuple[int, int, object]]:
+        """All (distance, hash, value) within max_distance, closest first"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[0], node[1]))
+            # Triangle inequality: only children in this band can match
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class NearDuplicateIndex:
+    """
+    Index of perceptual hashes of previously moderated images.
+
+    Lets MainAgent reuse the verdict of an earlier image when a new
+    upload is within max_distance bits of it, which catches re-encoded
+    and resized copies that an exact byte hash misses. Verdicts are of
+    the image alone, never of its caption.
+    """
+
+    def __init__(self, max_distance: int = 4, max_entries: int = 100000,
+                 reuse: str = "unsafe"):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        # "unsafe" only reuses toxic verdicts, "all" reuses safe ones too. A
+        # 32x32 hash barely sees a caption, so a safe image verdict only
+        # spares the Vision call and the caption is still analyzed
+        self.reuse = reuse
+        self._tree = BKTree()
+        self._entries: List[Tuple[int, Dict]] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["NearDuplicateIndex"]:
+        """Build the index configured by PHASH_* (None when disabled)"""
+        if os.getenv("PHASH_INDEX_ENABLED", "true").lower() != "true":
+            return None
+        index = cls(
+            max_distance=int(os.getenv("PHASH_MAX_DISTANCE", "4")),
+            max_entries=int(os.getenv("PHASH_INDEX_MAX_ENTRIES", "100000")),
+            reuse=os.getenv("PHASH_REUSE", "unsafe").lower()
+        )
+        seed_dir = os.getenv("PHASH_SEED_DIR")
+        if seed_dir:
+            count = index.seed_directory(seed_dir)
+            logging.info(f"Seeded near-duplicate index with {count} images")
+        return index
+
+    def lookup(self, key: int) -> Optional[Tuple[int, Dict]]:
+        """Closest stored (distance, verdict) within max_distance"""
+        with self._lock:
+            matches = self._tree.search(key, self.max_distance)
+        for distance, _, verdict in matches:
+            if self.reuse == "all" or verdict.get("is_toxic"):
+                self.hits += 1
+                return distance, verdict
+        self.misses += 1
+        return None
+
+    def add(self, key: int, verdict: Dict):
+        with self._lock:
+            self._entries.append((key, verdict))
+            if len(self._entries) > self.max_entries:
+                # BK-trees can't delete, rebuild from the newest half
+                self._entries = self._entries[len(self._entries) // 2:]
+                self._tree = BKTree()
+                for entry_key, entry_verdict in self._entries:
+                    self._tree.add(entry_key, entry_verdict)
+            else:
+                self._tree.add(key, verdict)
+
+    def seed(self, images: Iterable[Image.Image], label: str = "known unsafe content") -> int:
+        """Add a known-bad corpus so near copies are flagged without analysis"""
+        count = 0
+        for image in images:
+            self.add(image_hash(image), self.seed_verdict(label))
+            count += 1
+        return count
+
+    def seed_directory(self, path: str, label: str = "known unsafe content") -> int:
+        """Seed from every image file under a directory"""
+        count = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                try:
+                    with Image.open(os.path.join(root, name)) as image:
+                        count += self.seed([image], label)
+                except Exception as e:
+                    logging.error(f"Could not seed {name}: {str(e)}", exc_info=True)
+        return count
+
+    @staticmethod
+    def seed_verdict(label: str) -> Dict:
+        return {
+            "is_toxic": True,
+            "confidence": 1.0,
+            "summary": f"TOXICITY DETECTED: This image closely matches {label} "
+                       "from a curated corpus and should be restricted."
+        }
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._tree.size,
+            "max_distance": self.max_distance,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,134 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, NamedTuple, Optional
+import multiprocessing
+import numpy as np
+import asyncio
+import os
+
+
+class SharedArray(NamedTuple):
+    """Reference to an array in a shared memory segment, cheap to pickle"""
+    name: str
+    shape: tuple
+    dtype: str
+
+
+def _share(array: np.ndarray) -> tuple:
+    """Copy array into a new shared memory segment"""
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=segment.buf)[...] = array
+    return segment, SharedArray(segment.name, array.shape, array.dtype.str)
+
+
+def _attach(ref: SharedArray) -> tuple:
+    # Spawned workers share the server's resource tracker, which keeps a
+    # set of names, so attaching again doesn't change who unlinks it
+    segment = shared_memory.SharedMemory(name=ref.name)
+    return segment, np.ndarray(ref.shape, np.dtype(ref.dtype), buffer=segment.buf)
+
+
+def _init_worker():
+    # One OpenCV thread per process, the pool itself provides the parallelism
+    import cv2
+
+    cv2.setNumThreads(1)
+
+
+def _run_shared(fn: Callable, ref: SharedArray, args: tuple) -> Any:
+    """Worker side: run fn on the shared input, send arrays back the same way"""
+    segment, array = _attach(ref)
+    try:
+        result = fn(array, *args)
+    finally:
+        del array
+        segment.close()
+
+    if isinstance(result, np.ndarray):
+        return _share_result(result)
+    if isinstance(result, dict):
+        return {key: _share_result(value) if isinstance(value, np.ndarray) else value
+                for key, value in result.items()}
+    return result
+
+
+def _share_result(array: np.ndarray) -> SharedArray:
+    segment, ref = _share(array)
+    # The parent copies the result out and unlinks the segment
+    segment.close()
+    return ref
+
+
+def _collect(ref: SharedArray) -> np.ndarray:
+    segment, array = _attach(ref)
+    try:
+        return array.copy()
+    finally:
+        del array
+        segment.close()
+        segment.unlink()
+
+
+def _discard(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    refs = result.values() if isinstance(result, dict) else [result]
+    for ref in refs:
+        if isinstance(ref, SharedArray):
+            _collect(ref)
+
+
+def _noop():
+    return os.getpid()
+
+
+class ProcessPool:
+    """
+    Process pool for the CPU bound stages, sized to the cores by default.
+
+    Images go to the workers through shared memory instead of being
+    pickled: only the segment name, shape and dtype cross the pipe. Array
+    results (or arrays in a dict result) come back the same way.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        # Spawned workers don't inherit the event loop, gRPC channels or
+        # locks of the server process
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+
+    async def run(self, fn: Callable, array: np.ndarray, *args) -> Any:
+        """Run fn(array, *args) in a worker, fn must be picklable"""
+        segment, ref = _share(np.ascontiguousarray(array))
+        future = self.executor.submit(_run_shared, fn, ref, args)
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Free the result segments once the worker is done with them
+            future.add_done_callback(_discard)
+            raise
+        finally:
+            segment.close()
+            segment.unlink()
+
+        if isinstance(result, SharedArray):
+            return _collect(result)
+        if isinstance(result, dict):
+            return {key: _collect(value) if isinstance(value, SharedArray) else value
+                    for key, value in result.items()}
+        return result
+
+    async def warmup(self):
+        """Start every worker now rather than on the first requests"""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(self.executor, _noop) for _ in range(self.workers)
+        ))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
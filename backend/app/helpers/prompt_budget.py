@@ -0,0 +1,113 @@
+from typing import List, Optional
+import math
+import re
+import unicodedata
+
+# Whitespace inside a line, and a word repeated more than three times in a row
+_SPACES = re.compile(r"[^\S\n]+")
+_REPEATS = re.compile(r"\b(\w+)((?:\s+\1\b){2})(?:\s+\1\b)+", re.IGNORECASE)
+
+
+class TextTooLongError(ValueError):
+    """The text doesn't fit the token budget of its analysis"""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Tokens text costs in a Llama 3 prompt, a slight overestimate.
+
+    About four characters of Latin script per token and at least one
+    per word, and a token per character of other scripts, so it is
+    close enough to budget prompts without loading a tokenizer.
+    """
+    return sum(_word_tokens(word) for word in text.split())
+
+
+def compact_text(text: str) -> str:
+    """
+    Text with what doesn't change its meaning removed: Unicode
+    normalized, whitespace collapsed, lines with no letters, digits or
+    symbols (OCR debris) and repeated lines dropped, and runs of one
+    word cut to three.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    lines, seen = [], set()
+    for line in text.splitlines():
+        line = "".join(ch for ch in line if unicodedata.category(ch)[0] != "C")
+        line = _REPEATS.sub(r"\1\2", _SPACES.sub(" ", line)).strip()
+        if not any(ch.isalnum() or unicodedata.category(ch) == "So" for ch in line):
+            continue
+        key = line.casefold()
+        if key in seen:
+            continue
+        seen.add(key)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def split_chunks(text: str, max_tokens: int, overlap_tokens: int = 0,
+                 max_chunks: Optional[int] = None, max_chunk_tokens: Optional[int] = None) -> List[str]:
+    """
+    Split text on word boundaries into chunks of at most max_tokens,
+    consecutive chunks sharing about overlap_tokens so a phrase cut by a
+    boundary is still seen whole. Rather than dropping text, chunks grow
+    when there would be more than max_chunks, but never past
+    max_chunk_tokens: TextTooLongError is raised instead.
+    """
+    words = re.findall(r"\S+\s*", text)
+    costs = [_word_tokens(word) for word in words]
+    total = sum(costs)
+    if total <= max_tokens:
+        return [text] if words else []
+    if max_chunks and total > max_tokens * max_chunks - overlap_tokens * (max_chunks - 1):
+        max_tokens = math.ceil((total + overlap_tokens * (max_chunks - 1)) / max_chunks)
+        _check_chunk_size(total, max_tokens, max_chunks, max_chunk_tokens)
+
+    chunks = _split(words, costs, max_tokens, overlap_tokens)
+    while max_chunks and len(chunks) > max_chunks:
+        # Word boundaries left some chunks short of the budget
+        max_tokens += max(1, max_tokens // 20)
+        _check_chunk_size(total, max_tokens, max_chunks, max_chunk_tokens)
+        chunks = _split(words, costs, max_tokens, overlap_tokens)
+    return chunks
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """The leading words of text that fit in max_tokens"""
+    words = re.findall(r"\S+\s*", text)
+    used = end = 0
+    while end < len(words) and used + _word_tokens(words[end]) <= max_tokens:
+        used += _word_tokens(words[end])
+        end += 1
+    return "".join(words[:end]).strip()
+
+
+def _check_chunk_size(total: int, max_tokens: int, max_chunks: int, max_chunk_tokens: Optional[int]):
+    if max_chunk_tokens is not None and max_tokens > max_chunk_tokens:
+        raise TextTooLongError(
+            f"Text of about {total} tokens doesn't fit in {max_chunks} chunks of {max_chunk_tokens} tokens")
+
+
+def _split(words: List[str], costs: List[int], max_tokens: int, overlap_tokens: int) -> List[str]:
+    chunks, start = [], 0
+    while start < len(words):
+        end, used = start, 0
+        while end < len(words) and (used + costs[end] <= max_tokens or end == start):
+            used += costs[end]
+            end += 1
+        chunks.append("".join(words[start:end]).strip())
+        if end == len(words):
+            break
+        # The next chunk starts overlap_tokens back, but always moves forward
+        back, shared = end, 0
+        while back > start + 1 and shared + costs[back - 1] <= overlap_tokens:
+            back -= 1
+            shared += costs[back]
+        start = back
+    return chunks
+
+
+def _word_tokens(word: str) -> int:
+    word = word.strip()
+    latin = sum(1 for ch in word if ord(ch) < 0x250)
+    return max(1, math.ceil(latin / 4)) + len(word) - latin
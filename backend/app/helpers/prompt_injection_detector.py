@@ -1,46 +1,141 @@
-import re
+from bisect import bisect_right
+from typing import Dict, List
+from .aho_corasick import AhoCorasick
 
 
 class PromptInjectionDetector:
-    def __init__(self):
-        # Common prompt injection patterns
-        self.patterns = [
-            r"(ignore|disregard|forget|overlook).*(previous|prior|above|instructions?|directives?)",
-            r"(act|play|pretend|impersonate).*(as|like|role of|character of)",
-            r"(system|exec|execute|run|command|cmd|terminal|shell).*(\`|\$\()",
-            r"(<\|.*?\|>|\[.*?\]|\{.*?\}|<<.*?>>)",
-            r"(admin|root|superuser|elevate|privilege|sudo)",
-            r"(output|print|display|show|return).*(this|that|following|as is|literally|exactly|raw|unmodified)",
-            r"(file|document|read|write|create|delete|modify).*(\.txt|\.json|\.csv|\.xml|\.yaml)",
-            r"(```|~~~).*(python|javascript|java|c\+\+|bash|shell|code)",
-            r"(password|secret|key|token|credentials?|api).*(send|give|provide|share|reveal|display)"
+    def __init__(self, max_gap: int = 100, max_scan_chars: int = 10000):
+        """
+        Args:
+            max_gap (int): Max characters between the two halves of a rule
+            max_scan_chars (int): Longer inputs only have their head and tail scanned
+        """
+        self.max_gap = max_gap
+        self.max_scan_chars = max_scan_chars
+
+        # Common prompt injection patterns. A rule fires when one of its
+        # lead terms is followed on the same line, within max_gap
+        # characters, by one of its trail terms (or on a lead alone when
+        # it has no trail terms).
+        self.rules = [
+            ("override_instructions",
+             [(["ignore", "disregard", "forget", "overlook"],
+               ["previous", "prior", "above", "instruction", "directive"])]),
+            ("role_play",
+             [(["act", "play", "pretend", "impersonate"],
+               ["as", "like", "role of", "character of"])]),
+            ("command_execution",
+             [(["system", "exec", "execute", "run", "command", "cmd", "terminal", "shell"],
+               ["`", "$("])]),
+            ("special_delimiters",
+             [(["<|"], ["|>"]), (["["], ["]"]), (["{"], ["}"]), (["<<"], [">>"])]),
+            ("privilege_escalation",
+             [(["admin", "root", "superuser", "elevate", "privilege", "sudo"], [])]),
+            ("verbatim_output",
+             [(["output", "print", "display", "show", "return"],
+               ["this", "that", "following", "as is", "literally", "exactly", "raw", "unmodified"])]),
+            ("file_access",
+             [(["file", "document", "read", "write", "create", "delete", "modify"],
+               [".txt", ".json", ".csv", ".xml", ".yaml"])]),
+            ("code_block",
+             [(["```", "~~~"],
+               ["python", "javascript", "java", "c++", "bash", "shell", "code"])]),
+            ("secret_exfiltration",
+             [(["password", "secret", "key", "token", "credential", "api"],
+               ["send", "give", "provide", "share", "reveal", "display"])])
         ]
+        self.rule_weight = 0.3
 
-        self.compiled_patterns = [re.compile(
-            p, re.IGNORECASE) for p in self.patterns]
         self.suspicious_keywords = [
             "override", "bypass", "inject", "malicious", "exploit",
             "hack", "unauthorized", "confidential", "proprietary"
         ]
+        self.keyword_weight = 0.1
+
+        # term -> [(rule index, clause index, "lead" | "trail")]
+        self._roles: Dict[str, List[tuple]] = {}
+        for rule_index, (_, clauses) in enumerate(self.rules):
+            for clause_index, (leads, trails) in enumerate(clauses):
+                for term in leads:
+                    self._roles.setdefault(term, []).append((rule_index, clause_index, "lead"))
+                for term in trails:
+                    self._roles.setdefault(term, []).append((rule_index, clause_index, "trail"))
+        for keyword in self.suspicious_keywords:
+            self._roles.setdefault(keyword, []).append((None, None, "keyword"))
+
+        # One automaton for every rule term and keyword: a single pass
+        # over the text with no backtracking
+        self.matcher = AhoCorasick(self._roles.keys())
 
     def is_injection(self, text: str, threshold: float = 0.6) -> bool:
         """Check if text contains prompt injection attempts."""
+        return self.scan(text)["score"] >= threshold
+
+    def scan(self, text: str) -> Dict:
+        """Score text and report which rules and keywords fired"""
+        result = {"score": 0.0, "rules": [], "keywords": [], "truncated": False}
         if not text.strip():
-            return False
+            return result
 
-        score = 0.0
-        text_lower = text.lower()
+        scanned = text.lower()
+        if len(scanned) > self.max_scan_chars:
+            # Injections tend to sit at either end, keep both and separate
+            # them with a newline so no rule can span the cut
+            half = self.max_scan_chars // 2
+            scanned = scanned[:half] + "\n" + scanned[-half:]
+            result["truncated"] = True
 
-        for pattern in self.compiled_patterns:
-            if pattern.search(text):
-                score += 0.3
+        lead_ends: Dict[tuple, List[int]] = {}
+        fired: Dict[int, str] = {}
+        keywords = []
 
-        for keyword in self.suspicious_keywords:
-            if keyword in text_lower:
-                score += 0.1
+        for start, end, term in self.matcher.iter_matches(scanned):
+            for rule_index, clause_index, role in self._roles[term]:
+                if role == "keyword":
+                    if term not in keywords:
+                        keywords.append(term)
+                    continue
+                if rule_index in fired:
+                    continue
+                clause = (rule_index, clause_index)
+                if role == "lead":
+                    if not self.rules[rule_index][1][clause_index][1]:
+                        fired[rule_index] = term
+                    else:
+                        lead_ends.setdefault(clause, []).append(end)
+                    continue
+                # Trail: find the closest lead ending at or before it
+                ends = lead_ends.get(clause)
+                if not ends:
+                    continue
+                position = bisect_right(ends, start) - 1
+                if position < 0:
+                    continue
+                lead_end = ends[position]
+                if start - lead_end <= self.max_gap and "\n" not in scanned[lead_end:start]:
+                    fired[rule_index] = scanned[lead_end - self._lead_length(rule_index, clause_index, lead_end, scanned):end]
+
+        score = 0.0
+        for rule_index in sorted(fired):
+            score += self.rule_weight
+            result["rules"].append({
+                "rule": self.rules[rule_index][0],
+                "score": self.rule_weight,
+                "match": fired[rule_index]
+            })
+        for keyword in keywords:
+            score += self.keyword_weight
+            result["keywords"].append({"keyword": keyword, "score": self.keyword_weight})
 
         if len(text) > 1000:
             score += 0.2
-        
 
-        return (score >= threshold)
+        result["score"] = round(score, 4)
+        return result
+
+    def _lead_length(self, rule_index: int, clause_index: int, lead_end: int, scanned: str) -> int:
+        """Length of the lead term ending at lead_end, for reporting the match"""
+        leads = self.rules[rule_index][1][clause_index][0]
+        return max(
+            (len(lead) for lead in leads if scanned.endswith(lead, 0, lead_end)),
+            default=0)
@@ -0,0 +1,224 @@
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, Optional
+from dotenv import load_dotenv
+import unicodedata
+import hashlib
+import asyncio
+import sqlite3
+import json
+import time
+import os
+import logging
+# Load environment variables from .env file
+load_dotenv()
+
+# Outcome of the cache lookup for the current request ("HIT" or "MISS"),
+# read by the API layer to set the X-Cache response header
+CACHE_STATUS: ContextVar[Optional[str]] = ContextVar("cache_status", default=None)
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with a per-entry TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Dict):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def clear(self):
+        self._entries.clear()
+
+    async def close(self):
+        pass
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCacheBackend:
+    """SQLite file cache so results survive restarts and are shared by workers"""
+
+    def __init__(self, path: str, max_entries: int = 100000, ttl: float = 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT, expires_at REAL, accessed_at REAL)")
+        self._conn.commit()
+        self._lock = asyncio.Lock()
+
+    async def get(self, key: str) -> Optional[Dict]:
+        async with self._lock:
+            return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: Dict):
+        async with self._lock:
+            await asyncio.to_thread(self._set, key, value)
+
+    async def clear(self):
+        async with self._lock:
+            await asyncio.to_thread(self._execute, "DELETE FROM results")
+
+    async def close(self):
+        self._conn.close()
+
+    def _get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            self._execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        self._execute(
+            "UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def _set(self, key: str, value: Dict):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + self.ttl, now))
+        # Evict expired rows, then the least recently used beyond the cap
+        self._conn.execute("DELETE FROM results WHERE expires_at < ?", (now,))
+        self._conn.execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM results "
+            "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        self._conn.commit()
+
+    def _execute(self, sql: str, params: tuple = ()):
+        self._conn.execute(sql, params)
+        self._conn.commit()
+
+
+class RedisCacheBackend:
+    """Redis (or any Redis-compatible server) cache, eviction is left to the server"""
+
+    def __init__(self, url: str, ttl: float = 3600, prefix: str = "safe-ns:"):
+        # Optional dependency, only needed when this backend is selected
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Dict]:
+        value = await self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Dict):
+        await self.client.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+
+    async def clear(self):
+        async for key in self.client.scan_iter(match=self.prefix + "*"):
+            await self.client.delete(key)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of moderation results.
+
+    Keys are derived from a hash of the raw upload bytes or normalized
+    text, namespaced by a fingerprint of the agent configuration so that
+    changing a model name or threshold invalidates every older entry.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ResultCache"]:
+        """Build the cache configured by RESULT_CACHE_* (None when disabled)"""
+        kind = os.getenv("RESULT_CACHE_BACKEND", "memory").lower()
+        ttl = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+        max_entries = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+
+        if kind == "none":
+            return None
+        if kind == "disk":
+            path = os.getenv("RESULT_CACHE_PATH", "data/result_cache.sqlite3")
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            return cls(DiskCacheBackend(path, max_entries=max_entries, ttl=ttl))
+        if kind == "redis":
+            url = os.getenv("RESULT_CACHE_REDIS_URL", "redis://localhost:6379/0")
+            return cls(RedisCacheBackend(url, ttl=ttl))
+        return cls(MemoryCacheBackend(max_entries=max_entries, ttl=ttl))
+
+    @staticmethod
+    def fingerprint(config: Dict) -> str:
+        """Stable short hash of the configuration results depend on"""
+        encoded = json.dumps(config, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+    @staticmethod
+    def image_key(content: bytes, fingerprint: str) -> str:
+        return f"image:{fingerprint}:{hashlib.sha256(content).hexdigest()}"
+
+    @staticmethod
+    def text_key(text: str, fingerprint: str) -> str:
+        normalized = " ".join(unicodedata.normalize("NFKC", text).split())
+        digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        return f"text:{fingerprint}:{digest}"
+
+    async def get(self, key: str) -> Optional[Dict]:
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            logging.error(f"Result cache lookup failed: {str(e)}", exc_info=True)
+            value = None
+
+        if value is None:
+            self.misses += 1
+            CACHE_STATUS.set("MISS")
+        else:
+            self.hits += 1
+            CACHE_STATUS.set("HIT")
+        return value
+
+    async def set(self, key: str, value: Dict):
+        try:
+            await self.backend.set(key, value)
+        except Exception as e:
+            logging.error(f"Result cache store failed: {str(e)}", exc_info=True)
+
+    async def clear(self):
+        await self.backend.clear()
+
+    async def close(self):
+        await self.backend.close()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
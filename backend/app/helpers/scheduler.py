@@ -0,0 +1,206 @@
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, Optional
+from dotenv import load_dotenv
+import heapq
+import asyncio
+import itertools
+import math
+import time
+import os
+# Load environment variables from .env file
+load_dotenv()
+
+# Priority of the work done for the current request, lower runs first.
+# Set on admission and inherited by every task the request spawns.
+PRIORITIES = {"text": 0, "image": 1}
+REQUEST_PRIORITY: ContextVar[int] = ContextVar("request_priority", default=PRIORITIES["image"])
+
+
+class AdmissionError(Exception):
+    """Raised when a request can't be admitted, carries the HTTP status and Retry-After"""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFullError(AdmissionError):
+    status_code = 429
+
+
+class QueueTimeoutError(AdmissionError):
+    status_code = 503
+
+
+class Limiter:
+    """
+    Concurrency limit with a priority ordered wait queue.
+
+    At most `concurrency` holders run at once. Waiters are woken lowest
+    priority value first, then in arrival order. With max_queue set,
+    acquiring while that many are already waiting raises QueueFullError,
+    and waiting longer than queue_timeout raises QueueTimeoutError.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: Optional[int] = None,
+                 queue_timeout: Optional[float] = None):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: list = []
+        self._sequence = itertools.count()
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queued = 0
+        self._wait_seconds = 0.0
+        # Moving average of how long a holder keeps its slot
+        self._service_seconds = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[int] = None):
+        await self.acquire(priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._service_seconds = (
+                elapsed if not self._service_seconds else 0.9 * self._service_seconds + 0.1 * elapsed)
+            self.release()
+
+    async def acquire(self, priority: Optional[int] = None):
+        if priority is None:
+            priority = REQUEST_PRIORITY.get()
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+
+        if self.max_queue is not None and len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"{self.name} queue is full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future)
+        heapq.heappush(self._waiters, entry)
+        self.max_queued = max(self.max_queued, len(self._waiters))
+        start = time.perf_counter()
+        try:
+            if self.queue_timeout:
+                await asyncio.wait_for(future, self.queue_timeout)
+            else:
+                await future
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over as we gave up, pass it on
+                self.release()
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise QueueTimeoutError(
+                    f"Timed out waiting for {self.name}", self.retry_after())
+            raise
+        self._wait_seconds += time.perf_counter() - start
+        self.admitted += 1
+
+    def release(self):
+        # Hand the slot straight to the next waiter, in_flight is unchanged
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue should have drained"""
+        backlog = (len(self._waiters) + 1) / self.concurrency
+        return max(1, math.ceil(backlog * (self._service_seconds or 1.0)))
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "mean_wait_ms": round(self._wait_seconds * 1e3 / self.admitted, 3) if self.admitted else 0.0,
+            "mean_service_ms": round(self._service_seconds * 1e3, 3)
+        }
+
+
+def limited(limiter: Optional[Limiter]):
+    """Slot of limiter for an `async with`, or a no-op when there is none"""
+    return limiter.slot() if limiter is not None else nullcontext()
+
+
+class Scheduler:
+    """
+    Admission control and per-stage concurrency limits.
+
+    Requests enter through a bounded lane per kind ("text" or "image"),
+    so a burst of uploads is turned away with 429/503 instead of piling
+    up in memory, and can't crowd out cheap text requests. Inside a
+    request, every expensive stage (preprocess, ocr, vision, groq) takes
+    a slot from its own limiter, and text work is served before image
+    work whenever a stage is contended.
+    """
+
+    STAGES = ("preprocess", "ocr", "vision", "groq")
+
+    def __init__(self, lanes: Dict[str, Limiter], stages: Dict[str, Limiter]):
+        self.lanes = lanes
+        self.stages = stages
+
+    @classmethod
+    def from_env(cls, defaults: Optional[Dict[str, int]] = None) -> "Scheduler":
+        """Limits from ADMISSION_* and <STAGE>_CONCURRENCY, defaults keyed by stage name"""
+        defaults = defaults or {}
+        timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+        lanes = {
+            "text": Limiter(
+                "text", int(os.getenv("ADMISSION_TEXT_CONCURRENCY", "64")),
+                max_queue=int(os.getenv("ADMISSION_TEXT_QUEUE", "256")), queue_timeout=timeout),
+            "image": Limiter(
+                "image", int(os.getenv("ADMISSION_IMAGE_CONCURRENCY", "16")),
+                max_queue=int(os.getenv("ADMISSION_IMAGE_QUEUE", "64")), queue_timeout=timeout)
+        }
+        stages = {
+            name: Limiter(name, int(os.getenv(
+                f"{name.upper()}_CONCURRENCY", str(defaults.get(name, os.cpu_count() or 1)))))
+            for name in cls.STAGES
+        }
+        return cls(lanes, stages)
+
+    @asynccontextmanager
+    async def admit(self, kind: str):
+        """Hold a slot in the lane for kind for the duration of a request"""
+        priority = PRIORITIES[kind]
+        REQUEST_PRIORITY.set(priority)
+        async with self.lanes[kind].slot(priority):
+            yield
+
+    def stage(self, name: str) -> Limiter:
+        return self.stages[name]
+
+    def stats(self) -> Dict:
+        return {
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+            "stages": {name: stage.stats() for name, stage in self.stages.items()}
+        }
@@ -0,0 +1,66 @@
+from typing import Any, Awaitable, Callable, Dict, Tuple
+import asyncio
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one run of the work.
+
+    The first caller for a key starts `factory()` in a task of its own and
+    later callers wait for that task instead of starting another, until it
+    finishes. Every caller gets the result, or the exception, of that one
+    run. A caller that is cancelled only stops waiting; the run is
+    cancelled once no caller is waiting for it any more.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[str, Tuple[asyncio.Task, list]] = {}
+
+        self.leaders = 0
+        self.collapsed = 0
+        self.max_waiters = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Result of the run for key, and whether it was shared with an earlier caller"""
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            task = asyncio.ensure_future(factory())
+            flight = (task, [0])
+            self._flights[key] = flight
+            task.add_done_callback(lambda _, key=key, flight=flight: self._land(key, flight))
+            self.leaders += 1
+        else:
+            self.collapsed += 1
+
+        task, waiters = flight
+        waiters[0] += 1
+        self.max_waiters = max(self.max_waiters, waiters[0])
+        try:
+            # Shielded, so one caller going away doesn't cancel the others' result
+            return await asyncio.shield(task), shared
+        finally:
+            waiters[0] -= 1
+            if waiters[0] == 0 and not task.done():
+                task.cancel()
+                # Callers arriving from now on start a fresh run
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def _land(self, key: str, flight: tuple):
+        # A newer flight may already use the key once this one was cancelled
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        task = flight[0]
+        if not task.cancelled():
+            # Retrieved here so an exception nobody waited for isn't logged as lost
+            task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            "leaders": self.leaders,
+            "collapsed": self.collapsed,
+            "in_flight": len(self._flights),
+            "max_waiters": self.max_waiters
+        }
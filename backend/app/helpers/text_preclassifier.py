@@ -0,0 +1,217 @@
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+import unicodedata
+import re
+import numpy as np
+import os
+import logging
+from .aho_corasick import AhoCorasick
+# Load environment variables from .env file
+load_dotenv()
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+DEFAULT_LEXICON_PATH = os.path.join(DATA_DIR, "toxicity_lexicon.tsv")
+DEFAULT_BENIGN_WORDS_PATH = os.path.join(DATA_DIR, "benign_words.txt")
+# Longest message the benign word list may resolve on its own
+BENIGN_MAX_WORDS = 6
+
+SEVERITY_RANK = {"low": 1, "medium": 2, "high": 3}
+
+# A term preceded by one of these within CONTEXT_WORDS words may be
+# negated ("don't kill yourself") or someone else's words ("he said kys"),
+# which only the LLM can tell apart from the real thing
+NEGATIONS = frozenset({"not", "no", "never", "don't", "dont", "doesn't", "didn't", "won't",
+                       "wouldn't", "shouldn't", "can't", "cannot", "stop", "nobody", "without"})
+REPORTING = frozenset({"said", "says", "say", "saying", "told", "tells", "wrote", "writes", "called",
+                       "calls", "heard", "quote", "quoted", "reported", "asked", "asks", "like"})
+CONTEXT_WORDS = 4
+QUOTES = "\"“”„«»"
+_WORDS = re.compile(r"[\w']+")
+
+
+class TextPreClassifier:
+    """
+    Cheap local tier in front of the toxicity LLM.
+
+    Resolves clearly safe or clearly toxic text in microseconds with a
+    lexicon matcher and an optional small CPU classifier, and returns
+    None for anything ambiguous so it escalates to Groq.
+    """
+
+    def __init__(self, lexicon_path: str = DEFAULT_LEXICON_PATH,
+                 benign_words_path: str = DEFAULT_BENIGN_WORDS_PATH,
+                 model_path: Optional[str] = None,
+                 safe_below: float = 0.05, toxic_above: float = 0.95,
+                 toxic_min_hits: int = 2):
+        """
+        Args:
+            lexicon_path (str): TSV of term, category, severity
+            benign_words_path (str): Words that short messages can be made of and stay safe
+            model_path (str): Optional .onnx or joblib text classifier
+            safe_below (float): Classifier toxic probability under which text is safe
+            toxic_above (float): Classifier toxic probability over which text is toxic
+            toxic_min_hits (int): Distinct lexicon terms, one of them high severity,
+                that make text toxic without asking the LLM
+        """
+        self.safe_below = safe_below
+        self.toxic_above = toxic_above
+        self.toxic_min_hits = toxic_min_hits
+        self.lexicon = self._load_lexicon(lexicon_path)
+        self.matcher = AhoCorasick(self.lexicon.keys(), word_boundaries=True)
+        self.benign_words = self._load_words(benign_words_path)
+        self.model = self._load_model(model_path) if model_path else None
+        self.counters = {"empty": 0, "lexicon": 0, "classifier": 0, "llm": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["TextPreClassifier"]:
+        """Build the pre-classifier configured by PRECLASSIFIER_* (None when disabled)"""
+        if os.getenv("PRECLASSIFIER_ENABLED", "true").lower() != "true":
+            return None
+        return cls(
+            lexicon_path=os.getenv("TOXICITY_LEXICON_PATH", DEFAULT_LEXICON_PATH),
+            benign_words_path=os.getenv("BENIGN_WORDS_PATH", DEFAULT_BENIGN_WORDS_PATH),
+            model_path=os.getenv("PRECLASSIFIER_MODEL_PATH") or None,
+            safe_below=float(os.getenv("PRECLASSIFIER_SAFE_BELOW", "0.05")),
+            toxic_above=float(os.getenv("PRECLASSIFIER_TOXIC_ABOVE", "0.95")),
+            toxic_min_hits=int(os.getenv("PRECLASSIFIER_TOXIC_MIN_HITS", "2"))
+        )
+
+    def classify(self, text: str) -> Optional[Dict]:
+        """A toxicity result when the local tiers are confident, else None"""
+        if not any(char.isalpha() for char in text):
+            self.counters["empty"] += 1
+            return self._result(False, 1.0, [], [], "No words to analyze", "low", "local-rules")
+
+        normalized = unicodedata.normalize("NFKC", text).lower()
+        hits, separate, in_context = self._lexicon_hits(normalized)
+        worst = max((SEVERITY_RANK[hit["severity"]] for hit in hits), default=0)
+
+        words = [word.strip(".,!?;:'\"()") for word in normalized.split()]
+        if not hits and len(words) <= BENIGN_MAX_WORDS and all(
+                word in self.benign_words for word in words if word):
+            self.counters["lexicon"] += 1
+            return self._result(False, 0.95, [], [], "Short benign message", "low", "local-lexicon")
+
+        # One phrase alone can be advice, a quote or a report, and so can
+        # any match in quotes or after a negation: only the LLM decides those
+        if (worst == SEVERITY_RANK["high"] and separate >= self.toxic_min_hits
+                and not in_context and not any(quote in normalized for quote in QUOTES)):
+            self.counters["lexicon"] += 1
+            categories = sorted({hit["category"] for hit in hits})
+            return self._result(
+                True, 0.95, categories, hits,
+                "Matched several terms from the toxicity lexicon, high severity among them",
+                "high", "local-lexicon")
+
+        if self.model is not None:
+            probability = self._toxic_probability(normalized)
+            if probability is not None:
+                if probability >= self.toxic_above:
+                    self.counters["classifier"] += 1
+                    categories = sorted({hit["category"] for hit in hits})
+                    return self._result(
+                        True, probability, categories, hits,
+                        "Local classifier is confident the text is toxic",
+                        "medium" if worst < SEVERITY_RANK["medium"] else "high", "local-classifier")
+                if probability <= self.safe_below and not hits:
+                    self.counters["classifier"] += 1
+                    return self._result(
+                        False, 1.0 - probability, [], [],
+                        "Local classifier is confident the text is benign", "low", "local-classifier")
+
+        self.counters["llm"] += 1
+        return None
+
+    def stats(self) -> Dict:
+        total = sum(self.counters.values())
+        return {
+            "resolved_by_tier": dict(self.counters),
+            "local_resolution_rate": round(1 - self.counters["llm"] / total, 4) if total else 0.0,
+            "classifier_loaded": self.model is not None
+        }
+
+    def _lexicon_hits(self, normalized: str) -> Tuple[List[Dict], int, bool]:
+        """
+        Distinct lexicon terms in the text, how many distinct terms match
+        apart from each other ("go kill yourself" also holds "kill
+        yourself", one phrase), and whether any match follows a negation
+        or reporting word
+        """
+        hits, seen, spans, in_context = [], set(), [], False
+        for start, end, term in self.matcher.iter_matches(normalized):
+            spans.append((start, -end, term))
+            if not in_context:
+                before = normalized[max(0, start - 80):start].replace("’", "'")
+                in_context = any(word in NEGATIONS or word in REPORTING
+                                 for word in _WORDS.findall(before)[-CONTEXT_WORDS:])
+            if term in seen:
+                continue
+            seen.add(term)
+            category, severity = self.lexicon[term]
+            hits.append({"word": term, "category": category, "severity": severity})
+
+        # Longest match first at each start, then skip matches inside it
+        separate, last_end = set(), -1
+        for start, negative_end, term in sorted(spans):
+            if start >= last_end:
+                separate.add(term)
+                last_end = -negative_end
+        return hits, len(separate), in_context
+
+    def _toxic_probability(self, normalized: str) -> Optional[float]:
+        try:
+            if hasattr(self.model, "predict_proba"):
+                return float(self.model.predict_proba([normalized])[0][1])
+            # ONNX session exported from a text pipeline with a string input
+            session = self.model
+            outputs = session.run(None, {session.get_inputs()[0].name: np.array([[normalized]])})
+            probabilities = outputs[-1]
+            first = probabilities[0]
+            return float(first[1]) if not isinstance(first, dict) else float(first.get(1, first.get("1", 0.0)))
+        except Exception as e:
+            logging.error(f"Pre-classifier inference failed: {str(e)}", exc_info=True)
+            return None
+
+    @staticmethod
+    def _load_lexicon(path: str) -> Dict[str, tuple]:
+        lexicon = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                term, category, severity = [part.strip() for part in line.split("\t")]
+                lexicon[term.lower()] = (category, severity.lower())
+        return lexicon
+
+    @staticmethod
+    def _load_words(path: str) -> set:
+        with open(path, encoding="utf-8") as f:
+            return {
+                line.strip().lower() for line in f
+                if line.strip() and not line.startswith("#")
+            }
+
+    @staticmethod
+    def _load_model(path: str):
+        """Load the classifier once per worker; optional dependencies imported lazily"""
+        if path.endswith(".onnx"):
+            import onnxruntime
+
+            return onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        import joblib
+
+        return joblib.load(path)
+
+    @staticmethod
+    def _result(is_toxic: bool, confidence: float, categories: List[str], offensive_words: List[Dict],
+                reasoning: str, severity: str, model: str) -> Dict:
+        return {
+            "is_toxic": is_toxic,
+            "confidence": max(0.0, min(1.0, float(confidence))),
+            "categories": categories,
+            "reasoning": reasoning,
+            "offensive_words": offensive_words,
+            "severity": severity,
+            "model": model
+        }
@@ -0,0 +1,88 @@
+from typing import List, Tuple
+import numpy as np
+import cv2
+
+# (x, y, width, height)
+Box = Tuple[int, int, int, int]
+
+
+def detect_text_regions(binary: np.ndarray, max_tiles: int = 16, padding: int = 6) -> List[Box]:
+    """
+    Tiles covering the text in a binarized image, top to bottom.
+
+    Glyph sized components of either colour (dark text, or light text
+    left as holes in its outline) are smeared into lines with a wide
+    closing, and groups that look like a row of glyphs are kept. Each row
+    becomes a band, cropped to the horizontal extent of all the text
+    found so a row that was only partly detected is still read whole, and
+    consecutive rows are grouped to make at most max_tiles tiles. Returns
+    an empty list when nothing looks like text.
+    """
+    h, w = binary.shape[:2]
+    dark = cv2.threshold(binary, 127, 255, cv2.THRESH_BINARY_INV)[1]
+    lines = _find_lines(dark) + _find_lines(cv2.bitwise_not(dark))
+    if not lines:
+        return []
+
+    bands: List[List[int]] = []
+    for _, y, _, bh in sorted(lines, key=lambda line: line[1]):
+        # Lines side by side (columns, or both colours of one caption) share a band
+        if bands and y < bands[-1][1]:
+            bands[-1][1] = max(bands[-1][1], y + bh)
+        else:
+            bands.append([y, y + bh])
+    if len(bands) > max_tiles:
+        # More tiles than this would cost more in per call overhead than
+        # they gain in parallelism
+        size = -(-len(bands) // max_tiles)
+        bands = [[bands[i][0], bands[min(i + size, len(bands)) - 1][1]]
+                 for i in range(0, len(bands), size)]
+
+    x0 = max(0, min(line[0] for line in lines) - padding)
+    x1 = min(w, max(line[0] + line[2] for line in lines) + padding)
+    edges = [[max(0, top - padding), min(h, bottom + padding)] for top, bottom in bands]
+    for above, below in zip(edges, edges[1:]):
+        # Padding must not reach into the next row, or its text is read twice
+        if below[0] < above[1]:
+            above[1] = below[0] = (above[1] - padding + below[0] + padding) // 2
+    return [(x0, top, x1 - x0, bottom - top) for top, bottom in edges]
+
+
+def _find_lines(ink: np.ndarray) -> List[Box]:
+    h, w = ink.shape[:2]
+    # Drop speckle left by the adaptive threshold in flat or textured areas
+    ink = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+    # Grana's algorithm measured about twice as fast as OpenCV's default on these masks
+    _, labels, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+        ink, 8, cv2.CV_32S, cv2.CCL_GRANA)
+    widths = stats[:, cv2.CC_STAT_WIDTH]
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    # Keep glyph sized components only, so shape outlines and the
+    # background can't join rows of text together
+    is_glyph = ((heights >= 6) & (heights <= h // 4) & (widths <= heights * 4)
+                & (stats[:, cv2.CC_STAT_AREA] >= widths * heights * 0.1))
+    is_glyph[0] = False
+    if not is_glyph.any():
+        return []
+    glyphs = np.where(is_glyph, 255, 0).astype(np.uint8)[labels]
+
+    # Close horizontally across letter and word gaps to turn text into
+    # lines, wide enough for caption sized lettering
+    lines_mask = cv2.morphologyEx(glyphs, cv2.MORPH_CLOSE, cv2.getStructuringElement(
+        cv2.MORPH_RECT, (max(9, w // 50), 3)))
+
+    contours, _ = cv2.findContours(lines_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    lines = []
+    for x, y, bw, bh in map(cv2.boundingRect, contours):
+        if bh < 8 or bw < bh * 1.5:
+            continue
+        # Strokes cover a moderate share of a text line's box
+        box_glyphs = glyphs[y:y + bh, x:x + bw]
+        if not 0.08 <= cv2.countNonZero(box_glyphs) / float(bw * bh) <= 0.75:
+            continue
+        # and it holds several glyphs of about the line's height
+        inside = np.unique(labels[y:y + bh, x:x + bw][box_glyphs > 0])
+        if np.count_nonzero(heights[inside] >= bh * 0.35) < 3:
+            continue
+        lines.append((int(x), int(y), int(bw), int(bh)))
+    return lines
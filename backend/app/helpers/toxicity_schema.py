@@ -0,0 +1,165 @@
+from typing import Any, Dict, List, Tuple
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field, ValidationError, field_validator
+from .llm_json import repair_json
+
+# Codes of the compact answer schema
+CATEGORY_CODES = {"H": "hate_speech", "A": "harassment", "T": "threats",
+                  "S": "sexual", "X": "self_harm", "V": "violence"}
+SEVERITY_CODES = {"l": "low", "m": "medium", "h": "high"}
+CATEGORIES = frozenset(CATEGORY_CODES.values())
+SEVERITIES = frozenset(SEVERITY_CODES.values())
+
+
+class ToxicityAnswer(BaseModel):
+    """
+    A model's toxicity answer, in the compact schema or the long one.
+
+    The compact keys ("t", "c", "k", "s", "w", "r") and the long field
+    names, "overall_severity" included, are both accepted, and codes are
+    expanded to the names used in results. Only the verdict is required:
+    an answer without a readable "t" fails validation instead of reading
+    as safe, anything else off-schema falls back to a default.
+    """
+
+    model_config = ConfigDict(extra="ignore")
+
+    is_toxic: bool = Field(validation_alias=AliasChoices("t", "is_toxic"))
+    confidence: float = Field(0.0, validation_alias=AliasChoices("c", "confidence"))
+    categories: List[str] = Field(default_factory=list, validation_alias=AliasChoices("k", "categories"))
+    severity: str = Field("low", validation_alias=AliasChoices("s", "severity", "overall_severity"))
+    # {"word", "category", "severity"} dicts, built by the validator below
+    offensive_words: List[Dict[str, str]] = Field(
+        default_factory=list, validation_alias=AliasChoices("w", "offensive_words"))
+    reasoning: str = Field("No reasoning provided", validation_alias=AliasChoices("r", "reasoning"))
+
+    @field_validator("confidence", mode="before")
+    @classmethod
+    def _confidence(cls, value: Any) -> float:
+        try:
+            return max(0.0, min(1.0, float(value)))
+        except (TypeError, ValueError):
+            return 0.0
+
+    @field_validator("categories", mode="before")
+    @classmethod
+    def _categories(cls, value: Any) -> List[str]:
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list):
+            return []
+        names = (CATEGORY_CODES.get(code, code) for code in value if isinstance(code, str))
+        return list(dict.fromkeys(name for name in names if name in CATEGORIES))
+
+    @field_validator("severity", mode="before")
+    @classmethod
+    def _severity(cls, value: Any) -> str:
+        return _severity(value)
+
+    @field_validator("offensive_words", mode="before")
+    @classmethod
+    def _offensive_words(cls, value: Any) -> List[Dict]:
+        if not isinstance(value, list):
+            return []
+        words, seen = [], set()
+        for entry in value:
+            if isinstance(entry, str):
+                entry = [entry]
+            if isinstance(entry, dict):
+                entry = [entry.get("word"), entry.get("category"), entry.get("severity")]
+            if not isinstance(entry, list) or not entry or not isinstance(entry[0], str):
+                continue
+            if entry[0].lower() in seen:
+                continue
+            seen.add(entry[0].lower())
+            category = entry[1] if len(entry) > 1 and isinstance(entry[1], str) else ""
+            category = CATEGORY_CODES.get(category, category)
+            words.append({
+                "word": entry[0],
+                "category": category if category in CATEGORIES else "unknown",
+                "severity": _severity(entry[2] if len(entry) > 2 else None)
+            })
+        return words
+
+    @field_validator("reasoning", mode="before")
+    @classmethod
+    def _reasoning(cls, value: Any) -> str:
+        return "No reasoning provided" if value is None else str(value)
+
+
+class PackedEntry(ToxicityAnswer):
+    """One text's answer in a packed answer"""
+
+    index: int = Field(validation_alias=AliasChoices("i", "id"))
+
+
+class PackedAnswer(BaseModel):
+    """A packed answer, entries are validated one by one so a bad one only loses its text"""
+
+    model_config = ConfigDict(extra="ignore")
+
+    entries: List[Any] = Field(default_factory=list, validation_alias=AliasChoices("a", "results"))
+
+
+def parse_answer(content: str) -> Tuple[ToxicityAnswer, bool]:
+    """
+    The answer in content, and whether it had to be repaired first.
+    Raises ValueError (a pydantic ValidationError) when even the
+    repaired answer doesn't validate.
+    """
+    content = _trim(content)
+    try:
+        return ToxicityAnswer.model_validate_json(content), False
+    except ValidationError:
+        repaired = repair_json(content)
+        if repaired == content:
+            raise
+    return ToxicityAnswer.model_validate_json(repaired), True
+
+
+def parse_packed(content: str, count: int) -> Tuple[Dict[int, ToxicityAnswer], bool]:
+    """Valid answers by text id for ids below count, and whether the answer had to be repaired"""
+    content = _trim(content)
+    try:
+        packed, repaired = PackedAnswer.model_validate_json(content), False
+    except ValidationError:
+        fixed = repair_json(content)
+        if fixed == content:
+            raise
+        packed, repaired = PackedAnswer.model_validate_json(fixed), True
+
+    answers = {}
+    for entry in packed.entries:
+        try:
+            answer = PackedEntry.model_validate(entry)
+        except ValidationError:
+            continue
+        if 0 <= answer.index < count and answer.index not in answers:
+            answers[answer.index] = answer
+    return answers, repaired
+
+
+def describe_error(error: Exception) -> str:
+    """Short description of why an answer was rejected, to tell the model"""
+    if isinstance(error, ValidationError) and error.errors():
+        first = error.errors()[0]
+        location = ".".join(str(part) for part in first.get("loc", ())) or "answer"
+        return f"{location}: {first.get('msg', 'invalid')}"
+    return str(error)[:200]
+
+
+def _trim(content: str) -> str:
+    """content without a code fence or prose around its object, the usual wrapping that needs no repair"""
+    start = max(content.find("{"), 0)
+    end = content.rfind("}") + 1
+    # What follows a cut off answer is part of it, only plain text is dropped
+    if end <= start or any(ch in content[end:] for ch in '{["'):
+        end = len(content)
+    return content[start:end] if start or end < len(content) else content
+
+
+def _severity(value: Any) -> str:
+    if not isinstance(value, str):
+        return "low"
+    value = value.strip().lower()
+    value = SEVERITY_CODES.get(value, value)
+    return value if value in SEVERITIES else "low"
@@ -1,15 +1,88 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from PIL import Image, UnidentifiedImageError
-import io
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+import os
+import json
+import time
+import asyncio
+import base64
+import binascii
+import functools
 import logging
-import imghdr
 from pydantic import BaseModel
-from typing import Union, Optional
-from .agents import MainAgent
+from typing import Union, Optional, List
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager, AsyncExitStack
+from starlette.background import BackgroundTask
+from .agents import AgentRegistry, ToxicityAgent, SUMMARY_MODES
+from .helpers import CACHE_STATUS, ImageTooLargeError, AdmissionError, read_upload, open_image
+from .helpers import METRICS, MetricsMiddleware, LLMUnavailableError, TextTooLongError
+from .helpers.image_input import IMAGE_MAX_BYTES
 
-app = FastAPI()
+# Upper bound on the number of items in one /moderate/batch request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+# Largest JSON /moderate/batch body, uploaded files are bounded one by one
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(100 * 1024 * 1024)))
+# Serve /health while the agents are built and warmed up, /ready and the
+# moderation endpoints answer 503 until they are
+BACKGROUND_STARTUP = os.getenv("BACKGROUND_STARTUP", "true").lower() == "true"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the agents once per worker and share them across requests
+    app.state.registry = None
+    app.state.startup = {"status": "starting", "started_at": time.perf_counter()}
+    if BACKGROUND_STARTUP:
+        task = asyncio.create_task(_start(app))
+    else:
+        await _start(app)
+        if app.state.registry is None:
+            raise RuntimeError(app.state.startup["error"])
+    try:
+        yield
+    finally:
+        if BACKGROUND_STARTUP and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if app.state.registry is not None:
+            await app.state.registry.aclose()
+
+
+async def _start(app: FastAPI):
+    """Build and warm up the registry, recording how long it took"""
+    state = app.state.startup
+    registry = AgentRegistry()
+    try:
+        # Import the SDKs on a thread so the event loop keeps answering
+        # /health, the clients themselves are built on the loop
+        await asyncio.to_thread(AgentRegistry.preload)
+        registry.build()
+        await registry.warmup()
+    except Exception as e:
+        logging.error(e, exc_info=True)
+        await registry.aclose()
+        state.update(status="failed", error=str(e))
+        return
+    app.state.registry = registry
+    state.update(status="ready", seconds=round(time.perf_counter() - state["started_at"], 6))
+    logging.info(f"Ready {state['seconds']:.3f}s after startup began")
+
+
+def _registry(request: Request) -> AgentRegistry:
+    """The registry, or a 503 while the agents are still being built"""
+    registry = request.app.state.registry
+    if registry is None:
+        detail = ("Server failed to start" if request.app.state.startup["status"] == "failed"
+                  else "Server is starting, retry later")
+        raise HTTPException(503, detail, headers={"Retry-After": "1"})
+    return registry
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware - Allow all origins
 app.add_middleware(
@@ -18,63 +91,383 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["Server-Timing", "X-Cache", "X-Token-Usage"]
 )
+# Request durations for /metrics and the Server-Timing header of /moderate
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(AdmissionError)
+async def admission_error_handler(request: Request, exc: AdmissionError):
+    # 429 when the lane queue is full, 503 when a queued request waited too
+    # long or no LLM could check the content
+    detail = ("Content analysis is unavailable, retry later" if isinstance(exc, LLMUnavailableError)
+              else "Server is busy, retry later")
+    return JSONResponse(
+        {"detail": detail},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)}
+    )
 
 
 class TextRequest(BaseModel):
     text: str
 
 
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    text: Optional[str] = None
+    image_base64: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    mode: str = "full"
+
+
 @app.post("/moderate")
 async def moderate(
+    request: Request,
     text: Optional[str] = Form(None),
-    image: Union[UploadFile, None] = File(None)
+    image: Union[UploadFile, None] = File(None),
+    mode: str = Form("full")
 ):
     try:
         # Validate that at least one input is provided
         if not text and not image:
             raise HTTPException(400, "Either text or image must be provided")
+        _check_mode(mode)
+        if text:
+            _check_text(text)
+
+        registry = _registry(request)
+        main_agent = registry.acquire()
 
         if text:
-            result = await MainAgent().analyze_text(text)
+            async with registry.scheduler.admit("text"):
+                result = await main_agent.analyze_text(text, mode=mode)
             if "error" in result:
                 logging.error(
                     f"Text processing error: {result['error']}", exc_info=True)
                 raise HTTPException(400, "Image processing failed")
 
-            return JSONResponse({"result": result})
+            return _result_response(result)
 
         if image:
-            contents = await image.read()
+            contents, img = await _open_upload(image)
+            async with registry.scheduler.admit("image"):
+                result = await main_agent.analyze_image(img, content=contents, mode=mode)
+            if "error" in result:
+                logging.error(
+                    f"Image processing error: {result['error']}", exc_info=True)
+                raise HTTPException(400, "Image processing failed")
+
+            return _result_response(result)
+
+    except (HTTPException, AdmissionError):
+        raise
+    except Exception as e:
+        logging.error(f"Unexpected error: {str(e)}", exc_info=True)
+        raise HTTPException(500, "Content analysis failed")
+
+
+@app.post("/moderate/stream")
+async def moderate_stream(
+    request: Request,
+    text: Optional[str] = Form(None),
+    image: Union[UploadFile, None] = File(None),
+    mode: str = Form("full")
+):
+    """
+    /moderate as Server-Sent Events, each stage reported as soon as it is done.
+
+    Images send `nsfw` and `ocr` (in whichever order they finish), then
+    both texts and images send `toxicity_verdict` as soon as the model has
+    decided (with TOXICITY_STREAM), `toxicity` and `verdict`, `summary` events
+    with {"delta": ...} while the LLM summary is generated (mode=full),
+    and `done` with the same result /moderate returns, or `error`.
+    """
+    if not text and not image:
+        raise HTTPException(400, "Either text or image must be provided")
+    _check_mode(mode)
+    if text:
+        _check_text(text)
+
+    registry = _registry(request)
+    main_agent = registry.acquire()
+    if text:
+        lane, events = "text", main_agent.analyze_text_stream(text, mode=mode)
+    else:
+        contents, img = await _open_upload(image)
+        lane, events = "image", main_agent.analyze_image_stream(img, content=contents, mode=mode)
+
+    # Held until the stream ends like a batch, a full queue is reported
+    # before the response starts
+    admission = AsyncExitStack()
+    await admission.enter_async_context(registry.scheduler.admit(lane))
+
+    async def stream():
+        try:
+            async for event, data in events:
+                if event != "result":
+                    yield _sse(event, data)
+                elif "error" in data:
+                    logging.error(f"Streamed analysis failed: {data['error']}")
+                    yield _sse("error", {"detail": "Content analysis failed"})
+                else:
+                    yield _sse("done", {"result": data})
+        except AdmissionError as e:
+            logging.error(f"Streamed analysis failed: {e}")
+            yield _sse("error", {"detail": "Content analysis is unavailable, retry later",
+                                 "retry_after": e.retry_after})
+        finally:
+            await events.aclose()
+            await admission.aclose()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers,
+                             background=BackgroundTask(admission.aclose))
+
 
-            # Verify image type
-            image_type = imghdr.what(None, h=contents)
-            if not image_type:
-                raise HTTPException(400, "Invalid image file")
+@app.post("/moderate/batch")
+async def moderate_batch(request: Request):
+    """
+    Moderate many texts and images in one request.
 
+    Accepts multipart form data (repeated `texts` and `images` fields) or
+    JSON ({"items": [{"id", "text" | "image_base64"}]}) and streams one
+    NDJSON line per item as soon as its result is ready.
+    """
+    ids, items, failures = [], [], []
+
+    # Mode and item count are checked before any image is read, and each
+    # image is only read and decoded when its turn in the fan-out comes
+    if request.headers.get("content-type", "").startswith("application/json"):
+        body = await _read_body(request, BATCH_MAX_BYTES)
+        try:
+            batch = BatchRequest.model_validate_json(body)
+        except Exception:
+            raise HTTPException(400, "Invalid batch request body")
+        del body
+        mode = batch.mode
+        _check_batch(mode, len(batch.items))
+        for index, entry in enumerate(batch.items):
+            item_id = entry.id or str(index)
+            if entry.text:
+                try:
+                    ToxicityAgent.check_length(entry.text)
+                except TextTooLongError as e:
+                    failures.append({"id": item_id, "error": str(e)})
+                    continue
+                ids.append(item_id)
+                items.append({"text": entry.text})
+            elif entry.image_base64:
+                encoded = entry.image_base64.split(",")[-1]
+                # Four base64 characters per three bytes, known before decoding
+                if len(encoded) // 4 * 3 > IMAGE_MAX_BYTES:
+                    failures.append({"id": item_id, "error": f"Image larger than {IMAGE_MAX_BYTES} bytes"})
+                    continue
+                ids.append(item_id)
+                items.append({"load": functools.partial(_decode_image, encoded)})
+            else:
+                failures.append(
+                    {"id": item_id, "error": "Either text or image_base64 must be provided"})
+    else:
+        # Parsing stops at the first field past the limits, before the count check
+        form = await request.form(max_files=BATCH_MAX_ITEMS, max_fields=BATCH_MAX_ITEMS + 1)
+        mode = form.get("mode") or "full"
+        texts, uploads = form.getlist("texts"), form.getlist("images")
+        _check_batch(mode, len(texts) + len(uploads))
+        for index, text in enumerate(texts):
+            if not text:
+                continue
             try:
-                img = Image.open(io.BytesIO(contents))
-                img.verify()
-                img = Image.open(io.BytesIO(contents))
+                ToxicityAgent.check_length(text)
+            except TextTooLongError as e:
+                failures.append({"id": f"text-{index}", "error": str(e)})
+                continue
+            ids.append(f"text-{index}")
+            items.append({"text": text})
+        for index, upload in enumerate(uploads):
+            ids.append(f"image-{index}")
+            items.append({"load": functools.partial(read_upload, upload)})
 
-                result = await MainAgent().analyze_image(img)
-                if "error" in result:
-                    logging.error(
-                        f"Image processing error: {result['error']}", exc_info=True)
-                    raise HTTPException(400, "Image processing failed")
+    if not items and not failures:
+        raise HTTPException(400, "Either texts or images must be provided")
 
-                return JSONResponse({"result": result})
+    registry = _registry(request)
+    main_agent = registry.acquire()
 
-            except UnidentifiedImageError:
-                raise HTTPException(400, "Invalid image format")
+    # The whole batch holds one slot of its lane until the stream ends, a
+    # full queue is reported before the response starts
+    admission = AsyncExitStack()
+    await admission.enter_async_context(registry.scheduler.admit(
+        "image" if any("image" in item for item in items) else "text"))
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logging.error(f"Unexpected error: {str(e)}", exc_info=True)
-        raise HTTPException(500, "Content analysis failed")
+    async def stream():
+        try:
+            for failure in failures:
+                yield json.dumps(failure) + "\n"
+            async for index, result in main_agent.analyze_batch(items, mode):
+                if "invalid_input" in result:
+                    line = {"id": ids[index], "error": result["invalid_input"]}
+                elif "error" in result:
+                    logging.error(f"Batch item {ids[index]} failed: {result['error']}")
+                    line = {"id": ids[index], "error": "Content analysis failed"}
+                else:
+                    line = {"id": ids[index], "result": result}
+                yield json.dumps(line) + "\n"
+        finally:
+            await admission.aclose()
+
+    # Also released after the response, in case the client left before
+    # the stream started
+    return StreamingResponse(stream(), media_type="application/x-ndjson",
+                             background=BackgroundTask(admission.aclose))
+
+
+@app.get("/results/{result_id}")
+async def get_result(request: Request, result_id: str):
+    """Poll the summary of a request made with mode=async_summary"""
+    main_agent = _registry(request).main_agent
+    summary_result = await main_agent.get_summary_result(result_id)
+    if summary_result is None:
+        raise HTTPException(404, "Unknown or expired result id")
+    return {"result_id": result_id, **summary_result}
+
+
+async def _open_upload(image: UploadFile):
+    """Bytes and lazily decoded image of an upload, or an HTTP error"""
+    try:
+        # Streamed with a size limit and sniffed from the first
+        # chunk, only the header is parsed before analysis
+        contents = await read_upload(image)
+        return contents, open_image(contents)
+    except ImageTooLargeError as e:
+        raise HTTPException(413, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+def _check_batch(mode: str, count: int):
+    _check_mode(mode)
+    if count > BATCH_MAX_ITEMS:
+        raise HTTPException(413, f"At most {BATCH_MAX_ITEMS} items per batch")
+
+
+async def _read_body(request: Request, max_bytes: int) -> bytes:
+    """The request body, or a 413 as soon as it is known to be over max_bytes"""
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_bytes:
+        raise HTTPException(413, f"Request body larger than {max_bytes} bytes")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise HTTPException(413, f"Request body larger than {max_bytes} bytes")
+    return bytes(body)
+
+
+async def _decode_image(encoded: str) -> bytes:
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"Invalid base64 image: {e}")
+
+
+def _check_text(text: str):
+    """A text over the toxicity prompt budget is rejected before it takes an admission slot"""
+    try:
+        ToxicityAgent.check_length(text)
+    except TextTooLongError as e:
+        raise HTTPException(413, str(e))
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _check_mode(mode: str):
+    if mode not in SUMMARY_MODES:
+        raise HTTPException(
+            400, f"Invalid mode, expected one of: {', '.join(SUMMARY_MODES)}")
+
+
+def _result_response(result: dict) -> JSONResponse:
+    """Wrap a moderation result, reporting whether it came from the cache"""
+    headers = {}
+    cache_status = CACHE_STATUS.get()
+    if cache_status:
+        headers["X-Cache"] = cache_status
+    return JSONResponse({"result": result}, headers=headers)
 
 
 @app.get("/health")
-async def health_check():
+async def health_check(request: Request):
+    """Liveness: the process serves requests, whether or not the agents are built yet"""
+    if request.app.state.startup["status"] == "failed":
+        return JSONResponse({"status": "unhealthy", "error": request.app.state.startup["error"]},
+                            status_code=503)
     return {"status": "healthy"}
+
+
+@app.get("/ready")
+async def ready_check(request: Request):
+    """Readiness: the agents are built and warmed up, moderation requests can be sent"""
+    startup = request.app.state.startup
+    if startup["status"] != "ready":
+        return JSONResponse({"status": startup["status"]}, status_code=503, headers={"Retry-After": "1"})
+    return {"status": "ready", "startup_seconds": startup["seconds"]}
+
+
+@app.get("/stats")
+async def stats(request: Request):
+    registry = _registry(request)
+    return {
+        "agents": registry.stats(),
+        "result_cache": registry.result_cache.stats() if registry.result_cache else None,
+        "near_duplicate_index": registry.near_duplicate_index.stats() if registry.near_duplicate_index else None,
+        "text_preclassifier": registry.text_preclassifier.stats() if registry.text_preclassifier else None,
+        "scheduler": registry.scheduler.stats(),
+        "toxicity": registry.main_agent.toxicity_agent.stats(),
+        "llm": registry.llm_gateway.stats(),
+        "single_flight": {
+            "image": registry.main_agent.image_flights.stats(),
+            "text": registry.main_agent.text_flights.stats()
+        },
+        "ocr": registry.main_agent.ocr_agent.stats(),
+        "vision": registry.main_agent.nsfw_agent.stats()
+    }
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    """Stage latencies, external calls, token usage and cache hits in the Prometheus text format"""
+    # Scrapes before the agents are built only get the request metrics
+    registry = request.app.state.registry
+    families = registry.metric_families() if registry is not None else []
+    return PlainTextResponse(METRICS.render(families),
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.post("/index/seed")
+async def seed_near_duplicate_index(
+    request: Request,
+    images: List[UploadFile] = File(...),
+    label: str = Form("known unsafe content")
+):
+    """Add known-bad images so near copies are flagged without a full analysis"""
+    index = _registry(request).near_duplicate_index
+    if index is None:
+        raise HTTPException(409, "Near-duplicate index is disabled")
+
+    seeded = 0
+    for upload in images:
+        try:
+            img = open_image(await read_upload(upload))
+            seeded += await run_in_threadpool(index.seed, [img], label)
+        except (ValueError, OSError):
+            raise HTTPException(400, f"Invalid image file: {upload.filename}")
+
+    return {"seeded": seeded, "entries": index.stats()["entries"]}
+
@@ -0,0 +1,124 @@
+"""
+Cold start of the app: import time per module, and how long a new server takes to go live and ready.
+
+- imports: `python -X importtime -c "import app.main"` in a fresh
+  interpreter, --runs times. Reports the total and the packages that
+  take longest to import, each with everything it imports in turn.
+- startup: starts uvicorn with the app --runs times and polls /health
+  (liveness) and /ready (readiness), reporting the seconds from spawning
+  the process to the first 200 of each. A tree without /ready counts as
+  ready when /health answers.
+
+The app is started with NSFW_BACKEND=fake and no Groq calls are made, so
+no API keys or network are needed. OCR still needs Tesseract, point
+TESSERACT_PATH at it.
+
+Usage: python -m benchmarks.cold_start [--runs 5] [--top 15] [--json out.json]
+"""
+from typing import Dict, Optional, Tuple
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+import httpx
+from benchmarks.report import latency_summary, print_results, write_report
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_profile() -> Tuple[float, Dict[str, float]]:
+    """Seconds to import app.main, and cumulative seconds per package it pulls in"""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                            capture_output=True, text=True, env=_env(), check=True).stderr
+    lines = [match.groups() for match in map(IMPORT_LINE.match, output.splitlines()) if match]
+    packages, total, stack = {}, 0.0, []
+    # Children are printed before their parent, reversed each parent comes first
+    for _, cumulative, indent, name in reversed(lines):
+        depth = len(indent)
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        parent = stack[-1][1] if stack else None
+        stack.append((depth, name))
+        root = name.split(".")[0]
+        if name == "app.main":
+            total = int(cumulative) / 1e6
+        elif root != "app" and (parent is None or parent.split(".")[0] != root):
+            # Imported from another package, its whole subtree is this package's cost
+            packages[root] = packages.get(root, 0.0) + int(cumulative) / 1e6
+    return total, packages
+
+
+def startup(port: int, timeout: float) -> Tuple[Optional[float], Optional[float]]:
+    """Seconds until /health and until /ready first answer 200"""
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"], env=_env())
+    live = ready = None
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1.0) as client:
+            while time.perf_counter() - start < timeout and server.poll() is None:
+                try:
+                    if live is None and client.get("/health").status_code == 200:
+                        live = time.perf_counter() - start
+                    if live is not None:
+                        response = client.get("/ready")
+                        if response.status_code == 200 or response.status_code == 404:
+                            ready = time.perf_counter() - start
+                            break
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return live, ready
+
+
+def _env() -> Dict[str, str]:
+    return dict(os.environ, NSFW_BACKEND="fake", GROQ_API_KEY=os.getenv("GROQ_API_KEY", "unused"))
+
+
+def main(runs: int, top: int, port: int, timeout: float) -> Dict:
+    totals, slowest = [], {}
+    for _ in range(runs):
+        total, modules = import_profile()
+        totals.append(total)
+        for name, seconds in modules.items():
+            slowest.setdefault(name, []).append(seconds)
+    heaviest = sorted(((name, min(values)) for name, values in slowest.items()), key=lambda item: -item[1])[:top]
+
+    live, ready = [], []
+    for _ in range(runs):
+        live_seconds, ready_seconds = startup(port, timeout)
+        if live_seconds is not None:
+            live.append(live_seconds)
+        if ready_seconds is not None:
+            ready.append(ready_seconds)
+
+    results = [
+        latency_summary("import/app.main", totals, sum(totals)),
+        latency_summary("startup/live", live, sum(live) or 1, failed=runs - len(live)),
+        latency_summary("startup/ready", ready, sum(ready) or 1, failed=runs - len(ready))
+    ]
+    return {"results": results,
+            "heaviest_imports_ms": {name: round(seconds * 1000, 1) for name, seconds in heaviest}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Heaviest imports to list")
+    parser.add_argument("--port", type=int, default=8120)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for a server to be ready")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    report = main(args.runs, args.top, args.port, args.timeout)
+    print_results(report["results"])
+    print("heaviest imports:")
+    for name, ms in report["heaviest_imports_ms"].items():
+        print(f"  {name:<48} {ms:>9.1f} ms")
+    write_report(args.json, "cold_start", report.pop("results"), **report)
@@ -0,0 +1,70 @@
+"""
+Compare two benchmark reports and fail on regressions.
+
+Matches the entries of two reports written with --json (by
+benchmarks.micro, benchmarks.load_test or anything else using
+benchmarks.report) by name. An entry regresses when a latency
+percentile or its peak RSS grows, or its throughput drops, by more than
+--threshold. Exits with status 1 if any entry regressed, so it can gate
+a CI job.
+
+Usage: python -m benchmarks.compare baseline.json current.json [--threshold 0.1] [--metrics p95_ms throughput_per_s]
+"""
+from typing import Dict, List
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "peak_rss_mb")
+HIGHER_IS_BETTER = ("throughput_per_s",)
+
+
+def compare(baseline: Dict, current: Dict, threshold: float, metrics: List[str]) -> List[Dict]:
+    """One row per entry and metric found in both reports"""
+    before = {entry["name"]: entry for entry in baseline["results"]}
+    rows = []
+    for entry in current["results"]:
+        previous = before.get(entry["name"])
+        if previous is None:
+            continue
+        for metric in metrics:
+            old, new = previous.get(metric), entry.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change if metric in LOWER_IS_BETTER else -change
+            rows.append({"name": entry["name"], "metric": metric, "baseline": old, "current": new,
+                         "change": round(change, 4), "regressed": worse > threshold})
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change that counts as a regression")
+    parser.add_argument("--metrics", nargs="+", default=["p50_ms", "p95_ms", "p99_ms", "throughput_per_s"],
+                        choices=LOWER_IS_BETTER + HIGHER_IS_BETTER)
+    parser.add_argument("--json", help="Write the comparison to this file")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get("environment", {}).get("cpu_count") != current.get("environment", {}).get("cpu_count"):
+        print("warning: the reports come from machines with different core counts")
+
+    rows = compare(baseline, current, args.threshold, args.metrics)
+    width = max((len(row["name"]) for row in rows), default=0)
+    for row in rows:
+        flag = "REGRESSED" if row["regressed"] else ""
+        print(f"{row['name']:<{width}}  {row['metric']:<16} {row['baseline']:>12} -> {row['current']:<12} "
+              f"{row['change']:+8.1%}  {flag}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+    regressions = [row for row in rows if row["regressed"]]
+    print(f"{len(regressions)} regression(s) in {len(rows)} comparisons (threshold {args.threshold:.0%})")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,84 @@
+"""
+Concurrent throughput of MainAgent.analyze_image with simulated backends.
+
+Every external call (Groq, Vision, Tesseract) is replaced by a stand-in
+with a fixed latency. When the pipeline is non-blocking, throughput grows
+with the number of in-flight requests instead of staying flat.
+
+Usage: python -m benchmarks.concurrency_load [--requests 64] [--json out.json]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import argparse
+import asyncio
+import json
+import time
+from app.agents import MainAgent, NSFWAgent, ToxicityAgent
+from app.helpers import ImagePreprocessor, PromptInjectionDetector
+from benchmarks.fakes import FakeAsyncGroq, FakeVisionAsyncClient, FakeOCRAgent
+
+
+def build_agent(executor: ThreadPoolExecutor, groq_client: FakeAsyncGroq = None) -> MainAgent:
+    groq_client = groq_client or FakeAsyncGroq()
+    return MainAgent(
+        ocr_agent=FakeOCRAgent(executor=executor),
+        nsfw_agent=NSFWAgent(client=FakeVisionAsyncClient(), executor=executor),
+        toxicity_agent=ToxicityAgent(client=groq_client),
+        image_preprocessor=ImagePreprocessor(
+            target_size=(320, 240), executor=executor),
+        prompt_injection_detector=PromptInjectionDetector(),
+        groq_client=groq_client
+    )
+
+
+async def run_level(agent: MainAgent, image: Image.Image, concurrency: int, total: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await agent.analyze_image(image)
+            latencies.append(time.perf_counter() - start)
+
+    vision_calls = agent.nsfw_agent.backend.calls
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "elapsed_seconds": round(elapsed, 4),
+        "throughput_rps": round(total / elapsed, 2),
+        "mean_latency_seconds": round(sum(latencies) / len(latencies), 4),
+        # Images in flight together share batched Vision calls
+        "vision_calls": agent.nsfw_agent.backend.calls - vision_calls
+    }
+
+
+async def main(total: int, levels):
+    image = Image.new("RGB", (640, 480), color="white")
+    with ThreadPoolExecutor(max_workers=max(levels)) as executor:
+        agent = build_agent(executor)
+        results = []
+        for level in levels:
+            results.append(await run_level(agent, image, level, total))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args.requests, args.levels))
+    for row in results:
+        print(f"concurrency={row['concurrency']:>3}  "
+              f"throughput={row['throughput_rps']:>7} req/s  "
+              f"mean latency={row['mean_latency_seconds']}s  "
+              f"vision calls={row['vision_calls']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,94 @@
+"""
+Throughput of the CPU bound stages on executor threads vs a process pool.
+
+Runs ImagePreprocessor.preprocess_profiles (and, with --ocr, OCRAgent on
+the "ocr" profile) for a stream of 1600x1200 JPEG uploads with 1, 4 and
+16 workers in each mode. In "process" mode the decoded arrays reach the
+workers through shared memory. Worker counts above the machine's core
+count are still run but can't scale further.
+
+--ocr needs Tesseract (TESSERACT_PATH) or, with --engine tesserocr, the
+tesserocr package.
+
+Usage: python -m benchmarks.cpu_pool [--images 64] [--ocr] [--engine pytesseract] [--json out.json]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from app.agents import OCRAgent
+from app.helpers import ImagePreprocessor, ProcessPool, open_image
+from benchmarks.preprocess_filters import synthetic_photo
+
+LEVELS = (1, 4, 16)
+
+
+async def run_level(mode: str, workers: int, uploads, ocr: bool, engine: str) -> dict:
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pool = ProcessPool(workers) if mode == "process" else None
+    preprocessor = ImagePreprocessor(executor=executor, process_pool=pool)
+    ocr_agent = OCRAgent(executor=executor, engine=engine, process_pool=pool) if ocr else None
+    # Twice as many images in flight as workers keeps every worker busy
+    semaphore = asyncio.Semaphore(workers * 2)
+
+    async def one(contents: bytes):
+        async with semaphore:
+            views = await preprocessor.preprocess_profiles(open_image(contents))
+            if ocr_agent is not None:
+                await ocr_agent.extract_text_async(views["ocr"])
+
+    try:
+        if pool is not None:
+            await pool.warmup()
+        await one(uploads[0])
+        start = time.perf_counter()
+        await asyncio.gather(*(one(contents) for contents in uploads))
+        elapsed = time.perf_counter() - start
+    finally:
+        executor.shutdown(wait=True)
+        if pool is not None:
+            pool.shutdown()
+
+    return {
+        "mode": mode,
+        "workers": workers,
+        "images": len(uploads),
+        "elapsed_seconds": round(elapsed, 3),
+        "images_per_second": round(len(uploads) / elapsed, 2)
+    }
+
+
+async def main(images: int, ocr: bool, engine: str):
+    uploads = []
+    for seed in range(min(images, 8)):
+        buffer = io.BytesIO()
+        synthetic_photo(1600, 1200, seed=seed).save(buffer, format="JPEG", quality=90)
+        uploads.append(buffer.getvalue())
+    uploads = [uploads[i % len(uploads)] for i in range(images)]
+
+    results = []
+    for workers in LEVELS:
+        for mode in ("thread", "process"):
+            results.append(await run_level(mode, workers, uploads, ocr, engine))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--ocr", action="store_true", help="Also run OCR on every image")
+    parser.add_argument("--engine", default="pytesseract", choices=["pytesseract", "tesserocr"])
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores available")
+    results = asyncio.run(main(args.images, args.ocr, args.engine))
+    for row in results:
+        print(f"{row['mode']:<8} workers={row['workers']:>3}  "
+              f"{row['images_per_second']:>7} images/s  ({row['elapsed_seconds']}s)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
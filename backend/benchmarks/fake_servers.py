@@ -0,0 +1,237 @@
+"""
+Local Groq and Google Vision servers for load tests.
+
+The Groq server speaks the OpenAI compatible HTTP API the groq SDK uses
+(POST /openai/v1/chat/completions, streamed or not). The Vision server
+answers BatchAnnotateImages over gRPC. Both reply like the stand-ins in
+benchmarks.fakes after a latency drawn from a configurable distribution,
+and can fail a share of calls. Point the app at them with:
+
+    GROQ_BASE_URL=http://127.0.0.1:8101 GROQ_API_KEY=fake
+    VISION_API_ENDPOINT=127.0.0.1:8102 VISION_API_INSECURE=true
+
+Latency specs: "0.2" (fixed), "uniform:0.1,0.3", "normal:0.2,0.05" or
+"lognormal:0.2,0.5" (median and sigma), all in seconds.
+
+Usage: python -m benchmarks.fake_servers [--groq-port 8101] [--vision-port 8102]
+       [--groq-latency lognormal:0.3,0.4] [--vision-latency lognormal:0.15,0.3]
+"""
+from google.cloud import vision
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+import grpc
+import uvicorn
+from benchmarks.fakes import completion_content, safe_annotations
+
+
+class Latency:
+    """Seconds to wait before each reply, drawn from a spec (see the module docstring)"""
+
+    def __init__(self, spec: str, seed: int = 0):
+        self.spec = spec
+        kind, _, params = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+        values = [float(value) for value in params.split(",")]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        if len(values) != (1 if kind == "fixed" else 2):
+            raise ValueError(f"Wrong number of parameters in latency spec: {spec}")
+        self.kind = kind
+        self.values = values
+        self.random = random.Random(seed)
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.values[0]
+        a, b = self.values
+        if self.kind == "uniform":
+            return self.random.uniform(a, b)
+        if self.kind == "normal":
+            return max(0.0, self.random.gauss(a, b))
+        return self.random.lognormvariate(math.log(a), b)
+
+
+class FakeGroqServer:
+    """Starlette app answering chat completions like FakeAsyncGroq"""
+
+    def __init__(self, latency: Latency, token_latency: float = 0.01, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+        self.app = Starlette(routes=[
+            Route("/openai/v1/chat/completions", self.completions, methods=["POST"])])
+
+    async def completions(self, request: Request):
+        self.calls += 1
+        body = await request.json()
+        await asyncio.sleep(self.latency.sample())
+        if self.random.random() < self.error_rate:
+            self.failures += 1
+            return JSONResponse({"error": {"message": "Service unavailable", "type": "internal_error"}},
+                                status_code=503)
+
+        prompt = body["messages"][-1]["content"]
+        content = completion_content(prompt)
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                 "total_tokens": len(prompt) // 4 + len(content) // 4}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        if body.get("stream"):
+            return StreamingResponse(self._stream(completion_id, body["model"], content, usage),
+                                     media_type="text/event-stream")
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+    async def _stream(self, completion_id: str, model: str, content: str, usage: dict):
+        def chunk(delta: dict, finish_reason=None, **extra) -> str:
+            return "data: " + json.dumps(dict({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }, **extra)) + "\n\n"
+
+        for index, word in enumerate(content.split(" ")):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            yield chunk({"content": word if index == 0 else " " + word})
+        # Like Groq, the last chunk carries the usage
+        yield chunk({}, "stop", x_groq={"id": completion_id, "usage": usage})
+        yield "data: [DONE]\n\n"
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "failures": self.failures}
+
+
+class FakeVisionServer:
+    """gRPC ImageAnnotator answering BatchAnnotateImages like FakeVisionAsyncClient"""
+
+    def __init__(self, latency: Latency, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.images = 0
+        self.failures = 0
+
+    async def batch_annotate_images(self, request, context):
+        self.calls += 1
+        self.images += len(request.requests)
+        await asyncio.sleep(self.latency.sample())
+        if self.random.random() < self.error_rate:
+            self.failures += 1
+            await context.abort(grpc.StatusCode.UNAVAILABLE, "Service unavailable")
+        return safe_annotations(len(request.requests))
+
+    def handler(self) -> grpc.GenericRpcHandler:
+        return grpc.method_handlers_generic_handler("google.cloud.vision.v1.ImageAnnotator", {
+            "BatchAnnotateImages": grpc.unary_unary_rpc_method_handler(
+                self.batch_annotate_images,
+                request_deserializer=vision.BatchAnnotateImagesRequest.deserialize,
+                response_serializer=vision.BatchAnnotateImagesResponse.serialize)
+        })
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "images": self.images, "failures": self.failures}
+
+
+class FakeServers:
+    """Both servers on the running event loop, as an async context manager"""
+
+    def __init__(self, groq: FakeGroqServer, vision_server: FakeVisionServer,
+                 host: str = "127.0.0.1", groq_port: int = 8101, vision_port: int = 8102):
+        self.groq = groq
+        self.vision = vision_server
+        self.host = host
+        self.groq_port = groq_port
+        self.vision_port = vision_port
+        self._http = None
+        self._http_task = None
+        self._grpc = None
+
+    @property
+    def env(self) -> dict:
+        """Environment that points the app at these servers"""
+        return {
+            "GROQ_BASE_URL": f"http://{self.host}:{self.groq_port}",
+            "GROQ_API_KEY": "fake",
+            "VISION_API_ENDPOINT": f"{self.host}:{self.vision_port}",
+            "VISION_API_INSECURE": "true"
+        }
+
+    async def __aenter__(self) -> "FakeServers":
+        self._http = uvicorn.Server(uvicorn.Config(
+            self.groq.app, host=self.host, port=self.groq_port, log_level="warning"))
+        self._http_task = asyncio.create_task(self._http.serve())
+        self._grpc = grpc.aio.server()
+        self._grpc.add_generic_rpc_handlers((self.vision.handler(),))
+        self._grpc.add_insecure_port(f"{self.host}:{self.vision_port}")
+        await self._grpc.start()
+        while not self._http.started:
+            if self._http_task.done():
+                # Failed to start, most likely the port is taken
+                self._http_task.result()
+            await asyncio.sleep(0.01)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._http.should_exit = True
+        await self._http_task
+        await self._grpc.stop(grace=None)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--groq-port", type=int, default=8101)
+    parser.add_argument("--vision-port", type=int, default=8102)
+    parser.add_argument("--groq-latency", default="lognormal:0.3,0.4",
+                        help="Latency of a Groq reply (or its first token)")
+    parser.add_argument("--groq-token-latency", type=float, default=0.01,
+                        help="Seconds between streamed tokens")
+    parser.add_argument("--vision-latency", default="lognormal:0.15,0.3")
+    parser.add_argument("--groq-error-rate", type=float, default=0.0, help="Share of Groq calls answered 503")
+    parser.add_argument("--vision-error-rate", type=float, default=0.0,
+                        help="Share of Vision calls failed with UNAVAILABLE")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the latency and error draws")
+
+
+def from_arguments(args) -> FakeServers:
+    return FakeServers(
+        FakeGroqServer(Latency(args.groq_latency, args.seed), args.groq_token_latency,
+                       args.groq_error_rate, args.seed),
+        FakeVisionServer(Latency(args.vision_latency, args.seed + 1), args.vision_error_rate, args.seed + 1),
+        groq_port=args.groq_port, vision_port=args.vision_port)
+
+
+async def serve(servers: FakeServers):
+    async with servers:
+        print("Serving, point the app at them with:")
+        for name, value in servers.env.items():
+            print(f"  {name}={value}")
+        await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    try:
+        asyncio.run(serve(from_arguments(parser.parse_args())))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,125 @@
+"""
+Local stand-ins for the external services used by the agents.
+
+They mimic just enough of the Groq, Google Vision and Tesseract
+interfaces for the pipeline to run, with a configurable latency so
+benchmarks can measure scheduling and overlap without network access.
+"""
+from types import SimpleNamespace
+from typing import AsyncIterator
+from google.cloud import vision
+from PIL import Image
+import asyncio
+import json
+import time
+from app.agents import OCRAgent
+
+# A safe answer in the compact schema of ToxicityAgent
+TOXICITY_RESPONSE = {"t": 0, "c": 0.9, "k": [], "s": "l", "w": [], "r": "Benign text"}
+
+
+def completion_content(prompt: str) -> str:
+    """What the stand-in model answers to prompt"""
+    if "(JSON array):" in prompt:
+        items = json.loads(prompt.split("(JSON array):", 1)[1].strip())
+        return json.dumps({"a": [dict(TOXICITY_RESPONSE, i=item["id"]) for item in items]})
+    if "JSON" in prompt:
+        return json.dumps(TOXICITY_RESPONSE)
+    return "The content appears safe for most audiences."
+
+
+def safe_annotations(count: int) -> vision.BatchAnnotateImagesResponse:
+    """A Vision response rating each of count images VERY_UNLIKELY in every category"""
+    annotation = vision.AnnotateImageResponse(
+        safe_search_annotation=vision.SafeSearchAnnotation(
+            adult=1, violence=1, racy=1, medical=1, spoof=1))
+    return vision.BatchAnnotateImagesResponse(responses=[annotation for _ in range(count)])
+
+
+class FakeStream:
+    """Streamed completion that, like Groq's, is iterated and then closed"""
+
+    def __init__(self, chunks: AsyncIterator):
+        self.chunks = chunks
+        self.closed = False
+
+    def __aiter__(self):
+        return self.chunks
+
+    async def close(self):
+        self.closed = True
+        await self.chunks.aclose()
+
+
+class FakeAsyncGroq:
+    """
+    Async Groq client answering toxicity prompts with JSON and others with
+    prose. With stream=True the reply arrives word by word after latency,
+    token_latency apart.
+    """
+
+    def __init__(self, latency: float = 0.2, token_latency: float = 0.01):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = 0
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, messages, model, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        content = completion_content(prompt)
+        if kwargs.get("stream"):
+            return FakeStream(self._stream(content, len(prompt) // 4))
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=len(prompt) // 4,
+                                  completion_tokens=len(content) // 4)
+        )
+
+    async def _stream(self, content: str, prompt_tokens: int):
+        for index, word in enumerate(content.split(" ")):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            delta = word if index == 0 else " " + word
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+        # Like Groq, the last chunk carries the usage
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(content) // 4)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None))],
+                              x_groq=SimpleNamespace(usage=usage))
+
+    async def close(self):
+        pass
+
+
+class FakeVisionAsyncClient:
+    """Async Vision client returning a fixed, safe annotation per request"""
+
+    def __init__(self, latency: float = 0.15):
+        self.latency = latency
+        self.calls = 0
+
+    async def batch_annotate_images(self, requests):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return safe_annotations(len(requests))
+
+
+class FakeOCRAgent(OCRAgent):
+    """OCR agent that blocks its worker thread instead of running Tesseract"""
+
+    def __init__(self, latency: float = 0.1, text: str = "hello world", executor=None, limiter=None):
+        self.latency = latency
+        self.text = text
+        self.executor = executor
+        self.limiter = limiter
+        self.process_pool = None
+        # Full mode sends the whole image through extract_text below
+        self.mode = "full"
+        self.images = self.fallbacks = self.tiles = 0
+
+    def extract_text(self, image: Image.Image) -> str:
+        time.sleep(self.latency)
+        return self.text
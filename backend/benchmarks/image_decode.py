@@ -0,0 +1,132 @@
+"""
+Memory and latency of turning an uploaded photo into the preprocessing array.
+
+The legacy path sniffed the bytes with imghdr, decoded them with
+Image.open().verify(), opened them again and copied the full-resolution
+pixels into NumPy before resizing. The new path sniffs the magic bytes,
+parses only the header and lets libjpeg decode at a reduced scale
+(PIL draft) before the one resize.
+
+Every measurement runs in a fresh process so its peak RSS is its own
+(read from /proc, so Linux only).
+
+Usage: python -m benchmarks.image_decode [--json out.json]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import time
+import warnings
+import cv2
+import numpy as np
+from PIL import Image
+
+SIZES_MP = {12: (4000, 3000), 24: (6000, 4000), 48: (8000, 6000)}
+
+
+def legacy_decode(contents: bytes, target_size=(1600, 1200)) -> np.ndarray:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import imghdr
+
+    if not imghdr.what(None, h=contents):
+        raise ValueError("Invalid image file")
+    img = Image.open(io.BytesIO(contents))
+    img.verify()
+    img = Image.open(io.BytesIO(contents))
+    array = np.array(img)
+    if len(array.shape) == 3 and array.shape[2] == 3:
+        array = cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
+    h, w = array.shape[:2]
+    ratio = min(target_size[0] / w, target_size[1] / h)
+    if ratio < 1:
+        array = cv2.resize(array, (int(w * ratio), int(h * ratio)), interpolation=cv2.INTER_AREA)
+    return array
+
+
+def single_decode(contents: bytes) -> np.ndarray:
+    from app.helpers import ImagePreprocessor, open_image
+
+    return ImagePreprocessor()._decode(open_image(contents))
+
+
+def synthetic_jpeg(width: int, height: int) -> bytes:
+    """Noisy gradient photo, so the JPEG is about as large as a real one"""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[..., 0] = (x + y) / 2
+    img[..., 1] = x
+    img[..., 2] = y
+    img = cv2.add(img, rng.integers(0, 24, img.shape, dtype=np.uint8))
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])
+    return encoded.tobytes()
+
+
+def _rss_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _child(name: str, contents: bytes, runs: int, queue):
+    decode = legacy_decode if name == "legacy" else single_decode
+    # Import everything and touch the code paths before taking the baseline
+    decode(synthetic_jpeg(64, 48))
+    baseline_kb = _rss_kb("VmRSS")
+    # Reset the peak RSS counter (Linux) so import time allocations don't count
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    start = time.perf_counter()
+    for _ in range(runs):
+        shape = decode(contents).shape
+    seconds = (time.perf_counter() - start) / runs
+    peak_kb = _rss_kb("VmHWM")
+    queue.put({"seconds": seconds, "peak_mb": (peak_kb - baseline_kb) / 1024, "shape": shape})
+
+
+def measure(name: str, contents: bytes, runs: int = 3) -> dict:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(name, contents, runs, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    results = []
+    for megapixels, (width, height) in SIZES_MP.items():
+        contents = synthetic_jpeg(width, height)
+        legacy, single = measure("legacy", contents), measure("single", contents)
+        results.append({
+            "megapixels": megapixels,
+            "jpeg_mb": round(len(contents) / 1e6, 1),
+            "legacy_ms": round(legacy["seconds"] * 1e3, 1),
+            "single_ms": round(single["seconds"] * 1e3, 1),
+            "speedup": round(legacy["seconds"] / single["seconds"], 2),
+            "legacy_peak_mb": round(legacy["peak_mb"], 1),
+            "single_peak_mb": round(single["peak_mb"], 1),
+            "output_shape": list(single["shape"])
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = main()
+    for row in results:
+        print(f"{row['megapixels']:>3} MP ({row['jpeg_mb']:>5} MB jpeg)  "
+              f"legacy={row['legacy_ms']:>7}ms/{row['legacy_peak_mb']:>6}MB  "
+              f"single={row['single_ms']:>6}ms/{row['single_peak_mb']:>6}MB  x{row['speedup']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
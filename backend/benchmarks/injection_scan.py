@@ -0,0 +1,60 @@
+"""
+Micro-benchmark of PromptInjectionDetector on short, long and adversarial inputs.
+
+Compares the single-pass Aho-Corasick scanner with the previous
+nine-regex implementation (LegacyDetector, kept with the tests that
+check both give the same verdicts). The adversarial inputs make the old
+greedy/lazy `.*` patterns backtrack quadratically.
+
+Usage: python -m benchmarks.injection_scan [--json out.json]
+"""
+import argparse
+import json
+import time
+from app.helpers import PromptInjectionDetector
+from tests.legacy_injection import LegacyDetector, INPUTS
+
+
+def measure(fn, text: str, min_time: float = 0.2) -> float:
+    """Mean seconds per call, repeating until min_time has elapsed"""
+    runs, start = 0, time.perf_counter()
+    while True:
+        fn(text)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / runs
+
+
+def main():
+    legacy, detector = LegacyDetector(), PromptInjectionDetector()
+    results = []
+    for name, text in INPUTS.items():
+        legacy_seconds = measure(legacy.is_injection, text)
+        new_seconds = measure(detector.is_injection, text)
+        results.append({
+            "input": name,
+            "chars": len(text),
+            "legacy_us": round(legacy_seconds * 1e6, 1),
+            "single_pass_us": round(new_seconds * 1e6, 1),
+            "speedup": round(legacy_seconds / new_seconds, 2),
+            "legacy_verdict": legacy.is_injection(text),
+            "single_pass_verdict": detector.is_injection(text),
+            "rules": [rule["rule"] for rule in detector.scan(text)["rules"]]
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = main()
+    for row in results:
+        print(f"{row['input']:<26} {row['chars']:>6} chars  legacy={row['legacy_us']:>10}us  "
+              f"single-pass={row['single_pass_us']:>9}us  x{row['speedup']:<8} "
+              f"verdicts {row['legacy_verdict']}/{row['single_pass_verdict']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
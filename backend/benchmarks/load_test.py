@@ -0,0 +1,192 @@
+"""
+End-to-end load test of the FastAPI app against fake Groq and Vision servers.
+
+Starts the servers of benchmarks.fake_servers in this process, runs the
+app with uvicorn in a subprocess pointed at them, and drives POST
+/moderate with a closed loop of --concurrency clients per level, each
+sending texts or JPEG uploads for --duration seconds. The result and
+near-duplicate caches are off unless --cache is given, so every request
+runs the full pipeline. OCR still runs Tesseract, so it has to be
+installed as for the app itself.
+
+Reports p50/p95/p99 latency, throughput and errors per level and request
+kind, the peak RSS of the app's processes, the mean time of each stage
+from the app's /metrics, and the calls the fake servers answered.
+
+Usage: python -m benchmarks.load_test [--concurrency 1 8 32] [--duration 10] [--mix 0.3]
+       [--groq-latency lognormal:0.3,0.4] [--vision-latency lognormal:0.15,0.3] [--json out.json]
+"""
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import io
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import httpx
+from benchmarks import fake_servers
+from benchmarks.preprocess_filters import synthetic_photo
+from benchmarks.report import latency_summary, peak_rss_mb, print_results, write_report
+
+TEXTS = (
+    "Had a great time at the beach today, the water was perfect.",
+    "Can anyone recommend a good book about the history of Rome?",
+    "This recipe needs more garlic, but otherwise it was delicious.",
+    "The meeting has been moved to Thursday at 3pm, see you there.",
+)
+
+# Every request runs the whole pipeline unless --cache is given
+NO_CACHE_ENV = {"RESULT_CACHE_BACKEND": "none", "PHASH_INDEX_ENABLED": "false"}
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, duration: float, image_share: float,
+                    uploads: List[bytes], mode: str, seed: int, server_pid: int) -> List[Dict]:
+    samples = []
+    counter = 0
+    deadline = time.perf_counter() + duration
+
+    async def one_client(client_id: int):
+        nonlocal counter
+        rng = random.Random(seed * 1000 + client_id)
+        while time.perf_counter() < deadline:
+            counter += 1
+            if rng.random() < image_share:
+                kind = "image"
+                request = {"files": {"image": ("upload.jpg", rng.choice(uploads), "image/jpeg")},
+                           "data": {"mode": mode}}
+            else:
+                kind = "text"
+                # Distinct texts, in case a cache is on
+                request = {"data": {"text": f"{rng.choice(TEXTS)} #{counter}", "mode": mode}}
+            start = time.perf_counter()
+            try:
+                status = (await client.post("/moderate", **request)).status_code
+            except httpx.HTTPError:
+                status = "transport_error"
+            samples.append((kind, time.perf_counter() - start, status))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    rss = _tree_peak_rss_mb(server_pid)
+    results = []
+    for kind in ("text", "image", "all"):
+        chosen = [sample for sample in samples if kind == "all" or sample[0] == kind]
+        if not chosen:
+            continue
+        statuses: Dict[str, int] = {}
+        for _, _, status in chosen:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        ok = [latency for _, latency, status in chosen if status == 200]
+        results.append(latency_summary(
+            f"load/c{concurrency}/{kind}", ok, elapsed, concurrency=concurrency,
+            errors=len(chosen) - len(ok), statuses=statuses, peak_rss_mb=rss))
+    return results
+
+
+async def wait_ready(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The app exited with code {server.returncode}")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("The app did not become ready in time")
+
+
+def stage_means(metrics: str) -> Dict[str, float]:
+    """Mean milliseconds per stage from the app's safens_stage_seconds histogram"""
+    sums, counts = {}, {}
+    for kind, stage, value in re.findall(r'^safens_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$',
+                                         metrics, re.MULTILINE):
+        (sums if kind == "sum" else counts)[stage] = float(value)
+    return {stage: round(sums[stage] * 1000 / counts[stage], 3) for stage in sums if counts.get(stage)}
+
+
+def _tree_peak_rss_mb(pid: int) -> Optional[float]:
+    """Sum of the peak RSS of pid and its descendants so far (Linux only)"""
+    total_kb, pending = 0, [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as f:
+                total_kb += next((int(line.split()[1]) for line in f if line.startswith("VmHWM:")), 0)
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError):
+        return None
+    return round(total_kb / 1024, 1)
+
+
+async def main(args) -> Dict:
+    uploads = []
+    for seed in range(8):
+        buffer = io.BytesIO()
+        synthetic_photo(args.image_width, args.image_height, seed=seed).save(buffer, format="JPEG", quality=90)
+        uploads.append(buffer.getvalue())
+
+    servers = fake_servers.from_arguments(args)
+    async with servers:
+        env = dict(os.environ, **servers.env, NSFW_BACKEND="vision")
+        if not args.cache:
+            env.update(NO_CACHE_ENV)
+        env.update(entry.split("=", 1) for entry in args.env)
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port),
+             "--workers", str(args.workers), "--log-level", "warning"], env=env)
+        try:
+            limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout,
+                                         limits=limits) as client:
+                await wait_ready(client, server)
+                results = []
+                for concurrency in args.concurrency:
+                    results.extend(await run_level(
+                        client, concurrency, args.duration, args.mix, uploads, args.mode, args.seed, server.pid))
+                # With several workers this is one worker's view
+                stages = stage_means((await client.get("/metrics")).text)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    return {
+        "results": results,
+        "stage_mean_ms": stages,
+        # The largest single app process, known once it has exited
+        "server_peak_rss_mb": peak_rss_mb(children=True),
+        "fake_servers": {"groq": servers.groq.stats(), "vision": servers.vision.stats()},
+        "config": {name: value for name, value in vars(args).items() if name != "json"}
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Clients per level")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per level")
+    parser.add_argument("--mix", type=float, default=0.3, help="Share of requests that upload an image")
+    parser.add_argument("--mode", default="full", help="Summary mode of every request")
+    parser.add_argument("--image-width", type=int, default=1280)
+    parser.add_argument("--image-height", type=int, default=960)
+    parser.add_argument("--port", type=int, default=8100, help="Port of the app under test")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the app")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Client timeout per request")
+    parser.add_argument("--cache", action="store_true", help="Keep the result and near-duplicate caches on")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="Extra environment of the app")
+    fake_servers.add_arguments(parser)
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    print_results(report["results"])
+    print("stage means (ms):", report["stage_mean_ms"])
+    print("app peak RSS (MB):", report["server_peak_rss_mb"])
+    print("fake servers:", report["fake_servers"])
+    write_report(args.json, "load", report.pop("results"), **report)
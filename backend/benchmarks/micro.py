@@ -0,0 +1,104 @@
+"""
+Microbenchmarks of the CPU bound steps of a request, in the shared report format.
+
+- preprocess/<WxH>: open_image, the single decode and the "vision" and
+  "ocr" profiles of ImagePreprocessor, serially on this thread, for
+  uploads from VGA up to a 12 MP phone photo
+- injection/<input>: PromptInjectionDetector.is_injection on the inputs
+  of benchmarks.injection_scan
+- json/<answer>: ToxicityAgent parsing and validating single, fenced and
+  packed Groq answers, answers that need repair (cut off, wrapped in
+  prose), and a single answer fed to JSONStream in 4 character pieces
+  as it would be streamed
+
+Each case runs until --min-time has elapsed and reports p50/p95/p99 per
+call, calls per second and the process's peak RSS so far.
+
+Usage: python -m benchmarks.micro [--min-time 1.0] [--only preprocess] [--json out.json]
+"""
+from typing import Callable, Dict, List
+import argparse
+import json
+import time
+from app.agents import ToxicityAgent
+from app.helpers import ImagePreprocessor, PromptInjectionDetector, JSONStream, open_image
+from benchmarks.fakes import FakeAsyncGroq, TOXICITY_RESPONSE
+from benchmarks.image_decode import synthetic_jpeg
+from benchmarks.injection_scan import INPUTS
+from benchmarks.report import latency_summary, peak_rss_mb, print_results, write_report
+
+RESOLUTIONS = ((640, 480), (1280, 960), (1920, 1080), (4032, 3024))
+
+TOXIC_ANSWER = dict(
+    TOXICITY_RESPONSE, t=1, k=["A", "T"], s="h", w=[["idiot", "A", "m"], ["hurt", "T", "h"]],
+    r="Insult followed by a threat of violence")
+
+
+def measure(name: str, fn: Callable[[], object], min_time: float, max_runs: int = 100000) -> Dict:
+    """Time fn call by call until min_time has elapsed"""
+    fn()
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < max_runs:
+        call_start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_start)
+        if call_start - start >= min_time and len(latencies) >= 5:
+            break
+    return latency_summary(name, latencies, time.perf_counter() - start, peak_rss_mb=peak_rss_mb())
+
+
+def cases() -> Dict[str, Callable[[], object]]:
+    found = {}
+
+    preprocessor = ImagePreprocessor()
+    for width, height in RESOLUTIONS:
+        contents = synthetic_jpeg(width, height)
+
+        def preprocess(contents=contents):
+            img = preprocessor._decode(open_image(contents))
+            return preprocessor._build_profiles(img, ("vision", "ocr"))
+        found[f"preprocess/{width}x{height}"] = preprocess
+
+    detector = PromptInjectionDetector()
+    for name, text in INPUTS.items():
+        found[f"injection/{name}"] = lambda text=text: detector.is_injection(text)
+
+    agent = ToxicityAgent(client=FakeAsyncGroq())
+    single = json.dumps(TOXIC_ANSWER, separators=(",", ":"))
+    fenced = "```json\n" + json.dumps(TOXIC_ANSWER, indent=4) + "\n```"
+    packed = json.dumps({"a": [dict(TOXIC_ANSWER, i=index) for index in range(10)]})
+    found["json/single"] = lambda: agent._parse(single)
+    found["json/fenced"] = lambda: agent._parse(fenced)
+    found["json/packed_10"] = lambda: agent._parse_packed(packed, 10)
+    truncated = single[:single.index(',"r":') + 12]
+    prose = "Here is the analysis:\n" + single + "\nLet me know if you need anything else."
+    found["json/truncated"] = lambda: agent._parse(truncated)
+    found["json/prose"] = lambda: agent._parse(prose)
+
+    def streamed():
+        answer = JSONStream()
+        for start in range(0, len(single), 4):
+            answer.feed(single[start:start + 4])
+        return agent._parse(answer.text)
+    found["json/streamed"] = streamed
+    return found
+
+
+def main(min_time: float, only: List[str]) -> List[Dict]:
+    return [
+        measure(name, fn, min_time) for name, fn in cases().items()
+        if not only or any(part in name for part in only)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds to run each case for")
+    parser.add_argument("--only", nargs="*", default=[], help="Run the cases whose name contains one of these")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    results = main(args.min_time, args.only)
+    print_results(results)
+    write_report(args.json, "micro", results)
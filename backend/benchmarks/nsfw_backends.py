@@ -0,0 +1,102 @@
+"""
+Per-image latency and throughput of the NSFW backends.
+
+Runs NSFWAgent.detect on "vision" profile JPEGs of 1600x1200 photos with
+each backend:
+
+- fake: the offline stand-in, no work at all (the pipeline's own overhead)
+- vision: VisionBackend against a simulated Vision API with --vision-latency
+  per call, so batching shows but the network is not measured
+- onnx: the local classifier, only with --model (needs onnxruntime)
+
+Latency is measured one image at a time, throughput with --concurrency
+images in flight.
+
+Usage: python -m benchmarks.nsfw_backends [--model nsfw.onnx] [--images 64] [--concurrency 16] [--json out.json]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from app.agents import NSFWAgent, VisionBackend, OnnxBackend, FakeBackend
+from app.helpers import ImagePreprocessor
+from benchmarks.fakes import FakeVisionAsyncClient
+from benchmarks.preprocess_filters import synthetic_photo
+
+
+async def run_backend(name: str, backend, uploads, concurrency: int) -> dict:
+    agent = NSFWAgent(backend=backend)
+    await backend.warmup()
+
+    latencies = []
+    for content in uploads[:min(len(uploads), 16)]:
+        start = time.perf_counter()
+        await agent.detect(content)
+        latencies.append(time.perf_counter() - start)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(content: bytes):
+        async with semaphore:
+            return await agent.detect(content)
+
+    calls = backend.calls
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(content) for content in uploads))
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for result in results if "error" in result)
+
+    return {
+        "backend": name,
+        "latency_p50_ms": round(statistics.median(latencies) * 1e3, 2),
+        "latency_max_ms": round(max(latencies) * 1e3, 2),
+        "images": len(uploads),
+        "concurrency": concurrency,
+        "images_per_second": round(len(uploads) / elapsed, 1),
+        "calls": backend.calls - calls,
+        "errors": errors
+    }
+
+
+async def main(model, images: int, concurrency: int, vision_latency: float) -> list:
+    executor = ThreadPoolExecutor(max_workers=1)
+    preprocessor = ImagePreprocessor()
+    uploads = []
+    for seed in range(min(images, 8)):
+        views = await preprocessor.preprocess_profiles(synthetic_photo(1600, 1200, seed=seed), ("vision",))
+        uploads.append(views["vision"])
+    uploads = [uploads[i % len(uploads)] for i in range(images)]
+
+    backends = {
+        "fake": FakeBackend(),
+        "vision": VisionBackend(FakeVisionAsyncClient(latency=vision_latency))
+    }
+    if model:
+        backends["onnx"] = OnnxBackend(model_path=model, executor=executor)
+
+    try:
+        return [await run_backend(name, backend, uploads, concurrency)
+                for name, backend in backends.items()]
+    finally:
+        executor.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="ONNX classifier to include")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--vision-latency", type=float, default=0.3,
+                        help="Seconds per simulated Vision call")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args.model, args.images, args.concurrency, args.vision_latency))
+    for row in results:
+        print(f"{row['backend']:<7} latency p50 {row['latency_p50_ms']:>8} ms  max {row['latency_max_ms']:>8} ms  "
+              f"{row['images_per_second']:>7} images/s  {row['calls']} calls  {row['errors']} errors")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
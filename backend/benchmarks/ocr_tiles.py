@@ -0,0 +1,132 @@
+"""
+Text detection and tiled OCR vs one Tesseract call on the whole image.
+
+Every image goes through the "ocr" preprocessing profile first, like in
+the server. Reports how long detect_text_regions takes, how many tiles it
+cuts and what share of the image they cover. A text-free photo should
+get no tiles and skip OCR entirely.
+
+With --ocr, also times OCRAgent in "full" and "tiled" mode on the same
+images and reports how much text each read. Needs Tesseract
+(TESSERACT_PATH) or, with --engine tesserocr, the tesserocr package.
+
+Usage: python -m benchmarks.ocr_tiles [--ocr] [--engine pytesseract] [--workers N] [--json out.json]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import json
+import os
+import time
+import cv2
+import numpy as np
+from PIL import Image
+from app.agents import OCRAgent
+from app.helpers import ImagePreprocessor, detect_text_regions
+from benchmarks.preprocess_filters import synthetic_photo
+
+WORDS = ("moderation report invoice total shipping address account balance "
+         "payment due settings profile notifications privacy").split()
+
+
+def text_free_photo(width: int = 1600, height: int = 1200, seed: int = 0) -> Image.Image:
+    """Gradients, shapes and noise, no lettering"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.stack([
+        128 + 100 * np.sin(x / 97.0 + seed),
+        128 + 100 * np.cos(y / 53.0),
+        128 + 80 * np.sin((x + y) / 151.0)
+    ], axis=-1)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    for _ in range(40):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(img, center, int(rng.integers(10, min(width, height) // 6)), color, -1)
+    img = np.clip(img + rng.normal(0, 6, img.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(img)
+
+
+def screenshot(width: int = 1600, height: int = 1200, seed: int = 0) -> Image.Image:
+    """Dense dark text on a light background in two columns, like a chat or settings page"""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 245, np.uint8)
+    for column in range(2):
+        for row in range(height // 32 - 2):
+            words = " ".join(rng.choice(WORDS, 5))
+            cv2.putText(img, words, (30 + column * width // 2, 40 + row * 32),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (30, 30, 30), 2)
+    return Image.fromarray(img)
+
+
+CASES = {
+    "text_free_photo": text_free_photo,
+    "captioned_photo": lambda: synthetic_photo(1600, 1200),
+    "screenshot": screenshot,
+    "blank": lambda: Image.new("RGB", (1600, 1200), "white")
+}
+
+
+def measure_detection(ocr_view: Image.Image, runs: int = 10) -> dict:
+    gray = np.asarray(ocr_view)
+    detect_text_regions(gray)
+    start = time.perf_counter()
+    for _ in range(runs):
+        tiles = detect_text_regions(gray)
+    elapsed = (time.perf_counter() - start) / runs
+    covered = sum(w * h for _, _, w, h in tiles) / float(gray.size)
+    return {
+        "detect_ms": round(elapsed * 1e3, 2),
+        "tiles": len(tiles),
+        "coverage": round(covered, 3)
+    }
+
+
+async def measure_ocr(agent: OCRAgent, ocr_view: Image.Image) -> dict:
+    start = time.perf_counter()
+    text = await agent.extract_text_async(ocr_view)
+    return {"ms": round((time.perf_counter() - start) * 1e3, 1), "chars": len(text.strip())}
+
+
+async def main(ocr: bool, engine: str, workers: int) -> list:
+    executor = ThreadPoolExecutor(max_workers=workers)
+    preprocessor = ImagePreprocessor(executor=executor)
+    agents = {}
+    if ocr:
+        agents = {mode: OCRAgent(executor=executor, engine=engine, mode=mode)
+                  for mode in ("full", "tiled")}
+
+    results = []
+    try:
+        for name, make in CASES.items():
+            views = await preprocessor.preprocess_profiles(make(), ("ocr",))
+            row = {"image": name, **measure_detection(views["ocr"])}
+            for mode, agent in agents.items():
+                # The first call starts the engine, time the second
+                await agent.extract_text_async(views["ocr"])
+                row[mode] = await measure_ocr(agent, views["ocr"])
+            results.append(row)
+    finally:
+        executor.shutdown(wait=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ocr", action="store_true", help="Also time full vs tiled OCR")
+    parser.add_argument("--engine", default="pytesseract", choices=["pytesseract", "tesserocr"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args.ocr, args.engine, args.workers))
+    for row in results:
+        line = (f"{row['image']:<16} detect {row['detect_ms']:>6} ms  "
+                f"{row['tiles']:>2} tiles covering {row['coverage']:.0%}")
+        for mode in ("full", "tiled"):
+            if mode in row:
+                line += f"  {mode} {row[mode]['ms']} ms / {row[mode]['chars']} chars"
+        print(line)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
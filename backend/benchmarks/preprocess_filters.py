@@ -0,0 +1,192 @@
+"""
+Per-megapixel latency of ImagePreprocessor before and after the uint8 rewrite.
+
+The previous float/scikit-image pipeline is kept here as
+LegacyPreprocessor. Both run on the same synthetic photo-like images at
+the default 1600x1200 target size (and on a larger upload that has to be
+resized first), and the outputs are compared by PSNR so a regression in
+look shows up next to the speedup.
+
+The sharpen step is also timed against FusedSharpen, which folds the
+3x3 kernel and the unsharp mask into the single kernel they amount to.
+
+Usage: python -m benchmarks.preprocess_filters [--json out.json]
+"""
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+from PIL import Image
+from app.helpers import ImagePreprocessor
+
+
+class LegacyPreprocessor(ImagePreprocessor):
+    """The BGR/LAB/float pipeline this benchmark measures against"""
+
+    def _sync_preprocess(self, image: Image.Image) -> Image.Image:
+        img = np.array(image)
+        if len(img.shape) == 3 and img.shape[2] == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        img = self._smart_resize(img)
+        img = self._legacy_optimize_quality(img)
+        img = self._legacy_apply_filters(img)
+        if len(img.shape) == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return Image.fromarray(img)
+
+    def _legacy_optimize_quality(self, img):
+        if len(img.shape) == 2:
+            return img
+        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+        l, a, b = cv2.split(lab)
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        l = clahe.apply(l)
+        lab = cv2.merge((l, a, b))
+        img = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
+        return cv2.filter2D(img, -1, kernel)
+
+    def _legacy_apply_filters(self, image):
+        # Only needed for the reference implementation
+        from skimage.filters import gaussian, median
+
+        footprint = np.ones((self.mean_kernel_size, self.mean_kernel_size))
+        img_float = image.astype('float32') / 255.0
+        if len(image.shape) == 2:
+            blurred = gaussian(img_float, sigma=self.gaussian_sigma)
+            sharpened = img_float + (img_float - blurred) * 1.5
+            filtered = median(sharpened, footprint)
+        else:
+            blurred = gaussian(img_float, sigma=self.gaussian_sigma, channel_axis=-1)
+            sharpened = img_float + (img_float - blurred) * 1.5
+            filtered = np.zeros_like(sharpened)
+            for i in range(3):
+                filtered[:, :, i] = median(sharpened[:, :, i], footprint)
+        filtered = np.clip(filtered, 0, 1)
+        if len(filtered.shape) == 3:
+            for i in range(filtered.shape[2]):
+                channel = filtered[:, :, i]
+                filtered[:, :, i] = (channel - np.min(channel)) / (np.max(channel) - np.min(channel) + 1e-7)
+        else:
+            filtered = (filtered - np.min(filtered)) / (np.max(filtered) - np.min(filtered) + 1e-7)
+        return (filtered * 255).astype('uint8')
+
+
+class FusedSharpen:
+    """
+    The sharpen kernel and unsharp mask of ImagePreprocessor as one
+    filter2D pass: 2.5*K - 1.5*(G*K), where G is the Gaussian kernel
+    GaussianBlur picks for the same sigma on uint8 images
+    """
+
+    def __init__(self, preprocessor: ImagePreprocessor):
+        sigma = preprocessor.gaussian_sigma
+        size = int(round(sigma * 3 * 2 + 1)) | 1
+        gaussian = cv2.getGaussianKernel(size, sigma, cv2.CV_32F)
+        gaussian = gaussian @ gaussian.T
+        identity = np.zeros((3, 3), np.float32)
+        identity[1, 1] = 1
+        self.kernels = {}
+        for channels, kernel in ((3, preprocessor._sharpen_kernel), (1, identity)):
+            padded = np.pad(kernel, size // 2)
+            blurred = cv2.filter2D(padded, -1, gaussian, borderType=cv2.BORDER_CONSTANT)
+            self.kernels[channels] = 2.5 * padded - 1.5 * blurred
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        return cv2.filter2D(image, -1, self.kernels[image.shape[2] if image.ndim == 3 else 1])
+
+
+def synthetic_photo(width: int, height: int, mode: str = "RGB", seed: int = 0) -> Image.Image:
+    """Smooth gradients, shapes, text and sensor-like noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.stack([
+        128 + 100 * np.sin(x / 97.0),
+        128 + 100 * np.cos(y / 53.0),
+        128 + 80 * np.sin((x + y) / 151.0)
+    ], axis=-1)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    for _ in range(40):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(img, center, int(rng.integers(10, min(width, height) // 6)), color, -1)
+    for row in range(5):
+        cv2.putText(img, "SAMPLE CAPTION TEXT 123", (40, 120 + row * 160),
+                    cv2.FONT_HERSHEY_SIMPLEX, 2.5, (255, 255, 255), 5)
+    noise = rng.normal(0, 6, img.shape)
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(img).convert(mode)
+
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    return float(cv2.PSNR(np.asarray(a), np.asarray(b)))
+
+
+def measure(fn, image: Image.Image, min_time: float = 1.0) -> float:
+    """Mean seconds per call, repeating until min_time has elapsed"""
+    fn(image)
+    runs, start = 0, time.perf_counter()
+    while True:
+        fn(image)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / runs
+
+
+CASES = {
+    "rgb_1600x1200": (1600, 1200, "RGB"),
+    "gray_1600x1200": (1600, 1200, "L"),
+    "rgb_4000x3000_resized": (4000, 3000, "RGB"),
+}
+
+
+def main():
+    # Single threaded so the numbers are per core
+    cv2.setNumThreads(1)
+    legacy, preprocessor = LegacyPreprocessor(), ImagePreprocessor()
+    fused = FusedSharpen(preprocessor)
+    results = []
+    for name, (width, height, mode) in CASES.items():
+        image = synthetic_photo(width, height, mode)
+        legacy_out = legacy._sync_preprocess(image)
+        new_out = preprocessor._sync_preprocess(image)
+        megapixels = new_out.width * new_out.height / 1e6
+
+        legacy_seconds = measure(legacy._sync_preprocess, image)
+        new_seconds = measure(preprocessor._sync_preprocess, image)
+        # The sharpen step alone, two passes against one fused kernel
+        resized = preprocessor._smart_resize(np.array(image))
+        passes_out, fused_out = preprocessor._sharpen(resized), fused(resized)
+        passes_seconds = measure(preprocessor._sharpen, resized)
+        fused_seconds = measure(fused, resized)
+        results.append({
+            "case": name,
+            "output_megapixels": round(megapixels, 2),
+            "legacy_ms_per_mp": round(legacy_seconds * 1e3 / megapixels, 2),
+            "uint8_ms_per_mp": round(new_seconds * 1e3 / megapixels, 2),
+            "speedup": round(legacy_seconds / new_seconds, 2),
+            "psnr_db": round(psnr(legacy_out, new_out), 2),
+            "sharpen_passes_ms_per_mp": round(passes_seconds * 1e3 / megapixels, 2),
+            "sharpen_fused_ms_per_mp": round(fused_seconds * 1e3 / megapixels, 2),
+            "sharpen_fused_psnr_db": round(float(cv2.PSNR(passes_out, fused_out)), 2)
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = main()
+    for row in results:
+        print(f"{row['case']:<24} {row['output_megapixels']:>5} MP  "
+              f"legacy={row['legacy_ms_per_mp']:>8}ms/MP  uint8={row['uint8_ms_per_mp']:>7}ms/MP  "
+              f"x{row['speedup']:<6} psnr={row['psnr_db']}dB")
+        print(f"{'':<24} sharpen: passes={row['sharpen_passes_ms_per_mp']:>6}ms/MP  "
+              f"fused={row['sharpen_fused_ms_per_mp']:>6}ms/MP  psnr={row['sharpen_fused_psnr_db']}dB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
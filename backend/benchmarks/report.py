@@ -0,0 +1,90 @@
+"""
+Shared result format of the benchmark suite.
+
+Every entry of a report is {"name", "count", "p50_ms", "p95_ms",
+"p99_ms", "mean_ms", "max_ms", "throughput_per_s", "peak_rss_mb", ...}
+so two runs can be compared with benchmarks.compare, whichever
+benchmark produced them.
+"""
+from typing import Dict, List, Optional, Sequence
+import datetime
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+
+
+def latency_summary(name: str, latencies: Sequence[float], elapsed: float, **extra) -> Dict:
+    """Percentiles and throughput of latencies (seconds) measured over elapsed seconds"""
+    values = sorted(latencies)
+    entry = {"name": name, "count": len(values)}
+    if values:
+        entry.update({
+            "p50_ms": _ms(percentile(values, 50)),
+            "p95_ms": _ms(percentile(values, 95)),
+            "p99_ms": _ms(percentile(values, 99)),
+            "mean_ms": _ms(statistics.fmean(values)),
+            "max_ms": _ms(values[-1])
+        })
+    entry["throughput_per_s"] = round(len(values) / elapsed, 3) if elapsed > 0 else 0.0
+    entry.update(extra)
+    return entry
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Linearly interpolated q-th percentile of already sorted values"""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def peak_rss_mb(children: bool = False) -> float:
+    """Peak resident set size of this process, or of its largest waited-for child"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Kilobytes on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(usage.ru_maxrss / scale, 1)
+
+
+def environment() -> Dict:
+    """What a run depends on besides the code, to tell whether two reports are comparable"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def write_report(path: Optional[str], suite: str, results: List[Dict], **extra) -> Dict:
+    report = {"suite": suite, "environment": environment(), "results": results, **extra}
+    if path:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def print_results(results: List[Dict]):
+    width = max(len(entry["name"]) for entry in results) if results else 0
+    for entry in results:
+        if "p50_ms" not in entry:
+            print(f"{entry['name']:<{width}}  no successful samples")
+            continue
+        print(f"{entry['name']:<{width}}  p50={entry['p50_ms']:>9.3f}ms  p95={entry['p95_ms']:>9.3f}ms  "
+              f"p99={entry['p99_ms']:>9.3f}ms  {entry['throughput_per_s']:>10.2f}/s")
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 4)
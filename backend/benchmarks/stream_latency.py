@@ -0,0 +1,77 @@
+"""
+Time to first byte of MainAgent.analyze_image vs its streamed variant.
+
+With simulated backends, measures when each event of
+analyze_image_stream arrives against the total time analyze_image takes
+to return. The verdict is ready before the summary call starts, so a
+streaming client can act on it much earlier. With --stream-toxicity the
+toxicity answer is streamed too, and toxicity_verdict arrives as soon as
+the model has written "t".
+
+Usage: python -m benchmarks.stream_latency [--requests 16] [--groq-latency 0.2] [--stream-toxicity] [--json out.json]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from benchmarks.concurrency_load import build_agent
+from benchmarks.fakes import FakeAsyncGroq
+
+
+async def main(requests: int, groq_latency: float, stream_toxicity: bool = False) -> dict:
+    executor = ThreadPoolExecutor(max_workers=4)
+    agent = build_agent(executor, FakeAsyncGroq(latency=groq_latency))
+    agent.toxicity_agent.stream = stream_toxicity
+    image = Image.new("RGB", (640, 480), color="white")
+
+    blocking, first_event, toxicity_verdict, verdict, first_token, done = [], [], [], [], [], []
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            await agent.analyze_image(image)
+            blocking.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            seen = {}
+            async for event, _ in agent.analyze_image_stream(image):
+                seen.setdefault(event, time.perf_counter() - start)
+            first_event.append(min(seen.values()))
+            toxicity_verdict.append(seen.get("toxicity_verdict", seen["verdict"]))
+            verdict.append(seen["verdict"])
+            first_token.append(seen.get("summary", seen["result"]))
+            done.append(seen["result"])
+    finally:
+        executor.shutdown(wait=True)
+
+    def ms(values):
+        return round(statistics.mean(values) * 1000, 1)
+
+    return {
+        "requests": requests,
+        "blocking_ms": ms(blocking),
+        "stream_first_event_ms": ms(first_event),
+        "stream_toxicity_verdict_ms": ms(toxicity_verdict),
+        "stream_verdict_ms": ms(verdict),
+        "stream_first_summary_token_ms": ms(first_token),
+        "stream_done_ms": ms(done)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--groq-latency", type=float, default=0.2,
+                        help="Seconds before a simulated Groq reply (or its first token)")
+    parser.add_argument("--stream-toxicity", action="store_true", help="Stream the toxicity answers")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(main(args.requests, args.groq_latency, args.stream_toxicity))
+    for name, value in result.items():
+        print(f"{name:<32} {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
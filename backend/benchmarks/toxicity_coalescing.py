@@ -0,0 +1,67 @@
+"""
+Groq calls and latency of concurrent ToxicityAgent.analyze calls, with and without coalescing.
+
+Each level runs --texts short texts with --concurrency in flight against
+a fake Groq client, once per batching setting: off (a batch size of 1)
+and a window of each of --waits milliseconds. Groq rate limits count
+requests as well as tokens, so fewer calls per text means more texts
+per minute before the limit is hit.
+
+Usage: python -m benchmarks.toxicity_coalescing [--texts 200] [--concurrency 1 16 64] [--waits 2 5 10] [--json out.json]
+"""
+from typing import Dict, List
+import argparse
+import asyncio
+import time
+from app.agents import ToxicityAgent
+from benchmarks.fakes import FakeAsyncGroq
+from benchmarks.report import latency_summary, print_results, write_report
+
+
+async def run(texts: int, concurrency: int, batch_size: int, wait_ms: float, groq_latency: float) -> Dict:
+    client = FakeAsyncGroq(latency=groq_latency)
+    agent = ToxicityAgent(client=client)
+    agent.batcher.max_batch = batch_size
+    agent.batcher.max_wait = wait_ms / 1000
+    # Hedged duplicates would blur the count of calls
+    agent.gateway.hedge = False
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(index: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await agent.analyze(f"Message {index}: see you at the game tonight")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(texts)))
+    name = f"c{concurrency}/" + (f"wait{wait_ms:g}ms" if batch_size > 1 else "off")
+    return latency_summary(name, latencies, time.perf_counter() - start, concurrency=concurrency,
+                           groq_calls=client.calls, calls_per_text=round(client.calls / texts, 3))
+
+
+async def main(texts: int, levels: List[int], waits: List[float], batch_size: int, groq_latency: float) -> List[Dict]:
+    results = []
+    for concurrency in levels:
+        results.append(await run(texts, concurrency, 1, 0, groq_latency))
+        for wait_ms in waits:
+            results.append(await run(texts, concurrency, batch_size, wait_ms, groq_latency))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=200, help="Texts per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--waits", type=float, nargs="+", default=[2, 5, 10], help="Batch windows in milliseconds")
+    parser.add_argument("--batch-size", type=int, default=10, help="Most texts per packed prompt")
+    parser.add_argument("--groq-latency", type=float, default=0.2, help="Seconds before a simulated Groq reply")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args.texts, args.concurrency, args.waits, args.batch_size, args.groq_latency))
+    print_results(results)
+    for result in results:
+        print(f"{result['name']:<16} groq calls {result['groq_calls']:>4}  per text {result['calls_per_text']}")
+    write_report(args.json, "toxicity_coalescing", results)
@@ -0,0 +1,17 @@
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from tests.fakes import fake_registry
+
+
+@pytest.fixture
+def serve():
+    """Call with a MainAgent to get a TestClient of the app serving it"""
+    def serve(main_agent) -> TestClient:
+        app.state.registry = fake_registry(main_agent)
+        app.state.startup = {"status": "ready"}
+        # Not entered, so the lifespan doesn't build the real agents
+        return TestClient(app)
+
+    yield serve
+    app.state.registry = None
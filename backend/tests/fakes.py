@@ -0,0 +1,99 @@
+"""Offline stand-ins for the services the agents call, shared by the tests"""
+from types import SimpleNamespace
+from typing import List
+from PIL import Image
+import json
+from app.agents import OCRAgent, NSFWAgent, ToxicityAgent, MainAgent, AgentRegistry
+from app.agents.nsfw_backends import FakeBackend
+from app.helpers import Scheduler, TextPreClassifier
+
+# A safe answer in the compact schema of ToxicityAgent
+SAFE_ANSWER = {"t": 0, "c": 0.9, "k": [], "s": "l", "w": [], "r": "Benign text"}
+
+
+class FakeGroq:
+    """Async Groq client answering every toxicity prompt as safe"""
+
+    def __init__(self, usage=(100, 20)):
+        self.usage = usage
+        self.prompts: List[str] = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, messages, model, **kwargs):
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        if "(JSON array):" in prompt:
+            items = json.loads(prompt.split("(JSON array):", 1)[1].strip())
+            content = json.dumps({"a": [dict(SAFE_ANSWER, i=item["id"]) for item in items]})
+        elif "JSON" in prompt:
+            content = json.dumps(SAFE_ANSWER)
+        else:
+            content = "The content appears safe for most audiences."
+        if kwargs.get("stream"):
+            return FakeStream(content)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=self.usage[0], completion_tokens=self.usage[1]))
+
+    async def close(self):
+        pass
+
+
+class FakeStream:
+    """Streamed completion sending content word by word"""
+
+    def __init__(self, content: str):
+        self.words = content.split(" ")
+        self.closed = False
+
+    async def __aiter__(self):
+        for index, word in enumerate(self.words):
+            delta = word if index == 0 else " " + word
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeOCRAgent(OCRAgent):
+    """OCR agent reading the given texts in turn instead of running Tesseract"""
+
+    def __init__(self, *texts: str):
+        self.texts = list(texts) or ["hello thanks"]
+        self.calls = 0
+        self.executor = self.limiter = self.process_pool = None
+        self.mode = "full"
+        self.images = self.fallbacks = self.tiles = 0
+
+    def extract_text(self, image: Image.Image) -> str:
+        self.calls += 1
+        return self.texts[min(self.calls, len(self.texts)) - 1]
+
+
+class CountingBackend(FakeBackend):
+    """FakeBackend that counts the images it annotated"""
+
+    def __init__(self, **kwargs):
+        super().__init__(latency_ms=0, **kwargs)
+        self.annotated = 0
+
+    async def _annotate_batch(self, contents):
+        self.annotated += len(contents)
+        return await super()._annotate_batch(contents)
+
+
+def fake_main_agent(ocr: OCRAgent = None, backend: FakeBackend = None, **kwargs) -> MainAgent:
+    """MainAgent on the fakes above, with the local text tier of production"""
+    groq = kwargs.pop("groq_client", None) or FakeGroq()
+    return MainAgent(ocr_agent=ocr or FakeOCRAgent(), nsfw_agent=NSFWAgent(backend=backend or CountingBackend()),
+                     toxicity_agent=ToxicityAgent(client=groq, prefilter=TextPreClassifier()),
+                     groq_client=groq, **kwargs)
+
+
+def fake_registry(main_agent: MainAgent) -> AgentRegistry:
+    """Registry serving main_agent, as the app's lifespan would have built it"""
+    registry = AgentRegistry()
+    registry.scheduler = Scheduler.from_env()
+    registry.main_agent = main_agent
+    return registry
@@ -0,0 +1,36 @@
+import asyncio
+import time
+from PIL import Image
+from tests.fakes import FakeOCRAgent, fake_main_agent
+
+
+class SlowOCRAgent(FakeOCRAgent):
+    def extract_text(self, image):
+        time.sleep(0.05)
+        return super().extract_text(image)
+
+
+def test_closing_the_batch_waits_for_its_leftover_work():
+    async def run():
+        main = fake_main_agent(SlowOCRAgent())
+        images = [{"image": Image.new("RGB", (32, 32), (index, 0, 0))} for index in range(4)]
+        batch = main.analyze_batch([{"text": "hello thanks"}] + images, mode="verdict")
+        first = await batch.__anext__()
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await batch.aclose()
+        return first, pending, [task.done() for task in pending]
+
+    first, pending, done = asyncio.run(run())
+    assert first[0] == 0 and not first[1]["is_toxic"]
+    assert pending and all(done)
+
+
+def test_batch_results_come_back_by_index():
+    async def run():
+        main = fake_main_agent(FakeOCRAgent())
+        items = [{"text": "hello thanks"}, {"image": Image.new("RGB", (32, 32))}, {"text": "1234 !!"}]
+        return {index: result async for index, result in main.analyze_batch(items, mode="verdict")}
+
+    results = asyncio.run(run())
+    assert sorted(results) == [0, 1, 2]
+    assert not any(result["is_toxic"] for result in results.values())
@@ -0,0 +1,74 @@
+import base64
+import io
+import json
+import pytest
+from PIL import Image
+from app import main as app_main
+from tests.fakes import FakeOCRAgent, CountingBackend, fake_main_agent
+
+
+def png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def client(serve):
+    ocr, backend = FakeOCRAgent(), CountingBackend()
+    client = serve(fake_main_agent(ocr, backend))
+    client.ocr, client.backend = ocr, backend
+    return client
+
+
+def lines(response) -> dict:
+    return {line["id"]: line for line in map(json.loads, response.text.splitlines())}
+
+
+def test_json_batch_streams_a_line_per_item(client):
+    encoded = base64.b64encode(png()).decode()
+    response = client.post("/moderate/batch", json={"mode": "verdict", "items": [
+        {"id": "t", "text": "hello thanks"},
+        {"id": "i", "image_base64": f"data:image/png;base64,{encoded}"},
+        {"id": "bad", "image_base64": "not base64!"},
+        {"id": "none"}]})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    result = lines(response)
+    assert result["t"]["result"]["is_toxic"] is False
+    assert result["i"]["result"]["is_toxic"] is False
+    assert result["bad"]["error"].startswith("Invalid base64 image")
+    assert "error" in result["none"]
+
+
+def test_form_batch_reads_uploads_in_the_fan_out(client):
+    response = client.post("/moderate/batch", data={"texts": ["hello thanks"], "mode": "verdict"},
+                           files=[("images", ("a.png", png(), "image/png")),
+                                  ("images", ("b.txt", b"plain text", "text/plain"))])
+    result = lines(response)
+    assert result["text-0"]["result"]["is_toxic"] is False
+    assert result["image-0"]["result"]["is_toxic"] is False
+    assert result["image-1"]["error"] == "Invalid image file"
+    assert client.backend.annotated == 1
+
+
+def test_limits_are_checked_before_images_are_read(client, monkeypatch):
+    monkeypatch.setattr(app_main, "BATCH_MAX_ITEMS", 2)
+    items = [{"image_base64": base64.b64encode(png()).decode()}] * 3
+    assert client.post("/moderate/batch", json={"items": items}).status_code == 413
+    assert client.post("/moderate/batch", json={"items": items[:1], "mode": "poem"}).status_code == 400
+    files = [("images", ("a.png", png(), "image/png"))] * 3
+    assert client.post("/moderate/batch", files=files).status_code == 400
+    assert client.backend.annotated == 0
+
+
+def test_json_body_over_the_limit_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(app_main, "BATCH_MAX_BYTES", 100)
+    response = client.post("/moderate/batch", json={"items": [{"text": "x" * 200}]})
+    assert response.status_code == 413
+
+
+def test_base64_over_the_image_limit_is_not_decoded(client, monkeypatch):
+    monkeypatch.setattr(app_main, "IMAGE_MAX_BYTES", 30)
+    response = client.post("/moderate/batch", json={"items": [{"id": "i", "image_base64": "A" * 80}]})
+    assert lines(response)["i"]["error"] == "Image larger than 30 bytes"
@@ -0,0 +1,88 @@
+import asyncio
+from app.helpers import Batcher, REQUEST_TIMINGS, REQUEST_TOKENS
+from app.helpers.batcher import _shares
+from app.helpers.metrics import record_stage, record_tokens
+from app.helpers.scheduler import REQUEST_PRIORITY, PRIORITIES
+from types import SimpleNamespace
+
+
+def test_concurrent_items_share_one_call():
+    async def run():
+        calls = []
+
+        async def handler(items):
+            calls.append(list(items))
+            return [item * 2 for item in items]
+
+        batcher = Batcher("test", handler, max_batch=3)
+        results = await asyncio.gather(*(batcher.submit(item) for item in range(5)))
+        return results, calls, batcher.stats()
+
+    results, calls, stats = asyncio.run(run())
+    assert results == [0, 2, 4, 6, 8]
+    assert calls == [[0, 1, 2], [3, 4]]
+    assert stats["batches"] == 2 and stats["max_batch_size"] == 3
+
+
+def test_weight_closes_a_batch_early():
+    async def run():
+        calls = []
+
+        async def handler(items):
+            calls.append(list(items))
+            return items
+
+        batcher = Batcher("test", handler, max_batch=10, max_weight=5, weigh=len)
+        await asyncio.gather(*(batcher.submit(item) for item in ["aaa", "bb", "c", "dddd"]))
+        return calls
+
+    assert asyncio.run(run()) == [["aaa", "bb"], ["c", "dddd"]]
+
+
+def test_handler_error_reaches_every_submitter():
+    async def run():
+        async def handler(items):
+            raise ValueError("boom")
+
+        batcher = Batcher("test", handler)
+        return await asyncio.gather(*(batcher.submit(item) for item in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+
+
+def test_each_submitter_is_charged_its_share():
+    async def run():
+        seen = []
+
+        async def handler(items):
+            seen.append(REQUEST_PRIORITY.get())
+            record_stage("groq", 0.5)
+            record_tokens("model", SimpleNamespace(prompt_tokens=100, completion_tokens=21))
+            return items
+
+        batcher = Batcher("test", handler, max_batch=3, weigh=len)
+
+        async def request(item, kind):
+            tokens, timings = {"prompt": 0, "completion": 0, "calls": 0}, {}
+            REQUEST_TOKENS.set(tokens)
+            REQUEST_TIMINGS.set(timings)
+            REQUEST_PRIORITY.set(PRIORITIES[kind])
+            await batcher.submit(item)
+            return tokens, timings
+
+        usage = await asyncio.gather(request("a" * 10, "image"), request("b" * 30, "text"),
+                                     request("c" * 60, "image"))
+        return seen, usage
+
+    seen, usage = asyncio.run(run())
+    # The text request's priority, not the image request that flushed
+    assert seen == [PRIORITIES["text"]]
+    assert [tokens["prompt"] for tokens, _ in usage] == [10, 30, 60]
+    assert [tokens["completion"] for tokens, _ in usage] == [7, 7, 7]
+    assert all(tokens["calls"] == 1 and timings == {"groq": 0.5} for tokens, timings in usage)
+
+
+def test_shares_add_up_to_the_total():
+    assert sorted(_shares(10, [1, 1, 1])) == [3, 3, 4]
+    assert _shares(7, [0, 2, 5]) == [0, 2, 5]
+    assert sum(_shares(101, [3, 5, 9, 1])) == 101
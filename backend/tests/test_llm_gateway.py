@@ -0,0 +1,165 @@
+from types import SimpleNamespace
+import asyncio
+import pytest
+from app.helpers import LLMGateway, LLMUnavailableError
+from app.helpers import llm_gateway
+from app.helpers.llm_gateway import CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_gateway.time, "monotonic", clock)
+    return clock
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failures=3, cooldown=30)
+    breaker.failure()
+    breaker.failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.opened == 1
+    assert breaker.retry_after() == 30
+
+
+def test_breaker_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failures=1, cooldown=30)
+    breaker.failure()
+    clock.now += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    # Only the probe, until it reports back
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker(failures=5, cooldown=30)
+    for _ in range(5):
+        breaker.failure()
+    clock.now += 31
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+
+
+def test_lost_probe_expires_after_a_cooldown(clock):
+    breaker = CircuitBreaker(failures=1, cooldown=30)
+    breaker.failure()
+    clock.now += 30
+    assert breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+class FlakyClient:
+    """Groq-like client whose failing models time out"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.models = []
+        self.streams = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model, messages, **kwargs):
+        self.models.append(model)
+        if model in self.failing:
+            raise asyncio.TimeoutError()
+        if kwargs.get("stream"):
+            stream = Stream(["a", "b", "c"])
+            self.streams.append(stream)
+            return stream
+        return SimpleNamespace(model=model, usage=None,
+                               choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))])
+
+
+class Stream:
+    def __init__(self, parts):
+        self.parts = parts
+        self.closed = False
+
+    async def _chunks(self):
+        for part in self.parts:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def close(self):
+        self.closed = True
+
+
+def gateway(client, **kwargs):
+    kwargs = dict(dict(fallback_model="small", timeout=1, deadline=3, max_retries=0, hedge=False), **kwargs)
+    return LLMGateway(client, **kwargs)
+
+
+def test_gateway_falls_back_and_skips_an_open_circuit():
+    client = FlakyClient(failing={"big"})
+    llm = gateway(client)
+    llm.breakers["big"] = CircuitBreaker(failures=1, cooldown=30)
+
+    async def run():
+        first = await llm.create("toxicity", "big", messages=[])
+        second = await llm.create("toxicity", "big", messages=[])
+        return first.model, second.model
+
+    assert asyncio.run(run()) == ("small", "small")
+    # The second call didn't try the model whose circuit is open
+    assert client.models == ["big", "small", "small"]
+    assert llm.stats()["fallbacks"] == 2
+    assert llm.stats()["circuits"]["big"]["state"] == "open"
+
+
+def test_gateway_raises_when_no_model_answers():
+    llm = gateway(FlakyClient(failing={"big", "small"}))
+    with pytest.raises(LLMUnavailableError) as error:
+        asyncio.run(llm.create("toxicity", "big", messages=[]))
+    assert error.value.retry_after >= 1
+    assert llm.failures == 1
+
+
+def test_stream_is_closed_when_the_consumer_stops_early():
+    client = FlakyClient()
+    llm = gateway(client)
+
+    async def run():
+        chunks = llm.stream("summary_stream", "big", messages=[])
+        async for _ in chunks:
+            break
+        await chunks.aclose()
+
+    asyncio.run(run())
+    assert client.streams[0].closed
+
+
+def test_stream_is_closed_when_fully_read():
+    client = FlakyClient()
+    llm = gateway(client)
+
+    async def run():
+        return [chunk.choices[0].delta.content async for chunk in llm.stream("summary_stream", "big", messages=[])]
+
+    assert asyncio.run(run()) == ["a", "b", "c"]
+    assert client.streams[0].closed
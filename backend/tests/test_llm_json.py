@@ -0,0 +1,86 @@
+import json
+import random
+import pytest
+from pydantic import ValidationError
+from app.helpers import JSONStream, repair_json, parse_answer, parse_packed
+
+ANSWER = {"t": 1, "c": 0.9, "k": ["A"], "s": "h", "w": [["idiot", "A", "m"]],
+          "r": "Says \"idiot\" \\ twice, {not} [json]"}
+
+
+def test_stream_reports_fields_as_they_complete():
+    stream = JSONStream()
+    assert stream.feed('```json\n{"t":') == []
+    assert stream.feed('1,"c":0.') == [("t", 1)]
+    assert stream.feed('9,"k":["A"') == [("c", 0.9)]
+    assert stream.feed(']}\n```') == [("k", ["A"])]
+    assert stream.done
+    assert stream.object_text() == '{"t":1,"c":0.9,"k":["A"]}'
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_stream_matches_json_loads_for_any_split(seed):
+    rng = random.Random(seed)
+    text = json.dumps(ANSWER, separators=(",", ":"))
+    stream = JSONStream()
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 6)
+        stream.feed(text[position:position + size])
+        position += size
+    assert stream.done
+    assert stream.fields == ANSWER
+
+
+def test_stream_handles_an_escape_split_across_pieces():
+    stream = JSONStream()
+    stream.feed('{"r":"a\\')
+    assert stream.feed('"b","t":0}') == [("r", 'a"b'), ("t", 0)]
+
+
+def test_repair_drops_prose_fences_and_trailing_commas():
+    assert json.loads(repair_json('Sure! ```json\n{"t":1,"k":["A",],}\n``` hope this helps')) == {"t": 1, "k": ["A"]}
+
+
+def test_repair_closes_a_cut_off_answer():
+    repaired = json.loads(repair_json('{"t":1,"c":0.9,"w":[["idiot","A","m"],["du'))
+    assert repaired["t"] == 1 and repaired["c"] == 0.9
+    assert repaired["w"][0] == ["idiot", "A", "m"]
+
+
+def test_repair_drops_a_member_cut_in_the_middle():
+    assert json.loads(repair_json('{"t":0,"c":0.8,"r":')) == {"t": 0, "c": 0.8}
+
+
+def test_repair_leaves_text_without_an_object_alone():
+    assert repair_json("no json here") == "no json here"
+
+
+def test_parse_answer_reads_compact_and_long_schemas():
+    compact, repaired = parse_answer(json.dumps(ANSWER))
+    assert not repaired
+    assert compact.is_toxic and compact.categories == ["harassment"] and compact.severity == "high"
+    assert compact.offensive_words == [{"word": "idiot", "category": "harassment", "severity": "medium"}]
+
+    long, _ = parse_answer('{"is_toxic": true, "confidence": 3, "overall_severity": "Medium"}')
+    assert long.severity == "medium"
+    assert long.confidence == 1.0
+
+
+def test_parse_answer_requires_a_verdict():
+    with pytest.raises(ValidationError):
+        parse_answer('{"c":0.9,"r":"no verdict"}')
+
+
+def test_parse_answer_repairs_a_truncated_answer():
+    answer, repaired = parse_answer('{"t":1,"c":0.7,"k":["T"],"r":"Threat of')
+    assert repaired
+    assert answer.is_toxic and answer.categories == ["threats"]
+
+
+def test_parse_packed_keeps_valid_entries_only():
+    content = '{"a":[{"i":0,"t":1},{"i":1,"c":0.5},{"i":7,"t":0},{"i":2,"t":0}]}'
+    answers, repaired = parse_packed(content, 3)
+    assert not repaired
+    assert sorted(answers) == [0, 2]
+    assert answers[0].is_toxic and not answers[2].is_toxic
@@ -0,0 +1,78 @@
+import asyncio
+import random
+import numpy as np
+import pytest
+from PIL import Image
+from app.agents import MainAgent
+from app.helpers import NearDuplicateIndex
+from app.helpers.perceptual_hash import BKTree, hamming, image_hash
+from tests.fakes import FakeOCRAgent, CountingBackend, fake_main_agent
+
+TOXIC_CAPTION = "go kill yourself you motherfucker"
+UNSAFE = {category: 5 for category in ("adult", "violence", "racy", "medical", "spoof")}
+
+
+def picture(seed: int = 0) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (64, 64, 3), dtype=np.uint8))
+
+
+def agent(index, ocr, backend) -> MainAgent:
+    return fake_main_agent(ocr, backend, near_duplicate_index=index)
+
+
+def test_bk_tree_finds_what_a_linear_scan_finds():
+    rng = random.Random(0)
+    keys = [rng.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for key in keys:
+        tree.add(key, key)
+    for query in keys[:50]:
+        query ^= 1 << rng.randrange(64)
+        found = sorted(value for _, _, value in tree.search(query, 6))
+        assert found == sorted(key for key in keys if hamming(key, query) <= 6)
+
+
+def test_index_drops_the_oldest_half_when_full():
+    index = NearDuplicateIndex(max_distance=0, max_entries=4, reuse="all")
+    for key in range(5):
+        index.add(key, {"is_toxic": False, "key": key})
+    assert index.stats()["entries"] == 3
+    assert index.lookup(1) is None
+    assert index.lookup(4)[1]["key"] == 4
+
+
+def test_safe_verdicts_are_only_reused_when_asked_for():
+    key = image_hash(picture())
+    for reuse, expected in (("unsafe", None), ("all", 1)):
+        index = NearDuplicateIndex(reuse=reuse)
+        index.add(key, {"is_toxic": False, "confidence": 0.9})
+        match = index.lookup(key ^ 1)
+        assert (match and match[0]) == expected
+
+
+def test_toxic_caption_is_not_indexed_for_the_template():
+    index = NearDuplicateIndex(reuse="all")
+    ocr, backend = FakeOCRAgent(TOXIC_CAPTION, "hello thanks"), CountingBackend()
+    main = agent(index, ocr, backend)
+
+    first = asyncio.run(main.analyze_image(picture(), mode="verdict"))
+    assert first["is_toxic"]
+    # The image alone was safe, and only that is kept
+    assert index.lookup(image_hash(picture()))[1]["is_toxic"] is False
+
+    # A copy of the template with a harmless caption skips Vision, not OCR
+    second = asyncio.run(main.analyze_image(picture(), content=b"other", mode="verdict"))
+    assert not second["is_toxic"]
+    assert (ocr.calls, backend.annotated) == (2, 1)
+
+
+def test_toxic_image_verdict_answers_near_copies():
+    index = NearDuplicateIndex()
+    ocr, backend = FakeOCRAgent(), CountingBackend(likelihoods=UNSAFE)
+    main = agent(index, ocr, backend)
+
+    assert asyncio.run(main.analyze_image(picture(), mode="verdict"))["is_toxic"]
+    result = asyncio.run(main.analyze_image(picture(), content=b"other", mode="full"))
+    assert result["is_toxic"] and result["summary"]
+    assert (ocr.calls, backend.annotated) == (1, 1)
@@ -0,0 +1,122 @@
+import asyncio
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from google.cloud import vision
+from app.agents import NSFWAgent, NSFWBackend, VisionBackend, OnnxBackend, FakeBackend
+from app.agents.nsfw_backends import score_to_likelihood
+
+LABELS = ["drawings", "hentai", "neutral", "porn", "sexy"]
+
+
+def jpeg(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class FakeVisionClient:
+    """Vision client rating every image VERY_LIKELY adult, with one failing image"""
+
+    def __init__(self):
+        self.requests = []
+
+    async def batch_annotate_images(self, requests):
+        self.requests.append(len(requests))
+        responses = []
+        for request in requests:
+            if request.image.content == b"broken":
+                responses.append(vision.AnnotateImageResponse(error={"message": "Bad image data"}))
+                continue
+            responses.append(vision.AnnotateImageResponse(
+                safe_search_annotation=vision.SafeSearchAnnotation(
+                    adult=5, violence=1, racy=2, medical=1, spoof=1),
+                localized_object_annotations=[vision.LocalizedObjectAnnotation(name="Person", score=0.9)]))
+        return vision.BatchAnnotateImagesResponse(responses=responses)
+
+
+def test_a_backend_must_implement_annotate_batch():
+    class Incomplete(NSFWBackend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_scores_map_to_vision_likelihoods():
+    assert [score_to_likelihood(score) for score in (0.0, 0.2, 0.4, 0.6, 0.95)] == [1, 2, 3, 4, 5]
+
+
+def test_images_in_flight_share_one_call():
+    async def run():
+        backend = FakeBackend(batch_size=16, batch_wait_ms=5)
+        results = await asyncio.gather(*(backend.annotate(jpeg("white")) for _ in range(5)))
+        return results, backend.stats()
+
+    results, stats = asyncio.run(run())
+    assert all(result.likelihoods["adult"] == 1 for result in results)
+    assert stats["calls"] == 1 and stats["images"] == 5
+
+
+def test_vision_batches_are_converted_per_image():
+    async def run():
+        client = FakeVisionClient()
+        agent = NSFWAgent(backend=VisionBackend(client, batch_wait_ms=5))
+        results = await asyncio.gather(agent.detect(jpeg("white")), agent.detect(b"broken"))
+        return client.requests, results
+
+    requests, (flagged, failed) = asyncio.run(run())
+    assert requests == [2]
+    assert flagged["is_toxic"] and flagged["flagged_categories"] == ["adult"]
+    assert flagged["confidence"] == 0.9 and flagged["visual_cues"] == ["Person"]
+    assert failed == {"error": "Bad image data"}
+
+
+def test_agent_reports_unknown_for_categories_a_backend_cant_rate():
+    backend = FakeBackend(likelihoods={"adult": 1, "racy": 4})
+    result = asyncio.run(NSFWAgent(backend=backend).detect(Image.new("RGB", (32, 32))))
+    assert result["flagged_categories"] == ["racy"]
+    assert result["details"]["violence"] == {"level": "UNKNOWN", "confidence": 0.0}
+
+
+@pytest.fixture
+def onnx_model(tmp_path):
+    onnx = pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from onnx import helper, TensorProto
+
+    # Mean colour of the image times a weight matrix, so white reads as "porn"
+    weights = np.zeros((3, len(LABELS)), np.float32)
+    weights[:, LABELS.index("porn")] = 3.0
+    graph = helper.make_graph(
+        [helper.make_node("GlobalAveragePool", ["input"], ["pooled"]),
+         helper.make_node("Flatten", ["pooled"], ["flat"]),
+         helper.make_node("MatMul", ["flat", "weights"], ["logits"])],
+        "nsfw", [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["n", 3, 16, 16])],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["n", len(LABELS)])],
+        [helper.make_tensor("weights", TensorProto.FLOAT, weights.shape, weights.ravel())])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    path = tmp_path / "nsfw.onnx"
+    onnx.save(model, str(path))
+    return str(path)
+
+
+def test_onnx_scores_become_category_likelihoods(onnx_model):
+    async def run():
+        backend = OnnxBackend(onnx_model, labels=",".join(LABELS), batch_wait_ms=5)
+        assert backend.input_size == (16, 16) and backend.channels_first
+        return await asyncio.gather(*(backend.annotate(content)
+                                      for content in (jpeg("white"), jpeg("black"), b"not an image")))
+
+    white, black, invalid = asyncio.run(run())
+    # Logits are turned into probabilities before mapping
+    assert white.likelihoods == {"adult": 5, "racy": 1}
+    assert black.likelihoods == {"adult": 2, "racy": 2}
+    assert invalid.error.startswith("Invalid image")
+
+
+def test_onnx_backend_needs_a_model():
+    with pytest.raises(EnvironmentError):
+        OnnxBackend(None)
@@ -0,0 +1,79 @@
+import asyncio
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from app.agents import OCRAgent
+from app.agents import ocr_agent as ocr_module
+from app.agents.ocr_agent import merge_tiles
+from app.helpers import detect_text_regions
+
+ROWS = ["FIRST LINE OF TEXT", "SECOND LINE HERE", "THIRD ROW OF WORDS"]
+
+
+def page(rows=ROWS, width: int = 800, spacing: int = 120) -> np.ndarray:
+    gray = np.full((spacing * (len(rows) + 1), width), 255, np.uint8)
+    for index, row in enumerate(rows):
+        cv2.putText(gray, row, (30, spacing * (index + 1)), cv2.FONT_HERSHEY_SIMPLEX, 1.5, 0, 3)
+    return gray
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setenv("TESSERACT_PATH", "/bin/true")
+    calls = []
+
+    def recognize(gray, *args):
+        calls.append(gray.shape)
+        return f"text {len(calls)}"
+
+    # Tiles and the fallback both go through the module level recognize
+    monkeypatch.setattr(ocr_module, "recognize", recognize)
+    agent = OCRAgent(mode="tiled", max_tiles=16)
+    agent.calls = calls
+    return agent
+
+
+def test_each_row_of_text_gets_a_tile_top_to_bottom():
+    gray = page()
+    regions = detect_text_regions(gray)
+    assert len(regions) == len(ROWS)
+    tops = [y for _, y, _, _ in regions]
+    assert tops == sorted(tops)
+    for (_, y, _, h), (_, below, _, _) in zip(regions, regions[1:]):
+        assert y + h <= below
+
+
+def test_rows_are_grouped_to_max_tiles():
+    regions = detect_text_regions(page(ROWS * 2), max_tiles=2)
+    assert len(regions) == 2
+
+
+def test_blank_image_has_no_regions():
+    assert detect_text_regions(np.full((200, 300), 255, np.uint8)) == []
+
+
+def test_tiled_agent_reads_only_the_regions(agent):
+    gray = page()
+    text = asyncio.run(agent.extract_text_async(Image.fromarray(gray)))
+    assert sorted(text.splitlines()) == ["text 1", "text 2", "text 3"]
+    assert all(shape[0] < gray.shape[0] for shape in agent.calls)
+    assert agent.stats() == {"mode": "tiled", "images": 1, "fallbacks": 0, "tiles": 3}
+
+
+def test_image_without_regions_falls_back_to_one_full_read(agent):
+    # Two glyphs are too few to be taken for a line of text
+    gray = np.full((200, 300), 255, np.uint8)
+    cv2.putText(gray, "ok", (100, 110), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+    image = Image.fromarray(gray)
+    assert detect_text_regions(gray) == []
+
+    assert asyncio.run(agent.extract_text_async(image)) == "text 1"
+    assert agent.extract_text(image) == "text 2"
+    assert agent.calls == [gray.shape, gray.shape]
+    assert agent.stats()["fallbacks"] == 2
+
+
+def test_failed_tiles_are_dropped_unless_all_failed():
+    assert merge_tiles(["top", "OCR Error: timeout", "bottom"]) == "top\nbottom"
+    assert merge_tiles(["OCR Error: timeout", "OCR Error: crash"]) == "OCR Error: timeout"
@@ -0,0 +1,55 @@
+import pytest
+from app.helpers import compact_text, estimate_tokens, split_chunks, truncate_tokens, TextTooLongError
+
+
+def words(count: int) -> str:
+    return " ".join(f"word{index}" for index in range(count))
+
+
+def test_estimate_counts_latin_and_other_scripts():
+    assert estimate_tokens("hi") == 1
+    assert estimate_tokens("moderation") == 3
+    # One per character of other scripts, on top of the one every word costs
+    assert estimate_tokens("日本語") == 4
+
+
+def test_compact_text_drops_debris_and_repeats():
+    text = "Hello   world\n~~~ ---\nhello WORLD\nno no no no no way"
+    assert compact_text(text) == "Hello world\nno no no way"
+
+
+def test_short_text_is_one_chunk():
+    assert split_chunks("just a few words", 512) == ["just a few words"]
+    assert split_chunks("   ", 512) == []
+
+
+def test_chunks_stay_in_budget_and_overlap():
+    chunks = split_chunks(words(400), 100, overlap_tokens=10)
+    assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+    # Consecutive chunks share their boundary words
+    for first, second in zip(chunks, chunks[1:]):
+        assert first.split()[-1] in second.split()
+    covered = {word for chunk in chunks for word in chunk.split()}
+    assert covered == set(words(400).split())
+
+
+def test_chunks_grow_rather_than_outnumber_max_chunks():
+    chunks = split_chunks(words(400), 100, overlap_tokens=10, max_chunks=4)
+    assert len(chunks) <= 4
+    assert {word for chunk in chunks for word in chunk.split()} == set(words(400).split())
+
+
+def test_chunks_never_grow_past_the_hard_cap():
+    text = words(400)
+    chunks = split_chunks(text, 100, overlap_tokens=10, max_chunks=4, max_chunk_tokens=400)
+    assert all(estimate_tokens(chunk) <= 400 for chunk in chunks)
+    with pytest.raises(TextTooLongError):
+        split_chunks(text, 100, overlap_tokens=10, max_chunks=4, max_chunk_tokens=200)
+
+
+def test_truncate_keeps_the_leading_words_in_budget():
+    text = words(400)
+    truncated = truncate_tokens(text, 100)
+    assert estimate_tokens(truncated) <= 100 < estimate_tokens(truncate_tokens(text, 110))
+    assert text.startswith(truncated)
+    assert truncate_tokens("a few words", 100) == "a few words"
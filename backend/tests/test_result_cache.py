@@ -0,0 +1,104 @@
+import asyncio
+from app.helpers import ResultCache, CACHE_STATUS
+from app.helpers.result_cache import MemoryCacheBackend, DiskCacheBackend
+
+
+def test_text_key_normalizes_unicode_and_whitespace():
+    fingerprint = ResultCache.fingerprint({"model": "a"})
+    assert ResultCache.text_key("ｈｅｌｌｏ   world\n", fingerprint) == ResultCache.text_key("hello world", fingerprint)
+    assert ResultCache.text_key("hello world", fingerprint) != ResultCache.text_key("hello  there", fingerprint)
+
+
+def test_keys_are_namespaced_by_fingerprint():
+    first = ResultCache.fingerprint({"model": "a", "thresholds": {"adult": 3}})
+    second = ResultCache.fingerprint({"thresholds": {"adult": 3}, "model": "a"})
+    changed = ResultCache.fingerprint({"model": "b", "thresholds": {"adult": 3}})
+    assert first == second
+    assert ResultCache.image_key(b"png", first) != ResultCache.image_key(b"png", changed)
+    assert ResultCache.text_key("hi", first).startswith("text:")
+    assert ResultCache.image_key(b"png", first).startswith("image:")
+
+
+def test_memory_backend_evicts_least_recently_used():
+    async def run():
+        backend = MemoryCacheBackend(max_entries=2, ttl=60)
+        await backend.set("a", {"v": 1})
+        await backend.set("b", {"v": 2})
+        # Reading "a" makes "b" the oldest
+        assert await backend.get("a") == {"v": 1}
+        await backend.set("c", {"v": 3})
+        return await backend.get("a"), await backend.get("b"), await backend.get("c"), len(backend)
+
+    assert asyncio.run(run()) == ({"v": 1}, None, {"v": 3}, 2)
+
+
+def test_memory_backend_expires_entries():
+    async def run():
+        backend = MemoryCacheBackend(max_entries=2, ttl=-1)
+        await backend.set("a", {"v": 1})
+        return await backend.get("a"), len(backend)
+
+    assert asyncio.run(run()) == (None, 0)
+
+
+def test_disk_backend_evicts_beyond_max_entries(tmp_path):
+    async def run():
+        backend = DiskCacheBackend(str(tmp_path / "cache.sqlite3"), max_entries=2, ttl=60)
+        try:
+            for index in range(3):
+                await backend.set(f"k{index}", {"v": index})
+                # accessed_at has a resolution of the clock, keep the order clear
+                await asyncio.sleep(0.01)
+            return [await backend.get(f"k{index}") for index in range(3)]
+        finally:
+            await backend.close()
+
+    assert asyncio.run(run()) == [None, {"v": 1}, {"v": 2}]
+
+
+def test_disk_backend_survives_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+
+    async def run():
+        backend = DiskCacheBackend(path, ttl=60)
+        await backend.set("k", {"is_toxic": True})
+        await backend.close()
+        reopened = DiskCacheBackend(path, ttl=60)
+        try:
+            return await reopened.get("k")
+        finally:
+            await reopened.close()
+
+    assert asyncio.run(run()) == {"is_toxic": True}
+
+
+def test_result_cache_counts_hits_and_sets_status():
+    async def run():
+        cache = ResultCache(MemoryCacheBackend())
+        statuses = []
+        await cache.get("k")
+        statuses.append(CACHE_STATUS.get())
+        await cache.set("k", {"is_toxic": False})
+        await cache.get("k")
+        statuses.append(CACHE_STATUS.get())
+        return statuses, cache.stats()
+
+    statuses, stats = asyncio.run(run())
+    assert statuses == ["MISS", "HIT"]
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_result_cache_treats_backend_errors_as_misses():
+    class BrokenBackend(MemoryCacheBackend):
+        async def get(self, key):
+            raise ConnectionError("down")
+
+        async def set(self, key, value):
+            raise ConnectionError("down")
+
+    async def run():
+        cache = ResultCache(BrokenBackend())
+        await cache.set("k", {"is_toxic": True})
+        return await cache.get("k"), cache.stats()["misses"]
+
+    assert asyncio.run(run()) == (None, 1)
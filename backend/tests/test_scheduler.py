@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+from app.helpers import Limiter, Scheduler, limited
+from app.helpers.scheduler import PRIORITIES, REQUEST_PRIORITY, QueueFullError, QueueTimeoutError
+
+
+def test_waiters_run_by_priority_then_arrival():
+    async def run():
+        limiter, order = Limiter("test", 1), []
+        await limiter.acquire()
+
+        async def wait(name, priority):
+            async with limiter.slot(priority):
+                order.append(name)
+
+        waiters = [asyncio.ensure_future(wait(name, priority))
+                   for name, priority in (("image1", 1), ("text1", 0), ("image2", 1), ("text2", 0))]
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*waiters)
+        return order, limiter.stats()
+
+    order, stats = asyncio.run(run())
+    assert order == ["text1", "text2", "image1", "image2"]
+    assert stats["in_flight"] == 0 and stats["admitted"] == 5
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def run():
+        limiter = Limiter("test", 1, max_queue=1)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError) as raised:
+            await limiter.acquire()
+        waiter.cancel()
+        return raised.value, limiter.stats()
+
+    error, stats = asyncio.run(run())
+    assert error.status_code == 429 and error.retry_after >= 1
+    assert stats["rejected"] == 1
+
+
+def test_waiting_too_long_times_out_and_leaves_the_queue():
+    async def run():
+        limiter = Limiter("test", 1, queue_timeout=0.01)
+        await limiter.acquire()
+        with pytest.raises(QueueTimeoutError):
+            await limiter.acquire()
+        return limiter.stats()
+
+    stats = asyncio.run(run())
+    assert stats["timed_out"] == 1 and stats["queued"] == 0
+
+
+def test_cancelled_waiter_passes_a_handed_over_slot_on():
+    async def run():
+        limiter = Limiter("test", 1)
+        await limiter.acquire()
+        first = asyncio.ensure_future(limiter.acquire())
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()
+        first.cancel()
+        await asyncio.sleep(0)
+        await second
+        return limiter.in_flight
+
+    assert asyncio.run(run()) == 1
+
+
+def test_admission_sets_the_priority_stages_use():
+    async def run():
+        scheduler = Scheduler(
+            {"text": Limiter("text", 1), "image": Limiter("image", 1)},
+            {name: Limiter(name, 1) for name in Scheduler.STAGES})
+        seen = {}
+        for kind in ("text", "image"):
+            async with scheduler.admit(kind):
+                seen[kind] = REQUEST_PRIORITY.get()
+                async with limited(scheduler.stage("groq")):
+                    pass
+        return seen, scheduler.stats()
+
+    seen, stats = asyncio.run(run())
+    assert seen == PRIORITIES
+    assert stats["lanes"]["text"]["admitted"] == stats["lanes"]["image"]["admitted"] == 1
+    assert stats["stages"]["groq"]["admitted"] == 2
+
+
+def test_lanes_are_limited_separately():
+    async def run():
+        scheduler = Scheduler(
+            {"text": Limiter("text", 1, max_queue=0), "image": Limiter("image", 1, max_queue=0)},
+            {name: Limiter(name, 1) for name in Scheduler.STAGES})
+        async with scheduler.admit("image"):
+            # A busy image lane doesn't hold up text
+            async with scheduler.admit("text"):
+                pass
+            with pytest.raises(QueueFullError):
+                async with scheduler.admit("image"):
+                    pass
+
+    asyncio.run(run())
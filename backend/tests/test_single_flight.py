@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from app.helpers import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    async def run():
+        flights, runs = SingleFlight("test"), []
+
+        async def work():
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return {"is_toxic": False}
+
+        results = await asyncio.gather(*(flights.do("k", work) for _ in range(5)))
+        return results, runs, flights.stats()
+
+    results, runs, stats = asyncio.run(run())
+    assert len(runs) == 1
+    assert [shared for _, shared in results] == [False, True, True, True, True]
+    assert stats == {"leaders": 1, "collapsed": 4, "in_flight": 0, "max_waiters": 5}
+
+
+def test_later_calls_start_a_fresh_run():
+    async def run():
+        flights, runs = SingleFlight("test"), []
+
+        async def work():
+            runs.append(1)
+            return len(runs)
+
+        return await flights.do("k", work), await flights.do("k", work)
+
+    assert asyncio.run(run()) == ((1, False), (2, False))
+
+
+def test_every_waiter_gets_the_exception():
+    async def run():
+        flights = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        return await asyncio.gather(*(flights.do("k", work) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+
+
+def test_one_cancelled_waiter_leaves_the_run_to_the_others():
+    async def run():
+        flights = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        first = asyncio.ensure_future(flights.do("k", work))
+        second = asyncio.ensure_future(flights.do("k", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == ("done", True)
+
+
+def test_run_is_cancelled_once_nobody_waits():
+    async def run():
+        flights, cancelled = SingleFlight("test"), []
+
+        async def work():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        waiter = asyncio.ensure_future(flights.do("k", work))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+        return cancelled, flights.stats()["in_flight"]
+
+    assert asyncio.run(run()) == ([True], 0)
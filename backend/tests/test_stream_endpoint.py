@@ -0,0 +1,55 @@
+import io
+import json
+from PIL import Image
+from tests.fakes import FakeOCRAgent, fake_main_agent
+
+
+def events(response) -> list:
+    parsed = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        parsed.append((fields["event"], json.loads(fields["data"])))
+    return parsed
+
+
+def png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_text_stream_ends_with_the_summary_it_streamed(serve):
+    response = serve(fake_main_agent()).post("/moderate/stream", data={"text": "hello thanks", "mode": "full"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    stream = events(response)
+    names = [name for name, _ in stream]
+    assert names.index("toxicity") < names.index("verdict") < names.index("summary") < names.index("done")
+    assert names[-1] == "done"
+    streamed = "".join(data["delta"] for name, data in stream if name == "summary")
+    result = stream[-1][1]["result"]
+    assert result["summary"] == streamed == "The content appears safe for most audiences."
+
+
+def test_image_stream_reports_each_stage(serve):
+    client = serve(fake_main_agent(FakeOCRAgent("hello thanks")))
+    response = client.post("/moderate/stream", data={"mode": "verdict"},
+                           files={"image": ("a.png", png(), "image/png")})
+    names = [name for name, _ in events(response)]
+    assert {"nsfw", "ocr"} <= set(names[:2])
+    assert names[2:] == ["toxicity", "verdict", "done"]
+
+
+def test_failed_analysis_ends_with_an_error_event(serve):
+    client = serve(fake_main_agent(FakeOCRAgent("OCR Error: crashed")))
+    response = client.post("/moderate/stream", files={"image": ("a.png", png(), "image/png")})
+    assert response.status_code == 200
+    assert events(response)[-1] == ("error", {"detail": "Content analysis failed"})
+
+
+def test_bad_requests_are_refused_before_streaming(serve):
+    client = serve(fake_main_agent())
+    assert client.post("/moderate/stream", data={}).status_code == 400
+    assert client.post("/moderate/stream", data={"text": "hi", "mode": "poem"}).status_code == 400
+    long_text = " ".join(f"word{index}" for index in range(10000))
+    assert client.post("/moderate/stream", data={"text": long_text}).status_code == 413
@@ -0,0 +1,38 @@
+import pytest
+from app.helpers import TextPreClassifier
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return TextPreClassifier()
+
+
+@pytest.mark.parametrize("text", [
+    "kys",
+    "go kill yourself",
+    "don't kill yourself over this exam",
+    "he said kill yourself you motherfucker",
+    'she wrote "kill yourself, fuck you" on my wall',
+    "Never say kys, fuck you is bad enough",
+])
+def test_single_negated_or_quoted_matches_go_to_the_llm(classifier, text):
+    assert classifier.classify(text) is None
+
+
+@pytest.mark.parametrize("text", [
+    "go kill yourself you motherfucker",
+    "fuck you, i know where you live",
+])
+def test_several_separate_terms_resolve_locally(classifier, text):
+    result = classifier.classify(text)
+    assert result["is_toxic"] and result["model"] == "local-lexicon"
+    assert result["severity"] == "high"
+
+
+def test_short_benign_and_empty_texts_resolve_locally(classifier):
+    assert classifier.classify("hello thanks")["is_toxic"] is False
+    assert classifier.classify("1234 !!")["model"] == "local-rules"
+
+
+def test_medium_and_low_terms_go_to_the_llm(classifier):
+    assert classifier.classify("you idiot, what a bastard") is None
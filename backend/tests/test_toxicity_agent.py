@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+from PIL import Image
+from app.agents import ToxicityAgent
+from app.agents.toxicity_agent import MAX_TEXT_TOKENS
+from app.helpers import TextTooLongError, estimate_tokens
+from tests.fakes import FakeGroq, FakeOCRAgent, fake_main_agent
+
+
+def long_text() -> str:
+    return " ".join(f"line{index} says nothing much" for index in range(MAX_TEXT_TOKENS))
+
+
+def test_submitted_text_over_the_budget_is_rejected():
+    agent = ToxicityAgent(client=FakeGroq())
+    with pytest.raises(TextTooLongError):
+        ToxicityAgent.check_length(long_text())
+    with pytest.raises(TextTooLongError):
+        asyncio.run(agent.analyze(long_text()))
+
+
+def test_ocr_text_over_the_budget_is_analyzed_in_part():
+    groq = FakeGroq()
+    result = asyncio.run(ToxicityAgent(client=groq).analyze(long_text(), truncate=True))
+    assert result["partial"] and not result["is_toxic"]
+    assert 0 < len(groq.prompts) <= 8
+
+
+def test_length_is_measured_after_compacting():
+    # Repeated lines are dropped before analysis, so they don't count
+    text = "\n".join(["the same line again"] * MAX_TEXT_TOKENS)
+    assert estimate_tokens(text) > MAX_TEXT_TOKENS
+    ToxicityAgent.check_length(text)
+    result = asyncio.run(ToxicityAgent(client=FakeGroq()).analyze(text))
+    assert "partial" not in result
+
+
+def test_dense_image_text_gives_a_partial_result():
+    main = fake_main_agent(FakeOCRAgent(long_text()))
+    image = Image.new("RGB", (64, 64), "white")
+    result = asyncio.run(main.analyze_image(image, mode="verdict"))
+    assert result["partial"] and not result["is_toxic"]